@@ -1,11 +1,16 @@
 import argparse
 import functools
 from pathlib import Path
+from typing import List
 import sys
+import codecs
 import configparser
+import json
 import traceback
-import gcgen.generate as gen
-from gcgen.log import loggers_set_log_level, LogLevel, get_logger
+import gcgen.daemon as daemon
+from gcgen.project import find_project_root
+from gcgen.durability import Durability, MODES as DURABILITY_MODES
+from gcgen.log import loggers_set_log_level, LogLevel, get_logger, log_to_file
 from gcgen.excbase import GcgenError
 
 
@@ -15,6 +20,20 @@ cliparse = argparse.ArgumentParser(
     description="generate output into snippets embedded in files or create files from scratch with generators"
 )
 
+cliparse.add_argument(
+    "command",
+    nargs="?",
+    choices=["run", "serve", "regen", "stop"],
+    default="run",
+    help="run: regenerate the project (default), serve: start daemon keeping the project loaded, regen: have the daemon regenerate PATHS, stop: stop the daemon",
+)
+cliparse.add_argument(
+    "paths",
+    nargs="*",
+    metavar="PATHS",
+    help="(regen) files or directories to regenerate, all if none are given",
+)
+
 cliparse.add_argument(
     "-p",
     "--project",
@@ -38,6 +57,14 @@ cliparse.add_argument(
     help="output log to file",
 )
 
+cliparse.add_argument(
+    "--log-format",
+    action="store",
+    dest="log_format",
+    choices=["text", "json"],
+    help="format of log file output, `json` writes one JSON object per line (default: text)",
+)
+
 cliparse.add_argument(
     "--tag-start", action="store", dest="tag_start", help="set start tag (`<<?`)"
 )
@@ -45,6 +72,80 @@ cliparse.add_argument(
     "--tag-end", action="store", dest="tag_end", help="set end tag (`?>>`)"
 )
 
+cliparse.add_argument(
+    "--index",
+    action="store_true",
+    dest="use_index",
+    help="maintain an index of snippet calls in `.gcgen/index.json`, skipping files without snippets",
+)
+cliparse.add_argument(
+    "--incremental",
+    action="store_true",
+    dest="incremental",
+    help="only re-run snippet calls whose inputs changed since the last run, see `.gcgen/manifest.json`",
+)
+cliparse.add_argument(
+    "--segments",
+    action="store_true",
+    dest="use_segments",
+    help="keep models of where snippets are in parsed files in `.gcgen/segments.json`, re-splicing unchanged files without scanning them",
+)
+cliparse.add_argument(
+    "--cache",
+    action="store_true",
+    dest="use_cache",
+    help="store snippet output in the output cache (see `[cache]` in `gcgen_project.ini`), reusing it for snippet calls with unchanged inputs",
+)
+cliparse.add_argument(
+    "--cache-dir",
+    action="store",
+    dest="cache_dir",
+    metavar="DIR",
+    help="use output cache in directory DIR (implies --cache)",
+)
+cliparse.add_argument(
+    "--durability",
+    action="store",
+    dest="durability",
+    choices=list(DURABILITY_MODES),
+    help="when to sync written files to disk (see `[write]` in `gcgen_project.ini`)",
+)
+cliparse.add_argument(
+    "--transactional",
+    action="store_true",
+    dest="transactional",
+    help="only put written files in place once the whole run succeeded (see `[write]` in `gcgen_project.ini`)",
+)
+cliparse.add_argument(
+    "--profile-memory",
+    action="store_true",
+    dest="profile_memory",
+    help="measure memory allocated by each snippet and generator call, print a report and write it to `.gcgen/memory-profile.json`",
+)
+cliparse.add_argument(
+    "--profile-memory-sites",
+    action="store",
+    type=int,
+    default=0,
+    dest="profile_memory_sites",
+    metavar="N",
+    help="with --profile-memory, also record the N source lines allocating the most memory in each call (slow)",
+)
+cliparse.add_argument(
+    "--find-callers",
+    action="store",
+    dest="find_callers",
+    metavar="SNIPPET",
+    help="list all calls to snippet SNIPPET (using and updating the index), then exit",
+)
+
+
+def _lines(value: str) -> List[str]:
+    return [line.strip() for line in value.splitlines() if line.strip()]
+
+
+NEWLINES = {"lf": "\n", "crlf": "\r\n"}
+
 
 def pp_error(f):
     """catch and pretty-print GcgenError's which have a pretty-print function."""
@@ -68,7 +169,7 @@ def main():
     print("See documentation at: https://jwdevantier.github.io/gcgen")
     args = cliparse.parse_args()
     if args.project_root is None:
-        project_root = gen.find_project_root(Path.cwd())
+        project_root = find_project_root(Path.cwd())
     else:
         project_root = Path(args.project_root)
         if not project_root.exists():
@@ -78,13 +179,55 @@ def main():
             print(f"Invalid project root: {project_root!s} not a directory")
             sys.exit(1)
 
+    # compile changes the working directory, so relative paths must be avoided
+    project_root = project_root.resolve()
+
+    if args.command == "regen":
+        # thin client, the daemon has the project loaded and configured
+        paths = [Path(p) for p in args.paths]
+        if not daemon.regen(daemon.socket_path(project_root), paths):
+            sys.exit(1)
+        return
+    elif args.command == "stop":
+        daemon.stop(daemon.socket_path(project_root))
+        return
+    elif args.paths:
+        print(f"Unexpected arguments: {' '.join(args.paths)}")
+        sys.exit(1)
+
+    # imported only now, the client above must start fast
+    import gcgen.generate as gen
+    from gcgen.snippetindex import SnippetIndex
+    from gcgen.incremental import Incremental
+    from gcgen.outputcache import OutputCache
+    from gcgen.segments import SegmentStore
+    from gcgen.profiling import MemoryProfiler
+    from gcgen.limits import Limits, RunLimits, Watchdog
+    from gcgen.emitter import EmitterConfig, Section
+
     # read config
     conf_file = project_root / "gcgen_project.ini"
     config = configparser.ConfigParser()
     config.read_dict(
         {
             "parse": {"tag_start": "<<?", "tag_end": "?>>"},
-            "log": {"level": "warning"},
+            "log": {"level": "warning", "format": "text"},
+            "run": {"max_concurrency": "8"},
+            "cache": {"enabled": "no", "dir": ".gcgen/cache", "max_size_mb": "256"},
+            "emit": {
+                "newline": "lf",
+                "trim_trailing_whitespace": "no",
+                "encoding": "utf-8",
+            },
+            "write": {"durability": "none", "transactional": "no"},
+            "limits": {
+                "snippet_timeout": "0",
+                "snippet_max_memory_mb": "0",
+                "snippet_max_output_lines": "0",
+                "snippet_max_output_chars": "0",
+                "generator_timeout": "0",
+                "generator_max_memory_mb": "0",
+            },
         }
     )
     if conf_file.exists():
@@ -94,25 +237,251 @@ def main():
         if not config.has_section("log"):
             config.add_section("log")
         config.set("log", "level", args.log_level)
+    if args.log_file:
+        config.set("log", "file", str(Path(args.log_file).resolve()))
+    if args.log_format:
+        config.set("log", "format", args.log_format)
 
     level = config.get("log", "level", fallback="warning")
     try:
-        loggers_set_log_level(LogLevel[level.upper()])
+        log_level = LogLevel[level.upper()]
     except KeyError:
         print(
             f"Invalid log-level {level!r}, valid are: debug/info/warning/error/critical"
         )
         sys.exit(1)
+    loggers_set_log_level(log_level)
+    # validate input to the trusted (unchecked) section methods when debugging
+    Section.debug = log_level.value <= LogLevel.DEBUG.value
+    log_format = config.get("log", "format")
+    if log_format not in ("text", "json"):
+        print(f"Invalid log format {log_format!r}, valid are: text/json")
+        sys.exit(1)
+    log_file = config.get("log", "file", fallback=None)
+    if log_file:
+        log_to_file(project_root / log_file, json_format=log_format == "json")
+
     tag_start = config.get("parse", "tag_start")
     tag_end = config.get("parse", "tag_end")
-    if level == "debug":
-        logger.debug(f"Tag start: `{tag_start}`")
-        logger.debug(f"Tag end: `{tag_end}`")
+    # per file type tags, multiple pairs are given as multi-line values
+    tags_by_suffix = {}
+    for section in config.sections():
+        if not section.startswith("parse."):
+            continue
+        # raw, tags are taken literally (no `%` interpolation)
+        starts = _lines(config.get(section, "tag_start", raw=True, fallback=""))
+        ends = _lines(config.get(section, "tag_end", raw=True, fallback=""))
+        if not starts or len(starts) != len(ends):
+            print(
+                f"Invalid {section}, tag_start and tag_end must list the same number of tags"
+            )
+            sys.exit(1)
+        pairs = list(zip(starts, ends))
+        if len(set(starts)) != len(starts):
+            print(f"Invalid {section}, tag_start lists the same tag more than once")
+            sys.exit(1)
+        tags_by_suffix[section[len("parse.") :]] = pairs
+    logger.debug("Tag start: `%s`", tag_start)
+    logger.debug("Tag end: `%s`", tag_end)
 
     # ensure python code in the top-level directory of the project can be imported for use in snippets & generators
     sys.path.insert(1, str(project_root.resolve()))
 
-    gen.compile(project_root, tag_start=tag_start, tag_end=tag_end)
+    try:
+        max_concurrency = config.getint("run", "max_concurrency")
+        if max_concurrency < 1:
+            raise ValueError
+    except ValueError:
+        print("Invalid run.max_concurrency, must be an integer of 1 or greater")
+        sys.exit(1)
+
+    emit_configs = {}
+    for section in ["emit", *(s for s in config.sections() if s.startswith("emit."))]:
+        ext = section[len("emit.") :]
+        newline = config.get(section, "newline", fallback=config.get("emit", "newline"))
+        if newline not in NEWLINES:
+            print(f"Invalid {section}.newline {newline!r}, valid are: lf/crlf")
+            sys.exit(1)
+        try:
+            trim = config.getboolean(
+                section,
+                "trim_trailing_whitespace",
+                fallback=config.getboolean("emit", "trim_trailing_whitespace"),
+            )
+        except ValueError:
+            print(
+                f"Invalid {section}.trim_trailing_whitespace, must be a boolean (yes/no)"
+            )
+            sys.exit(1)
+        encoding = config.get(
+            section, "encoding", fallback=config.get("emit", "encoding")
+        )
+        try:
+            codecs.lookup(encoding)
+        except LookupError:
+            print(f"Invalid {section}.encoding {encoding!r}, unknown encoding")
+            sys.exit(1)
+        # indentation is set by `gcgen_indent_by` in `gcgen_conf.py` files
+        emit_configs[ext] = EmitterConfig(
+            indent_by=None,
+            newline=NEWLINES[newline],
+            trim_trailing_ws=trim,
+            encoding=encoding,
+        )
+
+    if args.durability:
+        config.set("write", "durability", args.durability)
+    durability_mode = config.get("write", "durability")
+    if durability_mode not in DURABILITY_MODES:
+        print(
+            f"Invalid write.durability {durability_mode!r}, valid are: {'/'.join(DURABILITY_MODES)}"
+        )
+        sys.exit(1)
+    durability = Durability(durability_mode)
+    if args.transactional:
+        config.set("write", "transactional", "yes")
+    try:
+        transactional = config.getboolean("write", "transactional")
+    except ValueError:
+        print("Invalid write.transactional, must be a boolean (yes/no)")
+        sys.exit(1)
+
+    # 0 means no limit
+    limit_values = {}
+    for key in config.options("limits"):
+        try:
+            limit_values[key] = config.getfloat("limits", key)
+            if limit_values[key] < 0:
+                raise ValueError
+        except ValueError:
+            print(f"Invalid limits.{key}, must be a number of 0 or greater")
+            sys.exit(1)
+    limits = RunLimits(
+        snippet=Limits(
+            limit_values["snippet_timeout"] or None,
+            int(limit_values["snippet_max_memory_mb"] * 1024 * 1024) or None,
+            int(limit_values["snippet_max_output_lines"]) or None,
+            int(limit_values["snippet_max_output_chars"]) or None,
+        ),
+        generator=Limits(
+            limit_values["generator_timeout"] or None,
+            int(limit_values["generator_max_memory_mb"] * 1024 * 1024) or None,
+        ),
+        # the daemon serves requests on the main thread, which a Ctrl-C like
+        # interrupt must not reach.
+        watchdog=Watchdog(escalate=args.command != "serve"),
+    )
+
+    index = None
+    index_path = project_root / ".gcgen" / "index.json"
+    tags = json.dumps([[tag_start, tag_end], sorted(tags_by_suffix.items())])
+    if args.use_index or args.find_callers:
+        index = SnippetIndex.load(project_root, index_path, tags)
+
+    if args.find_callers:
+        gen.build_index(
+            project_root,
+            tag_start=tag_start,
+            tag_end=tag_end,
+            index=index,
+            tags_by_suffix=tags_by_suffix,
+        )
+        index.save(index_path)
+        for fpath, line in index.callers(args.find_callers):
+            print(f"{fpath}:{line}")
+        return
+
+    incremental = None
+    manifest_path = project_root / ".gcgen" / "manifest.json"
+    if args.incremental:
+        incremental = Incremental.load(project_root, manifest_path)
+
+    segments = None
+    segments_path = project_root / ".gcgen" / "segments.json"
+    if args.use_segments:
+        segments = SegmentStore.load(project_root, segments_path, tags)
+
+    if args.use_cache:
+        config.set("cache", "enabled", "yes")
+    if args.cache_dir:
+        config.set("cache", "enabled", "yes")
+        config.set("cache", "dir", str(Path(args.cache_dir).resolve()))
+    cache = None
+    try:
+        use_cache = config.getboolean("cache", "enabled")
+    except ValueError:
+        print("Invalid cache.enabled, must be a boolean (yes/no)")
+        sys.exit(1)
+    if use_cache:
+        try:
+            max_size_mb = config.getint("cache", "max_size_mb")
+            if max_size_mb < 0:
+                raise ValueError
+        except ValueError:
+            print("Invalid cache.max_size_mb, must be an integer of 0 or greater")
+            sys.exit(1)
+        # relative paths are relative to the project root
+        cache_dir = project_root / Path(config.get("cache", "dir")).expanduser()
+        cache = OutputCache(cache_dir, max_size=max_size_mb * 1024 * 1024)
+
+    profiler = (
+        MemoryProfiler(top=args.profile_memory_sites) if args.profile_memory else None
+    )
+    profile_path = project_root / ".gcgen" / "memory-profile.json"
+
+    def after_run():
+        if profiler is not None:
+            print(profiler.report())
+            profiler.save(profile_path)
+            profiler.reset()
+        if index is not None:
+            index.save(index_path)
+        if segments is not None:
+            segments.save(segments_path)
+        if incremental is not None:
+            incremental.save(manifest_path)
+            logger.info(
+                "%d snippet calls run, %d unchanged",
+                incremental.ran,
+                incremental.skipped,
+                extra={
+                    "event": "incremental",
+                    "ran": incremental.ran,
+                    "skipped": incremental.skipped,
+                },
+            )
+            incremental.ran = incremental.skipped = 0
+        if cache is not None:
+            logger.info(
+                "output cache: %d hits, %d misses",
+                cache.hits,
+                cache.misses,
+                extra={"event": "cache", "hits": cache.hits, "misses": cache.misses},
+            )
+            cache.hits = cache.misses = 0
+
+    run_opts = dict(
+        tag_start=tag_start,
+        tag_end=tag_end,
+        max_concurrency=max_concurrency,
+        index=index,
+        incremental=incremental,
+        cache=cache,
+        emit_configs=emit_configs,
+        tags_by_suffix=tags_by_suffix,
+        segments=segments,
+        durability=durability,
+        transactional=transactional,
+        profiler=profiler,
+        limits=limits,
+    )
+    if args.command == "serve":
+        project = daemon.Project(project_root, after_run=after_run, **run_opts)
+        daemon.serve(project, daemon.socket_path(project_root))
+        return
+
+    gen.compile(project_root, **run_opts)
+    after_run()
 
 
 if __name__ == "__main__":
@@ -1,9 +1,10 @@
 from gcgen.scope import Scope
-from gcgen.emitter import Section
+from gcgen.emitter import Section, Template
 from gcgen.decorators import snippet, generator
 from gcgen.api.snippets_helpers import get_snippet, SnippetFn
 from gcgen.api.write_file import write_file
 from gcgen.api.types import Json
+from gcgen.api.models import load_model
 from gcgen.api.tree import *
 
 
@@ -11,15 +12,20 @@ __all__ = [
     "Scope",
     "SnippetFn",
     "Section",
+    "Template",
     "snippet",
     "generator",
     "get_snippet",
     "write_file",
     "Json",
+    "load_model",
     "TreeOp",
     "on_visit",
     "on_transform",
     "NodeVisitor",
     "NodeTransformer",
+    "on_hash",
+    "NodeHashError",
+    "MemoNodeTransformer",
     "parse_tree",
 ]
@@ -0,0 +1,169 @@
+import hashlib
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+from gcgen.fingerprint import Fingerprinter, UnhashableError
+
+
+Loader = Callable[[Path], Any]
+
+
+def _loader_name(loader: Loader) -> str:
+    module = getattr(loader, "__module__", "")
+    return f"{module}.{getattr(loader, '__qualname__', repr(loader))}"
+
+
+class ModelCache:
+    """Cache of input models, loaded at most once per run.
+
+    Models are keyed by the (resolved) path of the input file and the
+    fingerprint of the loader used to parse it (see `gcgen.fingerprint`), such
+    that equivalent loaders defined by different `gcgen_conf.py` files share
+    models, and persisted models are not reused once the loader changed.
+    Cached models are reused for as long as the file's modification time and
+    size are unchanged.
+
+    Args:
+        cache_dir: directory in which to persist models loaded with
+            `persist=True`. If None, models are only cached in memory.
+        root: project root, loaders use the project modules below it (defaults
+            to the current working directory).
+    """
+
+    def __init__(self, cache_dir: Optional[Path] = None, root: Optional[Path] = None):
+        self.cache_dir = cache_dir
+        self.root = root if root is not None else Path.cwd()
+        self._models: Dict[Tuple[str, str], Tuple[int, int, Any]] = {}
+        # id => (loader, fingerprint), keeps the loader alive so its id is not reused
+        self._loaders: Dict[int, Tuple[Loader, Optional[str]]] = {}
+
+    def _fingerprint(self, loader: Loader) -> Optional[str]:
+        """Fingerprint of `loader`, None if it cannot be fingerprinted."""
+        entry = self._loaders.get(id(loader))
+        if entry is None:
+            try:
+                # loaders are fingerprinted once, project modules may have
+                # changed since another loader was.
+                fp: Optional[str] = Fingerprinter(self.root).function(loader)
+            except UnhashableError:
+                fp = None
+            entry = self._loaders[id(loader)] = (loader, fp)
+        return entry[1]
+
+    def load(
+        self, path: Union[Path, str], loader: Loader, persist: bool = False
+    ) -> Any:
+        """Load model from `path` using `loader`, unless already cached.
+
+        Args:
+            path: path to the input file.
+            loader: function taking the path and returning the parsed model.
+            persist: if true, also store the model (which must be picklable)
+                on disk, such that subsequent runs can skip calling `loader`
+                for as long as the input file is unchanged.
+
+        Returns:
+            The model, as returned by `loader`.
+        """
+        path = Path(path).resolve()
+        st = path.stat()
+        fp = self._fingerprint(loader)
+        key = (str(path), fp if fp is not None else f"{id(loader)}")
+        entry = self._models.get(key)
+        if entry is not None and entry[:2] == (st.st_mtime_ns, st.st_size):
+            return entry[2]
+
+        cache_file = None
+        if persist and self.cache_dir is not None:
+            # e.g. builtin functions, which do not change between runs
+            loader_key = fp if fp is not None else _loader_name(loader)
+            digest = hashlib.sha1(f"{path}\0{loader_key}".encode("utf-8"))
+            cache_file = self.cache_dir / f"{digest.hexdigest()}.pickle"
+            model = self._read(cache_file, st.st_mtime_ns, st.st_size)
+            if model is not _MISS:
+                self._models[key] = (st.st_mtime_ns, st.st_size, model)
+                return model
+
+        model = loader(path)
+        self._models[key] = (st.st_mtime_ns, st.st_size, model)
+        if cache_file is not None:
+            self._write(cache_file, st.st_mtime_ns, st.st_size, model)
+        return model
+
+    @staticmethod
+    def _read(cache_file: Path, mtime_ns: int, size: int) -> Any:
+        try:
+            with open(cache_file, "rb") as fh:
+                c_mtime_ns, c_size, model = pickle.load(fh)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, AttributeError):
+            return _MISS
+        if c_mtime_ns != mtime_ns or c_size != size:
+            return _MISS
+        return model
+
+    @staticmethod
+    def _write(cache_file: Path, mtime_ns: int, size: int, model: Any) -> None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "wb", dir=cache_file.parent, delete=False
+        ) as fh:
+            try:
+                pickle.dump((mtime_ns, size, model), fh)
+            except Exception:
+                fh.close()
+                Path(fh.name).unlink()
+                raise
+        os.replace(fh.name, cache_file)
+
+    def clear(self) -> None:
+        """Discard all models cached in memory."""
+        self._models.clear()
+        self._loaders.clear()
+
+
+_MISS = object()
+_cache: Optional[ModelCache] = None
+
+
+def get_model_cache() -> ModelCache:
+    """Get model cache of current run (or a default in-memory cache if none is active)."""
+    global _cache
+    if _cache is None:
+        _cache = ModelCache()
+    return _cache
+
+
+def set_model_cache(cache: Optional[ModelCache]) -> Optional[ModelCache]:
+    """Install `cache` as the active model cache, returning the previous one."""
+    global _cache
+    prev, _cache = _cache, cache
+    return prev
+
+
+def load_model(path: Union[Path, str], loader: Loader, persist: bool = False) -> Any:
+    """Load input model from `path`, parsing it at most once per run.
+
+    Use this to share (large) input models, such as a JSON or YAML schema,
+    between all generators and snippets of the project, rather than parsing
+    the file again in each `gcgen_conf.py` file which uses it.
+    The model cache of the run is also available as `scope["$models"]`.
+
+    NOTE: models are shared, do not modify them.
+    NOTE: relative paths are resolved relative to the current working directory,
+      prefer paths relative to the `gcgen_conf.py` file, e.g.
+      `Path(__file__).parent / "schema.json"`.
+
+    Args:
+        path: path to the input file.
+        loader: function taking the path and returning the parsed model.
+        persist: if true, also store the (picklable) model in the project's
+            `.gcgen/models` directory, for subsequent runs to reuse for as long
+            as the input file is unchanged.
+
+    Returns:
+        The model, as returned by `loader`.
+    """
+    return get_model_cache().load(path, loader, persist=persist)
@@ -18,8 +18,15 @@ deriving from the `NodeTransformer` class.
 
 See tests for examples of use.
 """
+import dataclasses
 import functools
-from typing import Any, Union, List
+import hashlib
+import os
+import pickle
+import tempfile
+from enum import Enum
+from pathlib import Path
+from typing import Any, Dict, Optional, Union, List
 
 
 TreeOp = Union["NodeVisitor", "NodeTransformer"]
@@ -46,6 +53,10 @@ class OnTransform(OnDispatch):
     ...
 
 
+class OnHash(OnDispatch):
+    ...
+
+
 def on_visit(node_type, *node_types):
     """Mark method as handler for visits of nodes of type `node_type` or in `node_types`.
 
@@ -319,6 +330,242 @@ class NodeTransformer(metaclass=NodeTransformerMeta):
         return m(self, node)
 
 
+def on_hash(node_type, *node_types):
+    """Mark method as the structural hash function for nodes of type `node_type` or in `node_types`.
+
+    Use this decorator on methods in a `MemoNodeTransformer` class to describe
+    how to hash nodes of types which the transformer cannot hash on its own
+    (i.e. anything which is not a dataclass, enum, primitive or a built-in
+    container of those).
+    The method takes 1 argument, `node`, and should return the data identifying
+    the node, e.g. a tuple of its fields. The returned value is itself hashed
+    structurally, so it may contain other nodes.
+
+    Args:
+        node_type: node_type for which this handler should be used
+        *node_types: (optional) additional node_types for which to use this handler
+
+    Returns:
+        A decorated handler object.
+    """
+
+    def decorator(f):
+        if isinstance(f, OnHash):
+            wrapper = f
+            wrapper.node_types.append(node_type)
+        else:
+            wrapper = OnHash(node_type, f)
+            functools.update_wrapper(wrapper, f)
+
+        for nt in node_types:
+            wrapper.node_types.append(nt)
+
+        return wrapper
+
+    return decorator
+
+
+class NodeHashError(TypeError):
+    def __init__(self, node: Any):
+        self.node = node
+        super().__init__(f"cannot hash node of type {type(node).__qualname__}")
+
+
+class MemoNodeTransformerMeta(NodeTransformerMeta):
+    def __new__(cls, name, bases, dct):
+        typ = super().__new__(cls, name, bases, dct)
+
+        base_handlers = (getattr(b, "__hashers", {}) for b in bases)
+        hashers = {}
+
+        for bh in base_handlers:
+            hashers.update(bh)
+
+        for val in dct.values():
+            if not isinstance(val, OnHash):
+                continue
+            for node_type in val.node_types:
+                hashers[node_type] = val
+
+        setattr(typ, "__hashers", hashers)
+
+        return typ
+
+    def __call__(cls, *args, **kwargs):
+        obj = super().__call__(*args, **kwargs)
+
+        for ident, val in {ident: getattr(obj, ident) for ident in dir(obj)}.items():
+            if isinstance(val, OnHash):
+                setattr(obj, ident, val.method.__get__(obj))
+
+        return obj
+
+
+_PRIMITIVES = (type(None), bool, int, float, complex, str, bytes)
+
+
+class MemoNodeTransformer(NodeTransformer, metaclass=MemoNodeTransformerMeta):
+    """Transformer which memoizes the result of transforming each subtree.
+
+    A drop-in base class for `NodeTransformer` implementations whose handlers
+    are pure functions of the node they are given. Each call to `transform`
+    is keyed by a structural hash of the node, such that transforming a
+    subtree which is structurally identical to one transformed before returns
+    the earlier result rather than calling the handler again.
+
+    The memo table can be persisted to disk using `save_memo` and restored
+    using `load_memo`, allowing a subsequent run to only re-transform those
+    subtrees which changed in the meantime.
+
+    Note:
+        * dataclasses, enums, primitive values and lists, tuples, dicts and
+          sets of those are hashed automatically. For other node types, provide
+          a hash handler using the `on_hash()` decorator.
+        * nodes which cannot be hashed are transformed as usual, without
+          memoization.
+        * memoized results are shared, treat the transformed tree as immutable.
+        * change `memo_version` whenever the transformer's output changes, to
+          discard memo tables persisted by previous versions.
+    """
+
+    memo_version: str = "1"
+
+    def __init__(self) -> None:
+        self._memo: Dict[bytes, Any] = {}
+        # per-pass cache of node digests, keyed by id. Also holds a reference
+        # to each node to ensure ids are not reused during the pass.
+        self._digests: Dict[int, Any] = {}
+        self._depth = 0
+
+    def _digest(self, node: Any) -> bytes:
+        cached = self._digests.get(id(node))
+        if cached is not None:
+            if cached[1] is None:
+                raise NodeHashError(node)
+            return cached[1]
+
+        typ = type(node)
+        h = hashlib.blake2b(digest_size=20)
+        h.update(f"{typ.__module__}.{typ.__qualname__}".encode("utf-8"))
+        hasher = getattr(self, "__hashers").get(typ)
+        if hasher is not None:
+            h.update(self._digest(hasher(self, node)))
+        elif typ in _PRIMITIVES:
+            h.update(repr(node).encode("utf-8"))
+        elif isinstance(node, Enum):
+            h.update(node.name.encode("utf-8"))
+        elif isinstance(node, (list, tuple)):
+            for elem in node:
+                h.update(self._digest(elem))
+        elif isinstance(node, dict):
+            for item in sorted(
+                self._digest(k) + self._digest(v) for k, v in node.items()
+            ):
+                h.update(item)
+        elif isinstance(node, (set, frozenset)):
+            for item in sorted(self._digest(elem) for elem in node):
+                h.update(item)
+        elif dataclasses.is_dataclass(node):
+            for field in dataclasses.fields(node):
+                h.update(field.name.encode("utf-8"))
+                h.update(self._digest(getattr(node, field.name)))
+        else:
+            self._digests[id(node)] = (node, None)
+            raise NodeHashError(node)
+
+        digest = h.digest()
+        self._digests[id(node)] = (node, digest)
+        return digest
+
+    def node_hash(self, node: Any) -> Optional[bytes]:
+        """Compute structural hash of `node`.
+
+        Args:
+            node: the node to hash
+
+        Returns:
+            The hash digest of the node or None if the node cannot be hashed.
+        """
+        try:
+            return self._digest(node)
+        except NodeHashError:
+            return None
+        finally:
+            if self._depth == 0:
+                # outside of `transform`, digests are only valid for this call
+                self._digests.clear()
+
+    def transform(self, node: Any) -> Any:
+        """Transform node `node`, reusing the memoized result if available.
+
+        See `NodeTransformer.transform`.
+        """
+        self._depth += 1
+        try:
+            key = self.node_hash(node)
+            if key is None:
+                return super().transform(node)
+            try:
+                return self._memo[key]
+            except KeyError:
+                pass
+            result = self._memo[key] = super().transform(node)
+            return result
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                self._digests.clear()
+
+    def clear_memo(self) -> None:
+        """Discard all memoized results."""
+        self._memo.clear()
+
+    def _memo_tag(self) -> str:
+        typ = type(self)
+        return f"{typ.__module__}.{typ.__qualname__}:{self.memo_version}"
+
+    def save_memo(self, fpath: Union[Path, str]) -> None:
+        """Persist the memo table to `fpath`.
+
+        The file is replaced atomically. Transformed nodes must be picklable.
+
+        Args:
+            fpath: path of the file to write.
+        """
+        fpath = Path(fpath)
+        fpath.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile("wb", dir=fpath.parent, delete=False) as fh:
+            try:
+                pickle.dump((self._memo_tag(), self._memo), fh)
+            except Exception:
+                fh.close()
+                Path(fh.name).unlink()
+                raise
+        os.replace(fh.name, fpath)
+
+    def load_memo(self, fpath: Union[Path, str]) -> bool:
+        """Load memo table persisted by `save_memo`.
+
+        Memo tables written by another transformer class or by another
+        `memo_version` are ignored, as are unreadable files.
+
+        Args:
+            fpath: path of the file to read.
+
+        Returns:
+            True if the memo table was loaded, False otherwise.
+        """
+        try:
+            with open(fpath, "rb") as fh:
+                tag, memo = pickle.load(fh)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, AttributeError):
+            return False
+        if tag != self._memo_tag() or not isinstance(memo, dict):
+            return False
+        self._memo.update(memo)
+        return True
+
+
 def parse_tree(pipeline: List[TreeOp], tree: Any) -> Any:
     """Parse tree by applying a series of visitors and transformers.
 
@@ -346,5 +593,8 @@ __all__ = [
     "on_transform",
     "NodeVisitor",
     "NodeTransformer",
+    "on_hash",
+    "NodeHashError",
+    "MemoNodeTransformer",
     "parse_tree",
 ]
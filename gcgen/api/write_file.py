@@ -1,7 +1,9 @@
+import asyncio
+import codecs
 import tempfile
-from os import rename as os_rename
 from pathlib import Path
-from gcgen.emitter import Emitter, Section
+from gcgen.durability import replace_file
+from gcgen.emitter import BinaryWriter, Emitter, Section, StreamingSection
 from typing import Union
 
 
@@ -14,42 +16,81 @@ class write_file(object):
     If the context manager is exiting due to an exception, the temporary file
     is removed and the file at `fpath` (if any) is untouched.
 
+    Can also be used as an async context manager (`async with write_file(...)`)
+    from `async def` generators, in which case the file I/O of entering and
+    exiting the context is run in the event loop's default executor.
+
     Args:
         fpath: path to the file to write.
             (recommended to only write files in the same directory)
         indent_by: what to write for each level of indentation
             defaults to a single space (' ').
+        stream: if true, write contents to the temporary file while the
+            section is being built, rather than buffering all of it in memory.
+            (Note) contents following a sub-section (see `add_section`) are
+            buffered until the context manager exits.
+        encoding: encoding of the file, defaults to UTF-8 on all platforms.
+        newline: line ending to write, defaults to '\n' on all platforms.
     """
 
-    def __init__(self, fpath: Union[Path, str], indent_by: str = " "):
+    def __init__(
+        self,
+        fpath: Union[Path, str],
+        indent_by: str = " ",
+        stream: bool = False,
+        encoding: str = "utf-8",
+        newline: str = "\n",
+    ):
         if not isinstance(fpath, (str, Path)):
             raise RuntimeError("path supplied must be a pathlib.Path or str")
-        self._fpath = fpath if isinstance(fpath, Path) else Path(fpath)
+        # relative to the working directory at construction, async generators
+        # of other directories may change it before the file is written.
+        self._fpath = Path(fpath).absolute()
         self._indent_by = indent_by
+        self._stream = stream
+        # fail early on unknown encodings
+        self._encoding = codecs.lookup(encoding).name
+        self._newline = newline
 
     def __enter__(self) -> Section:
-        self._fh = tempfile.NamedTemporaryFile(
-            "w", dir=self._fpath.parent, delete=False
+        self._fh = BinaryWriter(
+            tempfile.NamedTemporaryFile("wb", dir=self._fpath.parent, delete=False),
+            self._encoding,
+            self._newline,
         )
         self._emitter = Emitter(prefix="", indent_by=self._indent_by)
-        self._section = Section()
+        if self._stream:
+            self._section = StreamingSection(self._emitter, self._fh)
+        else:
+            self._section = Section()
         return self._section
 
     def __exit__(self, exc_type, _, __):
         if exc_type:
             p = Path(self._fh.name)
-            self._fh.close()
+            self._fh.discard()
             if p.exists():
                 p.unlink()
             return
 
         try:
-            self._emitter.emit(self._section, self._fh)
+            if isinstance(self._section, StreamingSection):
+                self._section.close()
+            else:
+                self._emitter.emit(self._section, self._fh)
             self._fh.close()
-            os_rename(src=self._fh.name, dst=self._fpath)
+            replace_file(self._fh.name, self._fpath)
         except Exception as e:
-            self._fh.close()
+            self._fh.discard()
             p = Path(self._fh.name)
             if p.exists():
                 p.unlink()
             raise e
+
+    async def __aenter__(self) -> Section:
+        return await asyncio.get_running_loop().run_in_executor(None, self.__enter__)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.__exit__, exc_type, exc, tb
+        )
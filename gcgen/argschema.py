@@ -0,0 +1,180 @@
+"""
+Compile snippet argument schemas into validator functions.
+
+Schemas use a subset of JSON Schema:
+  * type: "null", "boolean", "integer", "number", "string", "array", "object"
+          or a list of these
+  * enum, const
+  * minimum, maximum (numbers), minLength, maxLength (strings)
+  * items, minItems, maxItems (arrays)
+  * properties, required, additionalProperties (objects)
+
+Each schema is compiled once into a tree of closures, each returning the list of
+problems found in the value (empty if the value is valid).
+"""
+import operator
+from typing import Any, Callable, Dict, List
+
+
+Validator = Callable[[Any, str], List[str]]
+
+
+_TYPES: Dict[str, Callable[[Any], bool]] = {
+    "null": lambda v: v is None,
+    "boolean": lambda v: isinstance(v, bool),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "string": lambda v: isinstance(v, str),
+    "array": lambda v: isinstance(v, list),
+    "object": lambda v: isinstance(v, dict),
+}
+
+_KEYWORDS = {
+    "type",
+    "enum",
+    "const",
+    "minimum",
+    "maximum",
+    "minLength",
+    "maxLength",
+    "items",
+    "minItems",
+    "maxItems",
+    "properties",
+    "required",
+    "additionalProperties",
+    "description",
+    "title",
+}
+
+
+def _identity(v):
+    return v
+
+
+def compile_schema(schema: Dict[str, Any]) -> Validator:
+    """Compile `schema` into a validator.
+
+    Args:
+        schema: the schema, a dict using the JSON Schema keywords listed in the
+          module documentation.
+
+    Raises:
+        ValueError: if the schema is invalid or uses unsupported keywords.
+
+    Returns:
+        A function taking the value to validate and the path used to describe
+        the value in error messages (use "$" for the top-level value), and
+        returning a list of problems found.
+    """
+    if not isinstance(schema, dict):
+        raise ValueError(f"schema must be a dict, got {type(schema)}")
+    unsupported = set(schema) - _KEYWORDS
+    if unsupported:
+        raise ValueError(f"unsupported schema keywords: {sorted(unsupported)!r}")
+
+    checks: List[Validator] = []
+
+    if "type" in schema:
+        types = schema["type"]
+        types = [types] if isinstance(types, str) else list(types)
+        for t in types:
+            if t not in _TYPES:
+                raise ValueError(f"unsupported schema type {t!r}")
+        type_fns = [_TYPES[t] for t in types]
+        expected = " or ".join(types)
+
+        def check_type(v, path):
+            if any(fn(v) for fn in type_fns):
+                return []
+            return [f"{path}: expected {expected}, got {type(v).__name__}"]
+
+        checks.append(check_type)
+
+    if "enum" in schema:
+        options = list(schema["enum"])
+
+        def check_enum(v, path):
+            return [] if v in options else [f"{path}: must be one of {options!r}"]
+
+        checks.append(check_enum)
+
+    if "const" in schema:
+        const = schema["const"]
+
+        def check_const(v, path):
+            return [] if v == const else [f"{path}: must be {const!r}"]
+
+        checks.append(check_const)
+
+    def bound(key: str, measure, op, applies, describe: str):
+        if key not in schema:
+            return
+        limit = schema[key]
+
+        def check_bound(v, path):
+            if not applies(v) or op(measure(v), limit):
+                return []
+            return [f"{path}: {describe} {limit!r}"]
+
+        checks.append(check_bound)
+
+    is_num = _TYPES["number"]
+    is_str = _TYPES["string"]
+    is_list = _TYPES["array"]
+    bound("minimum", _identity, operator.ge, is_num, "must be >=")
+    bound("maximum", _identity, operator.le, is_num, "must be <=")
+    bound("minLength", len, operator.ge, is_str, "length must be >=")
+    bound("maxLength", len, operator.le, is_str, "length must be <=")
+    bound("minItems", len, operator.ge, is_list, "length must be >=")
+    bound("maxItems", len, operator.le, is_list, "length must be <=")
+
+    if "items" in schema:
+        item_check = compile_schema(schema["items"])
+
+        def check_items(v, path):
+            if not isinstance(v, list):
+                return []
+            errs = []
+            for ndx, item in enumerate(v):
+                errs.extend(item_check(item, f"{path}[{ndx}]"))
+            return errs
+
+        checks.append(check_items)
+
+    if {"properties", "required", "additionalProperties"} & set(schema):
+        props = {k: compile_schema(s) for k, s in schema.get("properties", {}).items()}
+        required = list(schema.get("required", []))
+        additional = schema.get("additionalProperties", True)
+        additional_check = (
+            compile_schema(additional) if isinstance(additional, dict) else None
+        )
+
+        def check_object(v, path):
+            if not isinstance(v, dict):
+                return []
+            errs = [f"{path}: missing key {k!r}" for k in required if k not in v]
+            for k, val in v.items():
+                check = props.get(k)
+                if check is not None:
+                    errs.extend(check(val, f"{path}.{k}"))
+                elif additional_check is not None:
+                    errs.extend(additional_check(val, f"{path}.{k}"))
+                elif additional is False:
+                    errs.append(f"{path}: unexpected key {k!r}")
+            return errs
+
+        checks.append(check_object)
+
+    if not checks:
+        return lambda v, path: []
+    elif len(checks) == 1:
+        return checks[0]
+
+    def validate(v, path):
+        errs = []
+        for check in checks:
+            errs.extend(check(v, path))
+        return errs
+
+    return validate
@@ -0,0 +1,83 @@
+"""
+Run `async def` snippets and generators on a shared event loop.
+"""
+import asyncio
+from typing import Any, Awaitable, List, Optional
+
+
+class AsyncRunner:
+    """Owns the event loop on which all coroutines of a run are executed.
+
+    Args:
+        max_concurrency: maximum number of coroutines passed to `gather`
+            which may run at the same time.
+    """
+
+    def __init__(self, max_concurrency: int = 8):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be 1 or greater")
+        self.max_concurrency = max_concurrency
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop
+
+    def run(self, aw: Awaitable) -> Any:
+        """Run `aw` to completion and return its result."""
+        return self.loop.run_until_complete(aw)
+
+    def gather(self, aws: List[Awaitable]) -> List[Any]:
+        """Run all of `aws` concurrently, at most `max_concurrency` at a time.
+
+        Returns:
+            The results, in the order of `aws`. If an awaitable raised an
+            exception, the exception is returned in place of its result.
+        """
+        if not aws:
+            return []
+
+        async def limited(aw: Awaitable) -> Any:
+            if self._sem is None:
+                self._sem = asyncio.Semaphore(self.max_concurrency)
+            async with self._sem:
+                return await aw
+
+        async def run_all() -> List[Any]:
+            return await asyncio.gather(
+                *(limited(aw) for aw in aws), return_exceptions=True
+            )
+
+        return self.run(run_all())
+
+    def close(self) -> None:
+        if self._loop is None:
+            return
+        try:
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+            self._loop.run_until_complete(self._loop.shutdown_default_executor())
+        finally:
+            self._loop.close()
+            self._loop = None
+            self._sem = None
+
+
+_runner: Optional[AsyncRunner] = None
+
+
+def get_runner() -> AsyncRunner:
+    """Get runner of current run (or a default runner if none is active)."""
+    global _runner
+    if _runner is None:
+        _runner = AsyncRunner()
+    return _runner
+
+
+def set_runner(runner: Optional[AsyncRunner]) -> Optional[AsyncRunner]:
+    """Install `runner` as the active runner, returning the previous one."""
+    global _runner
+    prev, _runner = _runner, runner
+    return prev
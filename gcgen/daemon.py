@@ -0,0 +1,412 @@
+"""
+Long-running gcgen process keeping a project loaded between runs.
+
+`gcgen serve` loads the project once (importing `gcgen_conf.py` files and the
+project modules they import) and then listens on a Unix domain socket in the
+project's `.gcgen` directory. `gcgen regen [PATH...]` asks the daemon to
+regenerate the given paths, which skips the imports. Scopes are built anew for
+each run, as runs may modify them.
+
+The project is reloaded whenever a `gcgen_conf.py` file, a project module
+imported by one, or the directory tree changes.
+
+Protocol: the client sends requests as JSON objects, one per line, and the
+daemon answers each with one or more JSON objects, one per line:
+    {"op": "ping"}                  => {"event": "done"}
+    {"op": "regen", "paths": [...]} => {"event": "log", ...}*, then
+                                       {"event": "done", "output": ...} or
+                                       {"event": "error", "details": ...}
+
+`output` and `details` hold what the run printed (e.g. the memory profile).
+    {"op": "shutdown"}              => {"event": "done"}, daemon exits
+"""
+import contextlib
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from pathlib import Path
+from types import ModuleType
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional
+
+from gcgen.excbase import GcgenError
+from gcgen.log import format as log_format, get_logger
+from gcgen.scope import Scope
+
+# the client (`regen`, `stop`) must start fast, only the daemon itself imports
+# the machinery to load and run a project.
+if TYPE_CHECKING:
+    import gcgen.generate as gen
+
+
+logger = get_logger(__name__)
+
+Message = Dict[str, Any]
+
+
+def socket_path(root: Path) -> Path:
+    """Path of the socket of the daemon serving the project at `root`."""
+    return root / ".gcgen" / "daemon.sock"
+
+
+class DaemonError(GcgenError):
+    pass
+
+
+class DaemonNotRunningError(DaemonError):
+    def __init__(self, sock_path: Path):
+        self.sock_path = sock_path
+        super().__init__(f"no gcgen daemon listening on {sock_path!s}")
+
+    def printerr(self) -> None:
+        print("gcgen daemon not running")
+        print("")
+        print("Could not connect to the gcgen daemon of this project.")
+        print("Start it by running `gcgen serve` in the project.")
+        print("")
+        print("Details:")
+        print(f"  socket: {self.sock_path}")
+
+
+class DaemonRunningError(DaemonError):
+    def __init__(self, sock_path: Path):
+        self.sock_path = sock_path
+        super().__init__(f"a gcgen daemon is already listening on {sock_path!s}")
+
+    def printerr(self) -> None:
+        print("gcgen daemon already running")
+        print("")
+        print("Another gcgen daemon is serving this project.")
+        print("Stop it by running `gcgen stop` in the project.")
+        print("")
+        print("Details:")
+        print(f"  socket: {self.sock_path}")
+
+
+class DaemonPathError(DaemonError):
+    def __init__(self, paths: List[Path]):
+        self.paths = paths
+        super().__init__(
+            "no directory with a gcgen_conf.py file contains "
+            + ", ".join(str(p) for p in paths)
+        )
+
+    def printerr(self) -> None:
+        print("Paths not in the project")
+        print("")
+        print("The gcgen daemon can only regenerate paths within directories")
+        print("of its project which have a `gcgen_conf.py` file.")
+        print("")
+        print("Details:")
+        for path in self.paths:
+            print(f"  path: {path}")
+
+
+def _is_project_module(root: Path, mod: Any) -> bool:
+    name = getattr(mod, "__name__", "")
+    if name == "gcgen" or name.startswith("gcgen."):
+        return False
+    fname = getattr(mod, "__file__", None)
+    if not fname:
+        return False
+    try:
+        rel = Path(fname).resolve().relative_to(root)
+    except ValueError:
+        return False
+    return "site-packages" not in rel.parts
+
+
+class Project:
+    """A project kept loaded in memory, reloaded when its configuration changes.
+
+    Args:
+        root: the (resolved) project root.
+        after_run: (optional) called after each successful run, e.g. to save
+            the index.
+        run_opts: passed on to `gcgen.generate.run`.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        after_run: Optional[Callable[[], None]] = None,
+        **run_opts: Any,
+    ):
+        self.root = root
+        self.after_run = after_run
+        self.run_opts = run_opts
+        from gcgen.api.models import ModelCache
+
+        self.models = ModelCache(root / ".gcgen" / "models", root)
+        self.conf_dirs: Optional[List["gen.ConfDir"]] = None
+        # `gcgen_conf.py` path => module, imported once per load
+        self._modules: Dict[Path, ModuleType] = {}
+        # True while `conf_dirs` holds scopes no run has used yet
+        self._fresh = False
+        self._dirs: List[Path] = []
+        self._signature: Dict[str, int] = {}
+
+    def _compute_signature(self) -> Dict[str, int]:
+        paths = [*self._dirs]
+        if self.conf_dirs is not None:
+            paths.extend(cd.conf_path for cd in self.conf_dirs)
+        for mod in list(sys.modules.values()):
+            if _is_project_module(self.root, mod):
+                paths.append(Path(mod.__file__))  # type: ignore
+        sig = {}
+        for path in paths:
+            try:
+                sig[str(path)] = path.stat().st_mtime_ns
+            except OSError:
+                sig[str(path)] = -1
+        return sig
+
+    def is_stale(self) -> bool:
+        """True if the project must be (re)loaded before running."""
+        return self.conf_dirs is None or self._compute_signature() != self._signature
+
+    def _derive(self, dirs: Optional[List[Path]] = None) -> List["gen.ConfDir"]:
+        # scopes are built from scratch, `gcgen_scope_extend` hooks run again
+        # but `gcgen_conf.py` files are only imported if not yet loaded.
+        import gcgen.generate as gen
+        from gcgen.api.models import set_model_cache
+
+        scope = Scope()
+        scope["$models"] = self.models
+        cwd = os.getcwd()
+        prev_models = set_model_cache(self.models)
+        try:
+            return gen.load_project(self.root, scope, dirs, self._modules)
+        finally:
+            set_model_cache(prev_models)
+            os.chdir(cwd)
+
+    def load(self) -> None:
+        """(Re)load all `gcgen_conf.py` files of the project."""
+        # drop previously imported project modules such that imports made by
+        # `gcgen_conf.py` files pick up their current contents.
+        for name, mod in list(sys.modules.items()):
+            if _is_project_module(self.root, mod):
+                del sys.modules[name]
+        self.conf_dirs = None
+        self._modules = {}
+        dirs: List[Path] = []
+        self.conf_dirs = self._derive(dirs)
+        self._fresh = True
+        # ignore gcgen's own state (caches, index, socket)
+        state_dir = self.root / ".gcgen"
+        self._dirs = [d for d in dirs if not d.is_relative_to(state_dir)]
+        self._signature = self._compute_signature()
+
+    def select(self, paths: List[Path]) -> List["gen.ConfDir"]:
+        """Get the loaded directories to run to regenerate `paths`.
+
+        A directory is selected if it is (within) one of the paths. Paths
+        without such directories, e.g. files, select the nearest directory
+        containing them. No paths selects every directory.
+
+        Raises:
+            DaemonPathError: if no directory contains some of the paths.
+        """
+        assert self.conf_dirs is not None
+        if not paths:
+            return list(self.conf_dirs)
+        selected = set()
+        unmatched = []
+        for p in paths:
+            within = [cd.path for cd in self.conf_dirs if cd.path.is_relative_to(p)]
+            if not within:
+                containing = [
+                    cd.path for cd in self.conf_dirs if p.is_relative_to(cd.path)
+                ]
+                if not containing:
+                    unmatched.append(p)
+                    continue
+                within = [max(containing, key=lambda d: len(d.parts))]
+            selected.update(within)
+        if unmatched:
+            raise DaemonPathError(unmatched)
+        return [cd for cd in self.conf_dirs if cd.path in selected]
+
+    def regen(self, paths: List[Path]) -> Message:
+        """Run directories selected by `paths`, reloading the project if needed.
+
+        Returns:
+            Summary of the run.
+        """
+        import gcgen.generate as gen
+
+        reloaded = self.is_stale()
+        if reloaded:
+            logger.info("Loading project %s", self.root)
+            self.load()
+        elif not self._fresh:
+            # runs modify scopes, each run starts from scopes of its own
+            self.conf_dirs = self._derive()
+        self._fresh = False
+        selected = self.select(paths)
+        cwd = os.getcwd()
+        try:
+            gen.run(self.root, selected, self.models, **self.run_opts)
+        finally:
+            os.chdir(cwd)
+        if self.after_run is not None:
+            self.after_run()
+        # files written by the run itself change directory modification times,
+        # which must not cause a reload.
+        self._signature = self._compute_signature()
+        return {"reloaded": reloaded, "dirs": [str(cd.path) for cd in selected]}
+
+
+class _SendHandler(logging.Handler):
+    def __init__(self, send: Callable[..., None]):
+        super().__init__()
+        self._send = send
+        self.setFormatter(log_format)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self._send(event="log", level=record.levelname, message=self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: "DaemonServer"
+
+    def _send(self, **msg: Any) -> None:
+        self.wfile.write((json.dumps(msg, default=str) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                req = json.loads(line)
+                op = req["op"]
+            except (ValueError, KeyError, TypeError):
+                self._send(event="error", message="invalid request")
+                continue
+            if op == "ping":
+                self._send(event="done")
+            elif op == "regen":
+                self._regen([Path(p) for p in req.get("paths", [])])
+            elif op == "shutdown":
+                self._send(event="done")
+                # shutdown waits for the serve loop, which runs this handler
+                threading.Thread(target=self.server.shutdown).start()
+                return
+            else:
+                self._send(event="error", message=f"unknown operation {op!r}")
+
+    def _regen(self, paths: List[Path]) -> None:
+        handler = _SendHandler(self._send)
+        root_logger = logging.getLogger()
+        root_logger.addHandler(handler)
+        details = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(details):
+                result = self.server.project.regen(paths)
+        except GcgenError as e:
+            with contextlib.redirect_stdout(details):
+                e.printerr()
+            self._send(event="error", message=str(e), details=details.getvalue())
+        except Exception as e:
+            details.write(traceback.format_exc())
+            self._send(event="error", message=str(e), details=details.getvalue())
+        else:
+            self._send(event="done", output=details.getvalue(), **result)
+        finally:
+            root_logger.removeHandler(handler)
+
+
+class DaemonServer(socketserver.UnixStreamServer):
+    """Serves requests of gcgen clients, one at a time."""
+
+    def __init__(self, project: Project, sock_path: Path):
+        self.project = project
+        self.sock_path = sock_path
+        # only the user running the daemon may connect, the socket is created
+        # with these permissions such that no one else can connect meanwhile.
+        umask = os.umask(0o077)
+        try:
+            super().__init__(str(sock_path), _RequestHandler)
+        finally:
+            os.umask(umask)
+
+
+def _is_alive(sock_path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(sock_path))
+        except OSError:
+            return False
+    return True
+
+
+def make_server(project: Project, sock_path: Path) -> DaemonServer:
+    """Create server listening on `sock_path`, replacing a stale socket file."""
+    sock_path.parent.mkdir(parents=True, exist_ok=True)
+    if sock_path.exists():
+        if _is_alive(sock_path):
+            raise DaemonRunningError(sock_path)
+        # left behind by a daemon which did not exit cleanly
+        sock_path.unlink()
+    return DaemonServer(project, sock_path)
+
+
+def serve(project: Project, sock_path: Path) -> None:
+    """Serve requests until asked to shut down."""
+    # load eagerly, such that the first request is fast, too
+    project.load()
+    server = make_server(project, sock_path)
+    logger.info("Listening on %s", sock_path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        sock_path.unlink(missing_ok=True)
+
+
+def request(sock_path: Path, req: Message) -> Iterator[Message]:
+    """Send request `req` to the daemon, yielding its responses."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(sock_path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise DaemonNotRunningError(sock_path) from None
+        sock.sendall((json.dumps(req) + "\n").encode("utf-8"))
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile("r", encoding="utf-8") as fh:
+            for line in fh:
+                yield json.loads(line)
+
+
+def regen(sock_path: Path, paths: List[Path]) -> bool:
+    """Ask daemon to regenerate `paths`, printing its output as it arrives.
+
+    Returns:
+        True if the daemon regenerated the paths successfully.
+    """
+    ok = False
+    req = {"op": "regen", "paths": [str(p.resolve()) for p in paths]}
+    for msg in request(sock_path, req):
+        if msg["event"] == "log":
+            print(msg["message"], file=sys.stderr)
+        elif msg["event"] == "error":
+            print(msg.get("details") or msg["message"])
+        elif msg["event"] == "done":
+            if msg.get("output"):
+                print(msg["output"], end="")
+            ok = True
+    return ok
+
+
+def stop(sock_path: Path) -> None:
+    """Ask daemon to shut down."""
+    for _ in request(sock_path, {"op": "shutdown"}):
+        pass
@@ -1,4 +1,5 @@
-from typing import Set
+from typing import Any, Dict, Optional, Set
+from gcgen.argschema import compile_schema, Validator
 
 
 def has_snippet(f, name: str) -> bool:
@@ -18,7 +19,31 @@ def snippet_names(f) -> Set[str]:
     return getattr(f, "_gcgen", {}).get("snippets", set())
 
 
-def snippet(name: str):
+def snippet_validator(f) -> Optional[Validator]:
+    """get compiled argument validator of snippet, if any."""
+    return getattr(f, "_gcgen", {}).get("validator")
+
+
+def call_limits(f) -> Dict[str, Any]:
+    """get limits set on the snippet or generator's decorator (if any)."""
+    return getattr(f, "_gcgen", {}).get("limits", {})
+
+
+def _set_limits(f, timeout: Optional[float], max_memory_mb: Optional[float]) -> None:
+    limits = f._gcgen.setdefault("limits", {})
+    if timeout is not None:
+        limits["timeout"] = timeout
+    if max_memory_mb is not None:
+        limits["max_memory_mb"] = max_memory_mb
+
+
+def snippet(
+    name: str,
+    *,
+    schema: Optional[Dict[str, Any]] = None,
+    timeout: Optional[float] = None,
+    max_memory_mb: Optional[float] = None,
+):
     """Mark decorated callable as a snippet.
 
     This decorator does nothing except install some attributes on the
@@ -27,15 +52,29 @@ def snippet(name: str):
     Args:
         name: the name to identify the snippet by.
             (Note) can decorate multiple times to provide aliases
+        schema: (optional) schema describing the snippet's argument, see
+            `gcgen.argschema`. Snippets are only called with arguments
+            which validate, all invalid arguments of a file are reported
+            together.
+        timeout: (optional) time budget of each call in seconds, overriding
+            `snippet_timeout` of the project (0 means no limit).
+        max_memory_mb: (optional) how much each call may grow the memory use
+            of gcgen, overriding `snippet_max_memory_mb` of the project (0
+            means no limit).
 
     Returns:
         A decorator function.
     """
+    validator = compile_schema(schema) if schema is not None else None
 
     def decorator(f):
         cg_attr = f._gcgen = getattr(f, "_gcgen", {})
         snippets = cg_attr["snippets"] = cg_attr.get("snippets", set())
         snippets.add(name)
+        if validator is not None:
+            cg_attr["schema"] = schema
+            cg_attr["validator"] = validator
+        _set_limits(f, timeout, max_memory_mb)
 
         return f
 
@@ -46,13 +85,30 @@ def is_generator(f) -> bool:
     return callable(f) and getattr(f, "_gcgen", {}).get("generator", False)
 
 
-def generator(f):
+def generator(
+    f=None, *, timeout: Optional[float] = None, max_memory_mb: Optional[float] = None
+):
     """Mark decorated callable as a generator.
 
     This decorator does nothing except install an attribute on the callable,
     identifying it as a generator.
+    Use as `@generator`, or as `@generator(timeout=...)` to set limits:
+
+    Args:
+        timeout: (optional) time budget of the generator in seconds,
+            overriding `generator_timeout` of the project (0 means no limit).
+        max_memory_mb: (optional) how much the generator may grow the memory
+            use of gcgen, overriding `generator_max_memory_mb` of the project
+            (0 means no limit).
     """
-    cg_attr = f._gcgen = getattr(f, "_gcgen", {})
-    cg_attr["generator"] = True
 
-    return f
+    def decorator(f):
+        cg_attr = f._gcgen = getattr(f, "_gcgen", {})
+        cg_attr["generator"] = True
+        _set_limits(f, timeout, max_memory_mb)
+
+        return f
+
+    if f is None:
+        return decorator
+    return decorator(f)
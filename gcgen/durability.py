@@ -0,0 +1,123 @@
+"""
+Durability of files written by gcgen.
+
+Files are written to a temporary file which is then renamed over the target.
+The rename is atomic, but unless the file and its directory are synced, a
+crash may lose the new contents (or leave an empty file). The durability mode
+decides when gcgen syncs:
+
+    none:    never, leave it to the OS (fastest).
+    file:    sync each file before renaming it, and its directory after.
+    batched: sync all files written, then each touched directory once, at
+             the end of the run. Files are durable once the run completes.
+"""
+import os
+from pathlib import Path
+from typing import List, Optional, Set, Union
+
+from gcgen.log import get_logger
+
+
+logger = get_logger(__name__)
+
+MODES = ("none", "file", "batched")
+
+StrPath = Union[str, Path]
+
+
+def fsync_path(path: StrPath, directory: bool = False) -> None:
+    flags = os.O_RDONLY
+    if directory:
+        # not all platforms (e.g. Windows) can open or sync directories
+        flags |= getattr(os, "O_DIRECTORY", 0)
+    try:
+        fd = os.open(path, flags)
+    except OSError:
+        if directory:
+            return
+        raise
+    try:
+        os.fsync(fd)
+    except OSError:
+        if not directory:
+            raise
+    finally:
+        os.close(fd)
+
+
+class Durability:
+    """Replaces files, syncing them to disk as mandated by `mode`.
+
+    Args:
+        mode: one of 'none', 'file' or 'batched'.
+    """
+
+    def __init__(self, mode: str = "none"):
+        if mode not in MODES:
+            raise ValueError(f"invalid durability mode {mode!r}, valid are: {MODES}")
+        self.mode = mode
+        # (batched) files replaced and their directories, synced by `sync`
+        self._files: List[str] = []
+        self._dirs: Set[str] = set()
+
+    def replace_file(self, tmp: StrPath, dst: StrPath) -> None:
+        """Atomically replace `dst` by `tmp`."""
+        if self.mode == "file":
+            fsync_path(tmp)
+            os.replace(tmp, dst)
+            fsync_path(os.path.dirname(os.path.abspath(dst)), directory=True)
+            return
+        os.replace(tmp, dst)
+        if self.mode == "batched":
+            dst = os.path.abspath(dst)
+            self._files.append(dst)
+            self._dirs.add(os.path.dirname(dst))
+
+    def current(self, path: StrPath) -> str:
+        """Path to read the current contents of `path` from."""
+        return str(path)
+
+    def sync(self) -> None:
+        """(batched) Sync files replaced since the last call, then their directories."""
+        if not self._files:
+            return
+        files, dirs = self._files, self._dirs
+        self._files, self._dirs = [], set()
+        logger.debug("syncing %d files in %d directories", len(files), len(dirs))
+        for fpath in files:
+            try:
+                fsync_path(fpath)
+            except FileNotFoundError:
+                # removed or replaced again since, nothing to sync
+                pass
+        for dpath in sorted(dirs):
+            fsync_path(dpath, directory=True)
+
+
+_durability: Optional[Durability] = None
+
+
+def get_durability() -> Durability:
+    """Get durability of the current run (mode 'none' if none is set)."""
+    global _durability
+    if _durability is None:
+        _durability = Durability()
+    return _durability
+
+
+def set_durability(durability: Optional[Durability]) -> Optional[Durability]:
+    """Set durability of the current run, returns the previous one."""
+    global _durability
+    prev = _durability
+    _durability = durability
+    return prev
+
+
+def replace_file(tmp: StrPath, dst: StrPath) -> None:
+    """Atomically replace `dst` by `tmp`, observing the durability of the run."""
+    get_durability().replace_file(tmp, dst)
+
+
+def current_file(path: StrPath) -> str:
+    """Path to read the current contents of `path` from, see `Durability.current`."""
+    return get_durability().current(path)
@@ -1,2 +1,11 @@
-from gcgen.emitter.section import SectionError, SectionDedentError, Section
-from gcgen.emitter.emitter import Emitter
+from gcgen.emitter.section import (
+    SectionError,
+    SectionDedentError,
+    SectionConsumedError,
+    Section,
+)
+from gcgen.emitter.emitter import Emitter, EmitterConfig
+from gcgen.emitter.binary import BinaryWriter
+from gcgen.emitter.streaming import StreamingSection
+from gcgen.emitter.template import Template
+from gcgen.emitter.codec import SectionDecodeError, decode_section, encode_section
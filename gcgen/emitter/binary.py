@@ -0,0 +1,99 @@
+import codecs
+from typing import BinaryIO, Iterable, List
+
+
+def is_utf8(encoding: str) -> bool:
+    return codecs.lookup(encoding).name == "utf-8"
+
+
+class BinaryWriter:
+    """Writer encoding text to binary file handle `fh` in large chunks.
+
+    Text written is buffered until `chunk_size` characters are pending, then
+    encoded and written in one go. Line endings ('\\n') are written as
+    `newline`, regardless of the platform.
+
+    NOTE: call `close` (or `flush`) once done to write any pending text.
+
+    Args:
+        fh: binary file handle to write to.
+        encoding: encoding of the output.
+        newline: line ending to write.
+        errors: how to handle characters `encoding` cannot represent, see
+            `str.encode`.
+        chunk_size: number of characters to buffer before writing.
+    """
+
+    __slots__ = (
+        "_fh",
+        "encoding",
+        "newline",
+        "errors",
+        "_chunk_size",
+        "_pending",
+        "_size",
+    )
+
+    def __init__(
+        self,
+        fh: BinaryIO,
+        encoding: str = "utf-8",
+        newline: str = "\n",
+        errors: str = "strict",
+        chunk_size: int = 1 << 16,
+    ):
+        self._fh = fh
+        # validates the encoding upfront
+        self.encoding = codecs.lookup(encoding).name
+        self.newline = newline
+        self.errors = errors
+        self._chunk_size = chunk_size
+        self._pending: List[str] = []
+        self._size = 0
+
+    @property
+    def name(self) -> str:
+        return self._fh.name  # type: ignore
+
+    def write(self, text: str) -> int:
+        self._pending.append(text)
+        self._size += len(text)
+        if self._size >= self._chunk_size:
+            self.flush()
+        return len(text)
+
+    def writelines(self, lines: Iterable[str]) -> None:
+        for line in lines:
+            self.write(line)
+
+    def encode(self, text: str) -> bytes:
+        """Encode `text` as it would be written."""
+        if self.newline != "\n":
+            text = text.replace("\n", self.newline)
+        return text.encode(self.encoding, self.errors)
+
+    def flush(self) -> None:
+        """Write all pending text to the file handle."""
+        if not self._pending:
+            return
+        text = "".join(self._pending)
+        self._pending = []
+        self._size = 0
+        self._fh.write(self.encode(text))
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self._fh.close()
+
+    def discard(self) -> None:
+        """Close the file handle without writing pending text."""
+        self._pending = []
+        self._size = 0
+        self._fh.close()
+
+
+__all__ = [
+    "BinaryWriter",
+]
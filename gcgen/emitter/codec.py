@@ -0,0 +1,378 @@
+"""
+Compact binary encoding of sections.
+
+Encoded sections can cross process boundaries or be stored, and are much
+smaller and faster to encode and decode than pickled sections. They can be
+emitted directly (see `Emitter.emit_encoded`) without decoding them back into
+sections.
+
+Layout (all integers unsigned 32-bit little-endian unless noted):
+
+    magic       4 bytes, b"GCSE"
+    version     1 byte
+    flags       1 byte, see `FLAG_SIMPLE`
+    width       1 byte, size of each operand (1, 2 or 4 bytes)
+    nstrings    number of strings in the string table
+    nops        number of opcodes
+    noperands   number of operands
+    nbytes      size of the string table's UTF-8 data
+    lengths     `nstrings` integers, length of each string (in code points)
+    strings     `nbytes` bytes, the strings of the table, concatenated
+    ops         `nops` bytes, one opcode per element
+    operands    `noperands` integers of `width` bytes, the operands of the
+                opcodes taking one, in order
+
+Strings are deduplicated, each distinct string is stored once in the table
+and referred to by its index.
+
+NOTE: lazy contents of the section (see `Section.emitln_many`) are consumed
+when it is encoded.
+"""
+import struct
+import sys
+from array import array
+from itertools import accumulate, repeat
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from gcgen.emitter.section import (
+    Hole,
+    LazyLines,
+    LazySections,
+    Section,
+    SectionBuf,
+    SectionElem,
+    SectionError,
+)
+from gcgen.emitter.special_chars import CtrlChr, Padding
+
+
+MAGIC = b"GCSE"
+VERSION = 1
+
+# set if the section, and thus the encoding, holds only non-empty strings,
+# newlines and freshlines (see `Section.simple`).
+FLAG_SIMPLE = 0x01
+
+# opcodes, those marked (*) take one operand
+OP_STR = 0  # (*) string, by index in the string table
+OP_LINE = 1  # (*) string, by index, followed by a newline
+OP_NEWLINE = 2
+OP_FRESHLINE = 3
+OP_INDENT = 4
+OP_DEDENT = 5
+OP_PADDING = 6  # (*) number of lines
+OP_BEGIN = 7  # start of a sub-section
+OP_END = 8  # end of a sub-section
+OP_HOLE = 9  # (*) name, by index in the string table
+
+_HEADER = struct.Struct("<4sBBB4I")
+
+# typecode of unsigned 32-bit integers
+_U32 = "I" if array("I").itemsize == 4 else "L"
+# operand size => typecode
+_TYPECODES = {1: "B", 2: "H", 4: _U32}
+
+_CTRL_OPS = {
+    CtrlChr.Newline: OP_NEWLINE,
+    CtrlChr.Freshline: OP_FRESHLINE,
+    CtrlChr.Indent: OP_INDENT,
+    CtrlChr.Dedent: OP_DEDENT,
+}
+_OP_CTRLS = {op: ctrl for ctrl, op in _CTRL_OPS.items()}
+_AT_LINE_START = (OP_LINE, OP_NEWLINE, OP_FRESHLINE)
+# keyed by id, hashing enum members is slow
+_SIMPLE_OPS = {id(CtrlChr.Newline): OP_NEWLINE, id(CtrlChr.Freshline): OP_FRESHLINE}
+
+
+class SectionDecodeError(SectionError):
+    msg = "invalid or unsupported encoded section"
+
+
+def _uint_bytes(a: array, width: int = 4) -> bytes:
+    if a.itemsize != width:
+        a = array(_TYPECODES[width], a)
+    if sys.byteorder != "little" and width > 1:
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+
+def _uint_array(data: memoryview, width: int = 4) -> array:
+    a = array(_TYPECODES[width])
+    a.frombytes(data)
+    if sys.byteorder != "little" and width > 1:
+        a.byteswap()
+    return a
+
+
+def encode_section(section: Section) -> bytes:
+    """Encode `section`, including its sub-sections."""
+    if section.simple:
+        return _encode_simple(section._buf)
+    ops = array("B")
+    operands = array(_U32)
+    # string => index, in order of first use
+    table: Dict[str, int] = {}
+    intern = table.setdefault
+    simple = True
+
+    op = ops.append
+    operand = operands.append
+    # iterators over the elements of the sections being encoded, the
+    # innermost last.
+    stack: List[Iterator[SectionElem]] = [iter(section._buf)]
+    while stack:
+        for elem in stack[-1]:
+            if elem.__class__ is str:
+                op(OP_STR)
+                operand(intern(elem, len(table)))  # type: ignore
+            elif elem is CtrlChr.Newline:
+                if ops and ops[-1] == OP_STR:
+                    ops[-1] = OP_LINE
+                else:
+                    op(OP_NEWLINE)
+            elif elem is CtrlChr.Freshline:
+                # as `Section.freshline`, also for those of lazy sections
+                if not ops or ops[-1] not in _AT_LINE_START:
+                    op(OP_FRESHLINE)
+            elif isinstance(elem, CtrlChr):
+                simple = False
+                op(_CTRL_OPS[elem])
+            elif isinstance(elem, Section):
+                simple = False
+                op(OP_BEGIN)
+                stack.append(iter(elem._buf))
+                break
+            elif isinstance(elem, LazyLines):
+                simple = False
+                stack.append(_LazyIter(elem.iterator()))
+                break
+            elif isinstance(elem, LazySections):
+                simple = False
+                stack.append(_LazyIter(_lazy_sections(elem)))
+                break
+            elif isinstance(elem, Padding):
+                simple = False
+                op(OP_PADDING)
+                operand(elem.numlines)
+            elif isinstance(elem, Hole):
+                simple = False
+                op(OP_HOLE)
+                operand(intern(elem.name, len(table)))
+            else:
+                raise TypeError(f"cannot encode section element {elem!r}")
+        else:
+            it = stack.pop()
+            if stack and not isinstance(it, _LazyIter):
+                # end of a sub-section (lazy contents are encoded in-line)
+                op(OP_END)
+
+    if "" in table:
+        # empty strings write prefix & indentation, see `Section.emit`
+        simple = False
+    return _pack(FLAG_SIMPLE if simple else 0, list(table), ops, operands)
+
+
+def _encode_simple(buf: SectionBuf) -> bytes:
+    # only strings, newlines and freshlines, encoded in bulk
+    ops = bytes(map(_SIMPLE_OPS.get, map(id, buf), repeat(OP_STR)))
+    strs = [e for e in buf if e.__class__ is str]
+    strings = list(dict.fromkeys(strs))
+    index = {s: i for i, s in enumerate(strings)}
+    typecode = _TYPECODES[_width(len(strings))]
+    operands = array(typecode, list(map(index.__getitem__, strs)))
+    return _pack(FLAG_SIMPLE, strings, ops, operands)
+
+
+def _width(top: int) -> int:
+    """Size of operands up to `top`."""
+    return 1 if top < 0x100 else 2 if top < 0x10000 else 4
+
+
+def _pack(flags: int, strings: List[str], ops: Sequence[int], operands: array) -> bytes:
+    data = "".join(strings).encode("utf-8", "surrogatepass")
+    lengths = array(_U32, map(len, strings))
+    width = operands.itemsize
+    if operands.typecode == _U32:
+        # pick the smallest size fitting all operands
+        width = _width(max(operands, default=0))
+    return b"".join(
+        (
+            _HEADER.pack(
+                MAGIC,
+                VERSION,
+                flags,
+                width,
+                len(strings),
+                len(ops),
+                len(operands),
+                len(data),
+            ),
+            _uint_bytes(lengths),
+            data,
+            bytes(ops),
+            _uint_bytes(operands, width),
+        )
+    )
+
+
+class _LazyIter:
+    """Marks iterators over lazy contents of a section, which end no sub-section."""
+
+    __slots__ = "_it"
+
+    def __init__(self, it: Iterator[SectionElem]) -> None:
+        self._it = it
+
+    def __iter__(self) -> "_LazyIter":
+        return self
+
+    def __next__(self) -> SectionElem:
+        return next(self._it)
+
+
+def _lazy_sections(lazy: LazySections) -> Iterator[SectionElem]:
+    # each section starts on a fresh line, as with `add_section`
+    for section in lazy._take():
+        yield CtrlChr.Freshline
+        yield section
+
+
+def _read(data: bytes) -> Tuple[int, List[str], bytes, array]:
+    """Split encoded section `data` into (flags, strings, ops, operands)."""
+    view = memoryview(data)
+    try:
+        header = _HEADER.unpack_from(view)
+    except struct.error:
+        raise SectionDecodeError from None
+    magic, version, flags, width, nstrings, nops, noperands, nbytes = header
+    if magic != MAGIC or version != VERSION or width not in _TYPECODES:
+        raise SectionDecodeError
+    pos = _HEADER.size
+    end = pos + 4 * nstrings + nbytes + nops + width * noperands
+    if end != len(data):
+        raise SectionDecodeError
+    end = pos + 4 * nstrings
+    lengths = _uint_array(view[pos:end])
+    pos, end = end, end + nbytes
+    try:
+        text = bytes(view[pos:end]).decode("utf-8", "surrogatepass")
+    except UnicodeDecodeError:
+        raise SectionDecodeError from None
+    pos, end = end, end + nops
+    ops = bytes(view[pos:end])
+    pos, end = end, end + width * noperands
+    operands = _uint_array(view[pos:end], width)
+    offsets = list(accumulate(lengths, initial=0))
+    strings = [text[offsets[i] : offsets[i + 1]] for i in range(nstrings)]
+    return flags, strings, ops, operands
+
+
+def decode_section(data: bytes) -> Section:
+    """Decode a section encoded by `encode_section`.
+
+    Raises:
+        SectionDecodeError: if `data` is not an encoded section, or was encoded
+            by an unsupported version.
+    """
+    _, strings, ops, operands = _read(data)
+    nl, fl = CtrlChr.Newline, CtrlChr.Freshline
+    args = iter(operands)
+    root = section = Section()
+    buf: SectionBuf = section._buf
+    bappend = buf.append
+    parents: List[Section] = []
+    try:
+        for op in ops:
+            if op == OP_LINE:
+                bappend(strings[next(args)])
+                bappend(nl)
+            elif op == OP_STR:
+                bappend(strings[next(args)])
+            elif op == OP_NEWLINE:
+                bappend(nl)
+            elif op == OP_FRESHLINE:
+                bappend(fl)
+            elif op == OP_INDENT:
+                bappend(CtrlChr.Indent)
+                section._indent_level += 1
+            elif op == OP_DEDENT:
+                bappend(CtrlChr.Dedent)
+                section._indent_level -= 1
+            elif op == OP_PADDING:
+                bappend(Padding(next(args)))
+            elif op == OP_HOLE:
+                bappend(Hole(strings[next(args)]))
+            elif op == OP_BEGIN:
+                sub = Section()
+                bappend(sub)
+                section._children.append(sub)
+                parents.append(section)
+                section, buf = sub, sub._buf
+                bappend = buf.append
+            elif op == OP_END:
+                _finish(section)
+                section = parents.pop()
+                buf = section._buf
+                bappend = buf.append
+            else:
+                raise SectionDecodeError
+    except (IndexError, StopIteration):
+        raise SectionDecodeError from None
+    if parents:
+        raise SectionDecodeError
+    _finish(root)
+    return root
+
+
+def _finish(section: Section) -> None:
+    """Set the counts and flags of decoded `section` from its contents.
+
+    Its sub-sections are already finished, their counts are added.
+    """
+    buf = section._buf
+    strs = [e for e in buf if e.__class__ is str]
+    children, section._children = section._children, []
+    nlines = buf.count(CtrlChr.Newline) + buf.count(CtrlChr.Freshline)
+    section._nchars = sum(map(len, strs))
+    section._nlines = nlines
+    section._simple = len(strs) + nlines == len(buf) and "" not in strs
+    for child in children:
+        section._adopt(child)
+
+
+def iter_encoded(data: bytes) -> Iterator[SectionElem]:
+    """Iterate the elements of an encoded section, as `Section.iterator` would.
+
+    Holes and the nesting of sub-sections are skipped, no section is built.
+    """
+    _, strings, ops, operands = _read(data)
+    return _iter_ops(strings, ops, operands)
+
+
+def _iter_ops(strings: List[str], ops: bytes, operands: array) -> Iterator[SectionElem]:
+    nl = CtrlChr.Newline
+    ctrls = _OP_CTRLS
+    args = iter(operands)
+    for op in ops:
+        if op == OP_LINE:
+            yield strings[next(args)]
+            yield nl
+        elif op == OP_STR:
+            yield strings[next(args)]
+        elif op in ctrls:
+            yield ctrls[op]
+        elif op == OP_PADDING:
+            yield Padding(next(args))
+        elif op == OP_HOLE:
+            next(args)
+        elif op != OP_BEGIN and op != OP_END:
+            raise SectionDecodeError
+
+
+__all__ = [
+    "SectionDecodeError",
+    "decode_section",
+    "encode_section",
+    "iter_encoded",
+]
@@ -1,8 +1,9 @@
-from typing import Protocol, TYPE_CHECKING
+from typing import Iterable, List, Optional, Protocol, TYPE_CHECKING
+from gcgen.emitter import codec
 from gcgen.emitter.special_chars import Padding, CtrlChr
 
 if TYPE_CHECKING:
-    from gcgen.emitter.section import Section
+    from gcgen.emitter.section import Section, SectionElem
 
 
 class Writer(Protocol):
@@ -10,29 +11,200 @@ class Writer(Protocol):
         ...
 
 
+_SIMPLE_TEXT = {CtrlChr.Newline: "\n", CtrlChr.Freshline: "\n"}
+
+
+class EmitterConfig:
+    """Output settings shared by all emitters of a file type.
+
+    Args:
+        indent_by: string to indent lines by, once per indentation level. If
+            None, the value of `gcgen_indent_by` for the file type is used.
+        newline: line ending to write.
+        trim_trailing_ws: if true, trailing spaces and tabs are removed from
+            emitted lines.
+        encoding: encoding of the files written.
+    """
+
+    __slots__ = "indent_by", "newline", "trim_trailing_ws", "encoding"
+
+    def __init__(
+        self,
+        indent_by: Optional[str] = " ",
+        newline: str = "\n",
+        trim_trailing_ws: bool = False,
+        encoding: str = "utf-8",
+    ):
+        self.indent_by = indent_by
+        self.newline = newline
+        self.trim_trailing_ws = trim_trailing_ws
+        self.encoding = encoding
+
+    def __repr__(self) -> str:
+        return (
+            f"EmitterConfig(indent_by={self.indent_by!r}, newline={self.newline!r}, "
+            f"trim_trailing_ws={self.trim_trailing_ws!r}, encoding={self.encoding!r})"
+        )
+
+
+class EmitState:
+    """State of an emitter between calls to `Emitter.feed`."""
+
+    __slots__ = "fresh", "padding", "nls", "level", "started", "trailing"
+
+    def __init__(self) -> None:
+        self.fresh: bool = True
+        self.padding: int = 0
+        self.nls: int = 0
+        self.level: int = 0
+        self.started: bool = False
+        # whitespace held back until it is known not to end a line
+        self.trailing: str = ""
+
+
+class _TrimWriter:
+    """Writer dropping whitespace preceding line endings."""
+
+    __slots__ = "_w", "_state", "_newline"
+
+    def __init__(self, w: Writer, state: EmitState, newline: str):
+        self._w = w
+        self._state = state
+        self._newline = newline
+
+    def write(self, e: str):
+        state = self._state
+        if e.startswith(self._newline):
+            state.trailing = ""
+            self._w.write(e)
+            return
+        stripped = e.rstrip(" \t")
+        if not stripped:
+            state.trailing += e
+            return
+        if state.trailing:
+            self._w.write(state.trailing)
+        self._w.write(stripped)
+        state.trailing = e[len(stripped) :]
+
+
 class Emitter:
-    __slots__ = "_prefix", "_indent_by"
+    __slots__ = "_prefix", "_indent_by", "_newline", "_trim", "_indents"
 
-    def __init__(self, *, prefix: str, indent_by: str = " "):
+    def __init__(
+        self,
+        *,
+        prefix: str,
+        indent_by: str = " ",
+        newline: str = "\n",
+        trim_trailing_ws: bool = False,
+    ):
         self._prefix = prefix
         self._indent_by = indent_by
+        self._newline = newline
+        self._trim = trim_trailing_ws
+        # prefix and indentation of each indentation level seen so far
+        self._indents: List[str] = [prefix]
+
+    @classmethod
+    def from_config(cls, config: EmitterConfig, prefix: str) -> "Emitter":
+        return cls(
+            prefix=prefix,
+            indent_by=config.indent_by if config.indent_by is not None else " ",
+            newline=config.newline,
+            trim_trailing_ws=config.trim_trailing_ws,
+        )
+
+    def indentation(self, level: int) -> str:
+        """Get prefix and indentation of lines at indentation `level`."""
+        indents = self._indents
+        while len(indents) <= level:
+            indents.append(indents[-1] + self._indent_by)
+        return indents[level]
 
     def emit(self, s: "Section", w: Writer) -> None:
-        fresh: bool = True
-        padding: int = 0
-        nls: int = 0
-        indent_by: str = self._indent_by
-        prefix: str = self._prefix
-        level: int = 0
-
-        for ndx, elem in enumerate(s.iterator()):
+        if s.simple:
+            w.write(self.emit_simple(s))
+            return
+        state = EmitState()
+        self.feed(state, s.iterator(), w)
+        self.finish(state, w)
+
+    def emit_simple(self, s: "Section") -> str:
+        """Render a simple section (see `Section.simple`) in bulk."""
+        buf = s._buf
+        get = _SIMPLE_TEXT.get
+        out = "".join([get(elem, elem) for elem in buf])  # type: ignore
+        if buf and buf[0] is CtrlChr.Freshline:
+            # a freshline is never added after a newline or another freshline,
+            # so it ends a line, unless it is the first element.
+            out = out[1:]
+        return self._finish_simple(out)
+
+    def _finish_simple(self, out: str) -> str:
+        prefix = self._prefix
+        newline = self._newline
+        if not out or (not prefix and not self._trim and newline == "\n"):
+            return out
+        lines = out.split("\n")
+        if prefix:
+            # only lines with contents are prefixed
+            lines = [prefix + ln if ln else ln for ln in lines]
+        if self._trim:
+            lines = [ln.rstrip(" \t") for ln in lines]
+        return newline.join(lines)
+
+    def emit_encoded(self, data: bytes, w: Writer) -> None:
+        """Emit a section encoded by `codec.encode_section`, without decoding it."""
+        flags, strings, ops, operands = codec._read(data)
+        if flags & codec.FLAG_SIMPLE:
+            # only strings, newlines and freshlines (see `emit_simple`)
+            pieces: List[str] = []
+            append = pieces.append
+            args = iter(operands)
+            for op in ops:
+                if op == codec.OP_LINE:
+                    append(strings[next(args)])
+                    append("\n")
+                elif op == codec.OP_STR:
+                    append(strings[next(args)])
+                else:
+                    append("\n")
+            out = "".join(pieces)
+            if ops and ops[0] == codec.OP_FRESHLINE:
+                out = out[1:]
+            w.write(self._finish_simple(out))
+            return
+        state = EmitState()
+        self.feed(state, codec._iter_ops(strings, ops, operands), w)
+        self.finish(state, w)
+
+    def feed(self, state: EmitState, elems: Iterable["SectionElem"], w: Writer) -> None:
+        """Write `elems` to `w`, continuing from (and updating) `state`.
+
+        Used to emit a section incrementally, call `finish` once all
+        elements have been fed to the emitter.
+        """
+        fresh = state.fresh
+        padding = state.padding
+        nls = state.nls
+        level = state.level
+        started = state.started
+        newline = self._newline
+        indents = self._indents
+        if self._trim:
+            w = _TrimWriter(w, state, newline)
+
+        for elem in elems:
             if isinstance(elem, Padding):
-                if ndx == 0 or elem.numlines < padding:
+                if not started or elem.numlines < padding:
+                    started = True
                     continue
                 fresh = True
                 padding = elem.numlines
                 continue
-            elif elem == CtrlChr.Newline:
+            started = True
+            if elem == CtrlChr.Newline:
                 nls += 1
                 fresh = True
                 continue
@@ -54,19 +226,33 @@ class Emitter:
                 continue
             elif isinstance(elem, str):
                 if padding:
-                    w.write("\n" * max(nls, padding + 1))
+                    w.write(newline * max(nls, padding + 1))
                     padding = nls = 0
                     fresh = True
                 elif nls:
-                    w.write("\n" * nls)
+                    w.write(newline * nls)
                     padding = nls = 0
                     fresh = True
 
                 if fresh:
                     fresh = False
-                    w.write(prefix)
-                    w.write(indent_by * level)
+                    w.write(
+                        indents[level]
+                        if level < len(indents)
+                        else self.indentation(level)
+                    )
                 w.write(elem)
 
-        if nls:
-            w.write("\n" * nls)
+        state.fresh = fresh
+        state.padding = padding
+        state.nls = nls
+        state.level = level
+        state.started = started
+
+    def finish(self, state: EmitState, w: Writer) -> None:
+        """Write any output still pending after the last call to `feed`."""
+        if state.nls:
+            w.write(self._newline * state.nls)
+            state.nls = 0
+        # trailing whitespace at the end of the output is dropped
+        state.trailing = ""
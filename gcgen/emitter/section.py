@@ -1,4 +1,4 @@
-from typing import List, Union, NewType, Iterator
+from typing import Iterable, List, Optional, Union, NewType, Iterator
 from gcgen.emitter.special_chars import CtrlChr, Padding
 
 
@@ -10,7 +10,87 @@ class SectionDedentError(SectionError):
     msg = "dedent called too many times - trying to dedent out of minimum indentation"
 
 
-SectionElem = Union[str, "Section", CtrlChr, Padding]
+def _validate(elems: Iterable[str]) -> None:
+    for elem in elems:
+        if not isinstance(elem, str):
+            raise TypeError(f"got {type(elem)}, expected str (val: {repr(elem)})")
+        if "\n" in elem:
+            raise ValueError(f"string contains newline (val: {repr(elem)})")
+
+
+class SectionConsumedError(SectionError):
+    msg = "lazy section contents (see `emitln_many`/`extend_from`) can only be emitted once"
+
+
+class Lazy:
+    """Section contents produced from an iterable when the section is emitted."""
+
+    __slots__ = "_it"
+
+    def __init__(self, it: Iterable) -> None:
+        self._it: Optional[Iterable] = it
+
+    def _take(self) -> Iterable:
+        it = self._it
+        if it is None:
+            raise SectionConsumedError
+        self._it = None
+        return it
+
+    def iterator(self) -> Iterator["SectionElem"]:
+        raise NotImplementedError
+
+    def __str__(self) -> str:
+        # never consume the iterable, it may only be emitted once
+        return f"<{type(self).__name__.upper()}>"
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+class LazyLines(Lazy):
+    """Lines to emit, each followed by a newline (see `Section.emitln_many`)."""
+
+    __slots__ = ()
+
+    def iterator(self) -> Iterator["SectionElem"]:
+        nl = CtrlChr.Newline
+        for line in self._take():
+            if not isinstance(line, str):
+                raise TypeError(f"got {type(line)}, expected str (val: {repr(line)})")
+            yield line.replace("\n", "\\n")
+            yield nl
+
+
+class LazySections(Lazy):
+    """Sections to emit in order (see `Section.extend_from`)."""
+
+    __slots__ = ()
+
+    def iterator(self) -> Iterator["SectionElem"]:
+        fl = CtrlChr.Freshline
+        for section in self._take():
+            # as with `add_section`, each section starts on a fresh line.
+            yield fl
+            yield from section.iterator()
+
+
+class Hole:
+    """Named placeholder filled in when rendering a `Template`."""
+
+    __slots__ = "name"
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __str__(self) -> str:
+        return f"<HOLE({self.name})>"
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+SectionElem = Union[str, "Section", CtrlChr, Padding, Lazy, Hole]
 SectionBuf = NewType("SectionBuf", List[SectionElem])
 
 
@@ -32,16 +112,98 @@ class Section:
     more variable definitions to the start of a function as it becomes
     necessary.
     """
-    __slots__ = "_buf", "_indent_level"
+    __slots__ = (
+        "_buf",
+        "_indent_level",
+        "_simple",
+        "_nlines",
+        "_nchars",
+        "_nsections",
+        "_children",
+        "_parents",
+    )
+
+    # if true, `emit_raw` and `emit_lines` validate their input (see `emit`),
+    # enabled when running with debug logging.
+    debug = False
 
     def __init__(self) -> None:
         self._buf: SectionBuf = SectionBuf([])
         # to ensure indent/dedent is balanced within a section
         self._indent_level = 0
+        # true while the section holds only non-empty strings, newlines and
+        # freshlines, allowing the emitter to write it in bulk.
+        self._simple = True
+        # running counts of the contents added to this section, including
+        # sub-sections, see `lines`, `chars` & `sections`. Kept up-to-date
+        # as contents are added, including to sub-sections.
+        self._nlines = 0
+        self._nchars = 0
+        self._nsections = 0
+        # sub-sections, in order of addition
+        self._children: List[Section] = []
+        # sections this section was added to, if any
+        self._parents: Optional[List[Section]] = None
+
+    @property
+    def simple(self) -> bool:
+        """True if section has no sub-sections, indentation, padding or empty strings."""
+        return self._simple
+
+    def _propagate(self, nlines: int, nchars: int, nsections: int) -> None:
+        """Add to the counts of the sections containing this section."""
+        stack = list(self._parents or ())
+        while stack:
+            s = stack.pop()
+            s._nlines += nlines
+            s._nchars += nchars
+            s._nsections += nsections
+            if s._parents:
+                stack.extend(s._parents)
+
+    def _adopt(self, s: "Section") -> None:
+        """Record `s` as sub-section, counting its contents."""
+        self._children.append(s)
+        if s._parents is None:
+            s._parents = [self]
+        else:
+            s._parents.append(self)
+        self._nlines += s._nlines
+        self._nchars += s._nchars
+        self._nsections += s._nsections + 1
+        if self._parents is not None:
+            self._propagate(s._nlines, s._nchars, s._nsections + 1)
+
+    @property
+    def lines(self) -> int:
+        """Number of newlines and freshlines added, including sub-sections.
+
+        An upper bound of the number of lines of the output, which is known
+        without emitting the section. Lazy contents (see `emitln_many`) are
+        not counted.
+        """
+        return self._nlines
+
+    @property
+    def chars(self) -> int:
+        """Number of characters of the strings added, including sub-sections.
+
+        Excludes newlines, indentation and prefixes. Lazy contents (see
+        `emitln_many`) are not counted.
+        """
+        return self._nchars
+
+    @property
+    def sections(self) -> int:
+        """Number of sub-sections, including those nested in sub-sections."""
+        return self._nsections
 
     def newline(self) -> "Section":
         """add a newline."""
         self._buf.append(CtrlChr.Newline)
+        self._nlines += 1
+        if self._parents is not None:
+            self._propagate(1, 0, 0)
         return self
 
     def nl(self) -> "Section":
@@ -52,6 +214,9 @@ class Section:
         if self._buf and self._buf[-1] in (CtrlChr.Freshline, CtrlChr.Newline):
             return self
         self._buf.append(CtrlChr.Freshline)
+        self._nlines += 1
+        if self._parents is not None:
+            self._propagate(1, 0, 0)
         return self
 
     def fl(self) -> "Section":
@@ -67,6 +232,8 @@ class Section:
         """
         self.freshline()
         self._buf.append(s)
+        self._adopt(s)
+        self._simple = False
         return self
 
     def indent(self) -> "Section":
@@ -78,6 +245,7 @@ class Section:
         contents already written to it (using `emit`).
         """
         self._buf.append(CtrlChr.Indent)
+        self._simple = False
         self._indent_level += 1
         return self
 
@@ -90,6 +258,7 @@ class Section:
         contents already written to it (using `emit`).
         """
         self._buf.append(CtrlChr.Dedent)
+        self._simple = False
         self._indent_level -= 1
         if self._indent_level < 0:
             raise SectionDedentError
@@ -101,21 +270,104 @@ class Section:
         NOTE: if this is the top-level buffer and it is empty, this becomes a NO-OP
         """
         self._buf.append(Padding(nlines))
+        self._simple = False
         return self
 
     def emit(self, *elems: str) -> "Section":
         """Emit one or more string elements."""
         bappend = self._buf.append
+        nchars = 0
         for elem in elems:
             if not isinstance(elem, str):
                 raise TypeError(f"got {type(elem)}, expected str (val: {repr(elem)})")
-            bappend(elem.replace("\n", "\\n"))
+            if not elem:
+                # emitted at the start of a line, writes prefix & indentation
+                self._simple = False
+            elem = elem.replace("\n", "\\n")
+            nchars += len(elem)
+            bappend(elem)
+        self._nchars += nchars
+        if self._parents is not None:
+            self._propagate(0, nchars, 0)
+        return self
+
+    def emit_raw(self, *elems: str) -> "Section":
+        """Emit one or more string elements without validating them.
+
+        Elements must be strings containing no newlines, unlike `emit`, which
+        checks and escapes each element, elements are added as-is.
+        """
+        if self.debug:
+            _validate(elems)
+        self._buf.extend(elems)
+        nchars = sum(map(len, elems))
+        self._nchars += nchars
+        if self._parents is not None:
+            self._propagate(0, nchars, 0)
+        if "" in elems:
+            self._simple = False
+        return self
+
+    def emit_lines(self, lines: Iterable[str]) -> "Section":
+        """Emit each string of `lines` followed by a newline.
+
+        Like `emit_raw`, lines are added as-is and must contain no newlines.
+        """
+        lines = lines if isinstance(lines, list) else list(lines)
+        if self.debug:
+            _validate(lines)
+        elems: List[SectionElem] = [CtrlChr.Newline] * (2 * len(lines))
+        elems[::2] = lines
+        self._buf.extend(elems)
+        nchars = sum(map(len, lines))
+        self._nlines += len(lines)
+        self._nchars += nchars
+        if self._parents is not None:
+            self._propagate(len(lines), nchars, 0)
+        if "" in lines:
+            self._simple = False
+        return self
+
+    def hole(self, name: str) -> "Section":
+        """Add a placeholder named `name`, see `Template`.
+
+        Holes are filled in when rendering a template compiled from the
+        section. When emitting the section itself, holes are skipped.
+        """
+        self._buf.append(Hole(name))
+        self._simple = False
+        return self
+
+    def emitln_many(self, lines: Iterable[str]) -> "Section":
+        """Emit each string of `lines` followed by a newline.
+
+        `lines` is consumed lazily, when the section is emitted, and is written
+        straight to the output, so a generator producing the lines never needs
+        to hold all of them in memory. As a consequence, the section can only
+        be emitted once.
+        """
+        self._buf.append(LazyLines(lines))
+        self._simple = False
+        return self
+
+    def extend_from(self, sections: Iterable["Section"]) -> "Section":
+        """Add each section of `sections`, as if by `add_section`.
+
+        Like `emitln_many`, `sections` is consumed lazily when the section is
+        emitted, and can thus only be emitted once.
+        """
+        self.freshline()
+        self._buf.append(LazySections(sections))
+        self._simple = False
         return self
 
     def emitln(self, *elems: str) -> "Section":
         """Emit one or more string elements followed by a newline."""
         self.emit(*elems)
         self._buf.append(CtrlChr.Newline)
+        self._nlines += 1
+        if self._parents is not None:
+            self._propagate(1, 0, 0)
         return self
 
     def emitln_r(self, *elems: str) -> "Section":
@@ -138,7 +390,7 @@ class Section:
 
     def iterator(self) -> Iterator[SectionElem]:
         for elem in self._buf:
-            if isinstance(elem, Section):
+            if isinstance(elem, (Section, Lazy)):
                 yield from elem.iterator()
             else:
                 yield elem
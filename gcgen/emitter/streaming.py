@@ -0,0 +1,94 @@
+from typing import Iterable
+
+from gcgen.emitter.emitter import Emitter, EmitState, Writer
+from gcgen.emitter.section import Section
+
+
+class StreamingSection(Section):
+    """A section which writes its contents to `w` as it is being built.
+
+    Buffered elements are fed to the emitter once the buffer holds
+    `flush_at` or more elements, keeping memory use bounded regardless of
+    the size of the output.
+
+    Sub-sections added using `add_section` act as placeholders which may be
+    filled in later, so once a sub-section is added, it and everything after
+    it remains buffered until `close` is called.
+
+    NOTE: call `close` once done to write any remaining contents.
+    """
+
+    __slots__ = "_emitter", "_writer", "_state", "_held", "_flush_at"
+
+    def __init__(self, emitter: Emitter, w: Writer, flush_at: int = 4096) -> None:
+        super().__init__()
+        self._emitter = emitter
+        self._writer = w
+        self._state = EmitState()
+        self._held = False
+        self._flush_at = flush_at
+
+    def __reduce__(self) -> tuple:
+        # its contents are written as they are built
+        raise TypeError("cannot pickle a StreamingSection")
+
+    def flush(self) -> None:
+        """Write all buffered elements preceding the first sub-section."""
+        if self._held or not self._buf:
+            return
+        self._emitter.feed(self._state, self.iterator(), self._writer)
+        self._buf.clear()
+
+    def emit(self, *elems: str) -> "Section":
+        super().emit(*elems)
+        if len(self._buf) >= self._flush_at:
+            self.flush()
+        return self
+
+    def emitln(self, *elems: str) -> "Section":
+        super().emitln(*elems)
+        if len(self._buf) >= self._flush_at:
+            self.flush()
+        return self
+
+    def emit_raw(self, *elems: str) -> "Section":
+        super().emit_raw(*elems)
+        if len(self._buf) >= self._flush_at:
+            self.flush()
+        return self
+
+    def emit_lines(self, lines: Iterable[str]) -> "Section":
+        super().emit_lines(lines)
+        if len(self._buf) >= self._flush_at:
+            self.flush()
+        return self
+
+    def emitln_many(self, lines: Iterable[str]) -> "Section":
+        super().emitln_many(lines)
+        self.flush()
+        return self
+
+    def extend_from(self, sections: Iterable["Section"]) -> "Section":
+        super().extend_from(sections)
+        self.flush()
+        return self
+
+    def newline(self) -> "Section":
+        super().newline()
+        if len(self._buf) >= self._flush_at:
+            self.flush()
+        return self
+
+    def add_section(self, s: "Section") -> "Section":
+        self.freshline()
+        self.flush()
+        self._held = True
+        self._buf.append(s)
+        self._adopt(s)
+        return self
+
+    def close(self) -> None:
+        """Write all remaining contents, including those of sub-sections."""
+        self._emitter.feed(self._state, self.iterator(), self._writer)
+        self._emitter.finish(self._state, self._writer)
+        self._buf.clear()
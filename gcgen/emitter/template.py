@@ -0,0 +1,119 @@
+from typing import Dict, FrozenSet, List, Tuple, Union
+from gcgen.emitter.section import Hole, Section, SectionBuf, SectionElem
+from gcgen.emitter.special_chars import CtrlChr
+
+
+HoleValue = Union[str, Section]
+
+
+class Template:
+    """A section compiled for repeated rendering with different values.
+
+    The section is flattened once, merging adjacent strings and resolving
+    nested sections, such that rendering only copies the compiled elements
+    and fills in the holes (see `Section.hole`).
+
+    Example:
+    ```
+    s = Section()
+    s.emit("def get_").hole("name").emitln("(self):").indent()
+    s.emit("return self._").hole("name").newline()
+    getter = Template(s)
+
+    for field in fields:
+        sec.add_section(getter.render(name=field))
+    ```
+
+    NOTE: lazy contents of the section (see `Section.emitln_many`) are
+    consumed when the template is compiled.
+
+    Args:
+        section: the section to compile, later changes to it do not affect
+            the template.
+    """
+
+    __slots__ = (
+        "_elems",
+        "_holes",
+        "_names",
+        "_simple",
+        "_indent_level",
+        "_nlines",
+        "_nchars",
+    )
+
+    def __init__(self, section: Section) -> None:
+        elems: List[SectionElem] = []
+        holes: List[Tuple[int, str]] = []
+        simple = True
+        for elem in section.iterator():
+            if isinstance(elem, str):
+                if elems and isinstance(elems[-1], str):
+                    elems[-1] += elem
+                    continue
+                if not elem:
+                    simple = False
+            elif isinstance(elem, Hole):
+                holes.append((len(elems), elem.name))
+            elif elem is CtrlChr.Freshline:
+                if elems and elems[-1] in (CtrlChr.Freshline, CtrlChr.Newline):
+                    continue
+            elif elem is not CtrlChr.Newline:
+                simple = False
+            elems.append(elem)
+        self._elems = elems
+        self._holes = holes
+        self._names: FrozenSet[str] = frozenset(name for _, name in holes)
+        self._simple = simple
+        self._indent_level = section._indent_level
+        self._nlines = sum(
+            1 for e in elems if e is CtrlChr.Newline or e is CtrlChr.Freshline
+        )
+        self._nchars = sum(len(e) for e in elems if isinstance(e, str))
+
+    @property
+    def names(self) -> FrozenSet[str]:
+        """Names of the holes of the template."""
+        return self._names
+
+    def render(self, **values: HoleValue) -> Section:
+        """Render template to a new section, filling each hole with its value.
+
+        Args:
+            values: value of each hole by name. Strings are emitted (as by
+                `Section.emit`), sections are inserted in place.
+
+        Returns:
+            The rendered section, which may be added to other sections.
+        """
+        elems = self._elems.copy()
+        simple = self._simple
+        nchars = self._nchars
+        children = []
+        for ndx, name in self._holes:
+            try:
+                val = values[name]
+            except KeyError:
+                raise KeyError(f"no value given for template hole {name!r}") from None
+            if isinstance(val, str):
+                if not val:
+                    simple = False
+                elems[ndx] = val = val.replace("\n", "\\n")
+                nchars += len(val)
+            elif isinstance(val, Section):
+                elems[ndx] = val
+                children.append(val)
+                simple = False
+            else:
+                raise TypeError(
+                    f"hole {name!r}: got {type(val)}, expected str or Section"
+                )
+        s = Section()
+        s._buf = SectionBuf(elems)
+        s._indent_level = self._indent_level
+        s._simple = simple
+        s._nlines = self._nlines
+        s._nchars = nchars
+        for child in children:
+            s._adopt(child)
+        return s
@@ -0,0 +1,222 @@
+"""
+Fingerprint snippet & generator functions to detect changes to their implementation.
+
+A function's fingerprint covers its bytecode and constants, the functions of
+the same module it calls and, transitively, the source of every project
+module it uses (modules located in the project root, which is added to
+`sys.path` when running gcgen).
+"""
+import dataclasses
+import hashlib
+import sys
+from enum import Enum
+from pathlib import Path
+from types import CodeType, FunctionType, MethodType, ModuleType
+from typing import Any, Dict, Optional, Set
+
+
+class UnhashableError(TypeError):
+    def __init__(self, obj: Any):
+        self.obj = obj
+        super().__init__(f"cannot fingerprint object of type {type(obj).__qualname__}")
+
+
+_PRIMITIVES = (type(None), bool, int, float, complex, str, bytes)
+_CACHEABLE = (FunctionType, MethodType, ModuleType, type, Enum)
+
+
+class Fingerprinter:
+    """Compute (and cache) fingerprints of functions, modules and values.
+
+    Fingerprints are cached for the lifetime of the fingerprinter, create one
+    per run.
+
+    Args:
+        project_root: modules whose source file is located below this directory
+            (outside of any `site-packages` directory) are project modules.
+    """
+
+    def __init__(self, project_root: Path):
+        self.project_root = project_root.resolve()
+        self._modules: Dict[str, str] = {}
+        self._functions: Dict[int, Any] = {}
+        self._values: Dict[int, Any] = {}
+        self._in_project: Dict[str, bool] = {}
+        self._visiting: Set[int] = set()
+
+    def is_project_module(self, mod: ModuleType) -> bool:
+        name = mod.__name__
+        res = self._in_project.get(name)
+        if res is None:
+            res = False
+            fname = getattr(mod, "__file__", None)
+            if fname:
+                fpath = Path(fname).resolve()
+                try:
+                    rel = fpath.relative_to(self.project_root)
+                    res = "site-packages" not in rel.parts
+                except ValueError:
+                    pass
+            self._in_project[name] = res
+        return res
+
+    def _project_module_of(self, obj: Any) -> Optional[ModuleType]:
+        if isinstance(obj, ModuleType):
+            mod = obj
+        else:
+            modname = getattr(obj, "__module__", None)
+            if not isinstance(modname, str):
+                return None
+            mod = sys.modules.get(modname)
+            if mod is None:
+                return None
+        return mod if self.is_project_module(mod) else None
+
+    def module(self, mod: ModuleType) -> str:
+        """Fingerprint of module source and the project modules it uses."""
+        name = mod.__name__
+        fp = self._modules.get(name)
+        if fp is not None:
+            return fp
+        # placeholder, breaks import cycles
+        self._modules[name] = name
+
+        h = hashlib.sha1(name.encode("utf-8"))
+        fname = getattr(mod, "__file__", None)
+        if fname:
+            try:
+                h.update(Path(fname).read_bytes())
+            except OSError:
+                pass
+        deps = set()
+        for val in list(vars(mod).values()):
+            dep = self._project_module_of(val)
+            if dep is not None and dep is not mod:
+                deps.add(dep.__name__)
+        for dep in sorted(deps):
+            h.update(self.module(sys.modules[dep]).encode("utf-8"))
+
+        fp = self._modules[name] = h.hexdigest()
+        return fp
+
+    def _code(self, h, co: CodeType, fn_globals: dict, own: Optional[ModuleType]):
+        h.update(co.co_code)
+        h.update(repr((co.co_names, co.co_varnames, co.co_freevars)).encode("utf-8"))
+        for const in co.co_consts:
+            if isinstance(const, CodeType):
+                self._code(h, const, fn_globals, own)
+            else:
+                h.update(self.value(const))
+        own_name = getattr(own, "__name__", None)
+        for name in co.co_names:
+            if name not in fn_globals:
+                # builtin or attribute name
+                continue
+            val = fn_globals[name]
+            if isinstance(val, FunctionType) and val.__module__ == own_name:
+                h.update(self.function(val).encode("utf-8"))
+            elif isinstance(val, (FunctionType, type, ModuleType)):
+                dep = self._project_module_of(val)
+                if dep is not None:
+                    h.update(self.module(dep).encode("utf-8"))
+            else:
+                try:
+                    h.update(self.value(val))
+                except UnhashableError:
+                    dep = self._project_module_of(val) or own
+                    if dep is not None and self.is_project_module(dep):
+                        h.update(self.module(dep).encode("utf-8"))
+
+    def function(self, fn: Any) -> str:
+        """Fingerprint of function `fn`."""
+        key = id(fn)
+        cached = self._functions.get(key)
+        if cached is not None:
+            return cached[1]
+        if key in self._visiting:
+            # recursion, the function's own code is already being hashed
+            return getattr(fn, "__qualname__", "")
+        if isinstance(fn, MethodType):
+            fn = fn.__func__
+        code = getattr(fn, "__code__", None)
+        if code is None:
+            # not a plain Python function, e.g. a callable object
+            return hashlib.sha1(self.value(fn)).hexdigest()
+
+        self._visiting.add(key)
+        try:
+            h = hashlib.sha1(fn.__qualname__.encode("utf-8"))
+            own = sys.modules.get(fn.__module__)
+            self._code(h, code, fn.__globals__, own)
+            for default in (fn.__defaults__ or ()) + tuple(
+                (fn.__kwdefaults__ or {}).values()
+            ):
+                h.update(self.value(default))
+            for cell in fn.__closure__ or ():
+                try:
+                    h.update(self.value(cell.cell_contents))
+                except (ValueError, UnhashableError):
+                    h.update(b"?")
+        finally:
+            self._visiting.discard(key)
+        fp = h.hexdigest()
+        self._functions[key] = (fn, fp)
+        return fp
+
+    def value(self, obj: Any) -> bytes:
+        """Structural digest of a value.
+
+        Raises:
+            UnhashableError: if the value (or some part of it) cannot be digested.
+        """
+        typ = type(obj)
+        if typ in _PRIMITIVES:
+            return hashlib.sha1(f"{typ.__name__}:{obj!r}".encode("utf-8")).digest()
+
+        # only cache digests of objects which are not modified in the course of
+        # a run, containers are digested anew each time.
+        cacheable = isinstance(obj, _CACHEABLE)
+        if cacheable:
+            cached = self._values.get(id(obj))
+            if cached is not None:
+                return cached[1]
+
+        h = hashlib.sha1(f"{typ.__module__}.{typ.__qualname__}".encode("utf-8"))
+        if isinstance(obj, Enum):
+            h.update(obj.name.encode("utf-8"))
+        elif isinstance(obj, (list, tuple)):
+            for elem in obj:
+                h.update(self.value(elem))
+        elif isinstance(obj, dict):
+            for item in sorted(self.value(k) + self.value(v) for k, v in obj.items()):
+                h.update(item)
+        elif isinstance(obj, (set, frozenset)):
+            for item in sorted(self.value(elem) for elem in obj):
+                h.update(item)
+        elif isinstance(obj, (FunctionType, MethodType)):
+            h.update(self.function(obj).encode("utf-8"))
+        elif isinstance(obj, ModuleType):
+            h.update(
+                self.module(obj).encode("utf-8")
+                if self.is_project_module(obj)
+                else obj.__name__.encode("utf-8")
+            )
+        elif isinstance(obj, type):
+            h.update(obj.__qualname__.encode("utf-8"))
+            dep = self._project_module_of(obj)
+            if dep is not None:
+                h.update(self.module(dep).encode("utf-8"))
+        elif dataclasses.is_dataclass(obj):
+            for field in dataclasses.fields(obj):
+                h.update(field.name.encode("utf-8"))
+                h.update(self.value(getattr(obj, field.name)))
+        elif isinstance(obj, Path):
+            h.update(str(obj).encode("utf-8"))
+        else:
+            raise UnhashableError(obj)
+
+        digest = h.digest()
+        if cacheable:
+            # keep a reference, ensuring the id is not reused for another object.
+            self._values[id(obj)] = (obj, digest)
+        return digest
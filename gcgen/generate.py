@@ -8,18 +8,43 @@ Discover files with code to generate.
 
 from pathlib import Path
 from types import ModuleType
-from typing import Callable, Dict, Union
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 import importlib.util
+import contextlib
+import inspect
 import sys
 import os
-from io import TextIOWrapper
+from io import StringIO
 from gcgen.scope import Scope
 from gcgen import decorators
-from gcgen.snippetparser import ParserBase, Json
-from gcgen.emitter import Emitter, Section
+from gcgen.snippetparser import ParserBase, Json, TagPair
+from gcgen.emitter import Emitter, EmitterConfig, Section
+from gcgen.emitter.emitter import Writer
 from gcgen.log import get_logger, LogLevel
 from gcgen.api.snippets_helpers import SnippetFn
 from gcgen.excbase import GcgenError
+from gcgen.project import ProjectRootNotFoundError, find_project_root
+from gcgen.asyncrunner import AsyncRunner, get_runner, set_runner
+from gcgen.api.models import ModelCache, set_model_cache
+from gcgen.snippetindex import SnippetIndex
+from gcgen.incremental import CallKeys, CallRecord, Incremental, hash_text
+from gcgen.outputcache import OutputCache
+from gcgen.segments import SegmentStore
+from gcgen.durability import Durability, current_file, set_durability
+from gcgen.transaction import Transaction
+from gcgen.profiling import MemoryProfiler
+from gcgen.limits import LimitExceededError, RunLimits
 
 
 logger = get_logger(__name__)
@@ -90,81 +115,231 @@ class Parser(ParserBase):
         snippets_scope: Scope,
         indent_by: Scope,
         project_root: Path,
+        incremental: Optional[Incremental] = None,
+        cache: Optional[OutputCache] = None,
+        emit_configs: Optional[Dict[str, EmitterConfig]] = None,
+        tags_by_suffix: Optional[Dict[str, List[TagPair]]] = None,
+        profiler: Optional[MemoryProfiler] = None,
+        limits: Optional[RunLimits] = None,
     ):
-        super().__init__(snippet_start, snippet_end)
+        super().__init__(snippet_start, snippet_end, tags_by_suffix)
         self._scope = scope
         self._snippets_scope = snippets_scope
         self._indent_by = indent_by
         self._project_root = project_root
+        self._incremental = incremental
+        # skipped calls write their previous output, the snippet's body
+        self.keep_bodies = incremental is not None
+        self._cache = cache
+        self._profiler = profiler
+        self._limits = limits
+        # file suffix => output settings (from project config), "" is the default
+        self._emit_configs = emit_configs or {}
+        # file suffix => output settings, completed with `indent_by`
+        self._configs: Dict[str, EmitterConfig] = {}
+        # (file suffix, snippet prefix) => emitter
+        self._emitters: Dict[Tuple[str, str], Emitter] = {}
+        self._keys: Optional[CallKeys] = incremental
+        if self._keys is None and cache is not None:
+            self._keys = CallKeys(project_root)
+        # digests of the scopes the scope of each file derives from
+        self._digests: Dict[Any, Any] = {}
+        # (snippet fn, raw arg) => problems found validating arg
+        self._validated: Dict[Tuple[Callable, str], List[str]] = {}
 
     @property
     def scope(self) -> Scope:
         return self._scope
 
+    def emit_config(self, suffix: str) -> EmitterConfig:
+        """Get output settings of files with suffix `suffix` (e.g. 'py')."""
+        config = self._configs.get(suffix)
+        if config is None:
+            base = self._emit_configs.get(suffix) or self._emit_configs.get("")
+            if base is None:
+                base = EmitterConfig(indent_by=None)
+            indent_by = base.indent_by
+            if indent_by is None:
+                indent_by = self._indent_by.get(suffix) or self._indent_by[""]
+            config = self._configs[suffix] = EmitterConfig(
+                indent_by, base.newline, base.trim_trailing_ws, base.encoding
+            )
+        return config
+
+    def emitter(self, suffix: str, prefix: str) -> Emitter:
+        """Get emitter for snippets of files with suffix `suffix`."""
+        key = (suffix, prefix)
+        emitter = self._emitters.get(key)
+        if emitter is None:
+            config = self.emit_config(suffix)
+            # line endings are translated when the file is written (see
+            # `file_format`), such that all text handled is '\n'-terminated.
+            emitter = Emitter(
+                prefix=prefix,
+                indent_by=config.indent_by if config.indent_by is not None else " ",
+                trim_trailing_ws=config.trim_trailing_ws,
+            )
+            self._emitters[key] = emitter
+        return emitter
+
+    def file_format(self, fpath: Path) -> Tuple[str, str]:
+        config = self.emit_config(fpath.suffix[1:])
+        return config.encoding, config.newline
+
     @scope.setter
     def scope(self, scope: Scope) -> None:
         self._scope = scope
 
+    def validate_arg(
+        self, snippet_name: str, snippet_arg: Json, raw_arg: str
+    ) -> List[str]:
+        snippet_fn = self._snippets_scope.get(snippet_name, None)
+        validator = decorators.snippet_validator(snippet_fn)
+        if validator is None:
+            return []
+        key = (snippet_fn, raw_arg)
+        problems = self._validated.get(key)
+        if problems is None:
+            problems = self._validated[key] = validator(snippet_arg, "$")
+        return problems
+
     def on_snippet(
         self,
         snippet_prefix: str,
         snippet_name: str,
         snippet_arg: Json,
         src_path: Path,
-        fh: TextIOWrapper,
+        fh: Writer,
     ):
-        logger.debug(f"on_snippet {snippet_name!r} called")
+        logger.debug("on_snippet %r called", snippet_name)
         snippet_fn: Union[SnippetFn, None] = self._snippets_scope.get(
             snippet_name, None
         )
         fpath = src_path.relative_to(self._project_root)
         if snippet_fn is None:
-            logger.critical(f"undefined snippet {snippet_name!r} called from {fpath!s}")
+            logger.critical(
+                "undefined snippet %r called from %s",
+                snippet_name,
+                fpath,
+                extra={
+                    "event": "snippet_undefined",
+                    "snippet": snippet_name,
+                    "file": str(fpath),
+                },
+            )
             raise SnippetUndefinedError(snippet_name, self._snippets_scope)
 
-        indent_by = self._indent_by.get(src_path.suffix[1:]) or self._indent_by[""]
-        emitter = Emitter(indent_by=indent_by, prefix=snippet_prefix)
-        section = Section()
         scope = self._scope  # do not derive, share
         scope["$snippet"] = snippet_name
         scope["$file"] = fpath
         scope["$snippets"] = self._snippets_scope.derive()
+
+        inc = self._incremental
+        cache = self._cache
+        keys = self._keys
+        if keys is not None:
+            m = self.match
+            assert m is not None
+            digest = keys.scope_digest(scope, self._digests)
+            key = keys.call_key(
+                snippet_fn,
+                snippet_name,
+                m.raw_arg,
+                m.prefix,
+                self.emit_config(src_path.suffix[1:]),
+                fpath,
+                digest,
+            )
+            prev = None
+            if inc is not None:
+                prev = inc.can_skip(fpath, self.match_index, key, m.body)
+            if prev is not None:
+                logger.debug(
+                    "snippet %r in %s unchanged, skipping", snippet_name, fpath
+                )
+                fh.writelines(m.body)
+                inc.record(fpath, prev, skipped=True)
+                return
+            out = cache.get(key) if cache is not None and key is not None else None
+            if out is not None:
+                logger.debug(
+                    "snippet %r in %s restored from cache", snippet_name, fpath
+                )
+                fh.write(out)
+                if inc is not None:
+                    record = CallRecord(snippet_name, key, hash_text(out), False)
+                    inc.record(fpath, record, skipped=True)
+                return
+
+        # only built once the call must run, skipped and cached calls need neither
+        emitter = self.emitter(src_path.suffix[1:], snippet_prefix)
+        section = Section()
+        measure = (
+            self._profiler.measure("snippet", snippet_name, fpath, section)
+            if self._profiler is not None
+            else contextlib.nullcontext()
+        )
+
+        def call() -> None:
+            result = snippet_fn(section, scope, snippet_arg)
+            if inspect.isawaitable(result):
+                get_runner().run(result)
+
         try:
-            snippet_fn(section, scope, snippet_arg)
+            with measure:
+                if self._limits is None:
+                    call()
+                else:
+                    self._limits.call_snippet(
+                        snippet_fn, snippet_name, fpath, call, section
+                    )
             section.freshline()
+        except LimitExceededError:
+            logger.error(
+                "snippet %r in %s exceeded its limits",
+                snippet_name,
+                fpath,
+                exc_info=True,
+                extra={
+                    "event": "snippet_limit",
+                    "snippet": snippet_name,
+                    "file": str(fpath),
+                },
+            )
+            raise
         except Exception as e:
             logger.error(
-                f"error executing snippet {snippet_name!r} in {fpath!s}", exc_info=True
+                "error executing snippet %r in %s",
+                snippet_name,
+                fpath,
+                exc_info=True,
+                extra={
+                    "event": "snippet_error",
+                    "snippet": snippet_name,
+                    "file": str(fpath),
+                },
             )
             raise SnippetRunError(
                 snippet_name, snippet_fn, src_path, section, scope
             ) from e
-        logger.debug(str(section))
+        # deferred formatting, the section is only stringified if debug logging is on.
+        logger.debug("%s", section)
         # TODO: coerce types
-        emitter.emit(section, fh)
-
-
-class ProjectRootNotFoundError(GcgenError):
-    def __init__(self, start: Path):
-        self.start = start
-        super().__init__(f"Failed to find project root relative to {start!s}")
-
-    def printerr(self) -> None:
-        print("Failed to find project root directory")
-        print("")
-        print("gcgen cannot determine the root of your project.")
-        print(
-            "The project root can be defined (i.e. `-p path/to/project`), or inferred."
-        )
-        print("The inferrence algorithm works as follows:")
-        print("From the current directory up to the root directory:")
-        print("1) search for a `gcgen_project.ini` file")
-        print("2) (if not found) restart search, look for a `.git` folder")
-        print("")
-        print("Neither was found, and gcgen gave up.")
-        print("TIP:")
-        print("  * Either specify the project root (`-p path/to/project/root`)")
-        print("  * (OR) create a `gcgen_project.ini` file in the project root folder")
+        if keys is None:
+            emitter.emit(section, fh)
+            return
+        buf = StringIO()
+        emitter.emit(section, buf)
+        out = buf.getvalue()
+        fh.write(out)
+        mutates = digest is None or keys.scope_digest(scope, self._digests) != digest
+        if cache is not None and key is not None and not mutates:
+            # output of snippets modifying the scope cannot be reused, their
+            # effect on the scope would be lost.
+            cache.put(key, out)
+        if inc is not None:
+            record = CallRecord(snippet_name, key, hash_text(out), mutates)
+            inc.record(fpath, record, skipped=False)
 
 
 class CompileError(GcgenError):
@@ -350,17 +525,6 @@ class IndentByValueError(GcgenError):
         print(f"  indent_by type:  {type(self.indent_by)}")
 
 
-def find_project_root(start: Path) -> Path:
-    """Find directory closest to `start` which is determined to be a project root."""
-    search_path = [start, *start.parents]
-    for directory in search_path:
-        for elem in ["gcgen_project.ini", ".git"]:
-            p = directory / elem
-            if p.exists():
-                return directory
-    raise ProjectRootNotFoundError(start)
-
-
 def fmt_module_name(root: Path, modpath: Path) -> str:
     modname = modpath.relative_to(root)
     modname = modname.parent / modname.name[: -len(modname.suffix)]
@@ -389,19 +553,48 @@ def get_mod_snippet_fns(mod: ModuleType) -> Dict[str, Callable]:
     return {name: fn for name, fn in mod.__dict__.items() if decorators.is_snippet(fn)}
 
 
-def _compile(
-        root: Path,
-        tag_start: str,
-        tag_end: str,
+class ConfDir:
+    """A directory with a `gcgen_conf.py` file, loaded and ready to run."""
+
+    __slots__ = "path", "conf_path", "module", "scope", "snippets_scope", "indent_by"
+
+    def __init__(
+        self,
         path: Path,
-        parent_scope: Scope,
+        conf_path: Path,
+        module: ModuleType,
+        scope: Scope,
         snippets_scope: Scope,
-        indent_by: Scope
-) -> None:
+        indent_by: Scope,
+    ):
+        self.path = path
+        self.conf_path = conf_path
+        self.module = module
+        self.scope = scope
+        self.snippets_scope = snippets_scope
+        self.indent_by = indent_by
+
+
+def _load(
+    root: Path,
+    path: Path,
+    parent_scope: Scope,
+    snippets_scope: Scope,
+    indent_by: Scope,
+    dirs: Optional[List[Path]] = None,
+    modules: Optional[Dict[Path, ModuleType]] = None,
+) -> Iterator[ConfDir]:
+    if dirs is not None:
+        dirs.append(path)
     gcgen_mod = None
     gcgen_conf_path = path / "gcgen_conf.py"
     if gcgen_conf_path.exists():
-        gcgen_mod = import_from_path(root, gcgen_conf_path)
+        if modules is not None:
+            gcgen_mod = modules.get(gcgen_conf_path)
+        if gcgen_mod is None:
+            gcgen_mod = import_from_path(root, gcgen_conf_path)
+            if modules is not None:
+                modules[gcgen_conf_path] = gcgen_mod
     scope = parent_scope.derive()
 
     exclude_dirs = []
@@ -411,7 +604,8 @@ def _compile(
                 exclude_dirs = gcgen_mod.gcgen_exclude_dirs()
             except Exception as e:
                 logger.critical(
-                    f"error during execution of `gcgen_exclude_dirs` in {gcgen_conf_path!s}",
+                    "error during execution of `gcgen_exclude_dirs` in %s",
+                    gcgen_conf_path,
                     exc_info=True,
                 )
                 raise CompileExcludeFilesError(gcgen_conf_path)
@@ -428,7 +622,8 @@ def _compile(
                 gcgen_mod.gcgen_scope_extend(scope)
             except Exception as e:
                 logger.critical(
-                    f"error during execution of `gcgen_scope_extend` in {gcgen_conf_path!s}",
+                    "error during execution of `gcgen_scope_extend` in %s",
+                    gcgen_conf_path,
                     exc_info=True,
                 )
                 raise CompileScopeExtendError(gcgen_conf_path) from e
@@ -440,73 +635,543 @@ def _compile(
                 for name in decorators.snippet_names(snippet_fn):
                     snippets_scope[name] = snippet_fn
 
-    # traverse and compile in depth-first order, passing initialized scope
+    # traverse in depth-first order, passing initialized scope
     for p in path.iterdir():
         if p.is_dir() and p.name not in exclude_dirs:
-            _compile(root, tag_start, tag_end, p, scope, snippets_scope, indent_by)
+            yield from _load(root, p, scope, snippets_scope, indent_by, dirs, modules)
 
-    if gcgen_mod is None:
-        return
+    if gcgen_mod is not None:
+        yield ConfDir(
+            path, gcgen_conf_path, gcgen_mod, scope, snippets_scope, indent_by
+        )
+
+
+def iter_project(
+    root: Path,
+    scope: Optional[Scope] = None,
+    dirs: Optional[List[Path]] = None,
+    modules: Optional[Dict[Path, ModuleType]] = None,
+) -> Iterator[ConfDir]:
+    """Import the `gcgen_conf.py` files of the project as its directories are run.
+
+    Directories are loaded lazily, running each directory as it is yielded
+    keeps the order of a run: a `gcgen_conf.py` file is imported (and its
+    `gcgen_scope_extend` called) once all directories preceding it ran.
+
+    Args:
+        root: the (resolved) project root.
+        scope: (optional) the root scope.
+        dirs: (optional) if given, every directory visited is appended to it.
+        modules: (optional) `gcgen_conf.py` path => module, modules found in
+            it are used instead of importing the file again, modules imported
+            are added to it.
+
+    Returns:
+        An iterator of the loaded directories, in the order in which they
+        should be run (depth-first, subdirectories before their parent
+        directory).
+    """
+    indent_by = Scope()
+    indent_by[""] = "   "
+    return _load(root, root, scope or Scope(), Scope(), indent_by, dirs, modules)
+
+
+def load_project(
+    root: Path,
+    scope: Optional[Scope] = None,
+    dirs: Optional[List[Path]] = None,
+    modules: Optional[Dict[Path, ModuleType]] = None,
+) -> List[ConfDir]:
+    """Import all `gcgen_conf.py` files of the project and build their scopes.
+
+    Unlike `iter_project`, every `gcgen_conf.py` file is imported before any
+    directory runs.
+
+    Args:
+        root: the (resolved) project root.
+        scope: (optional) the root scope.
+        dirs: (optional) if given, every directory visited is appended to it.
+        modules: (optional) see `iter_project`.
+
+    Returns:
+        The loaded directories, in the order in which they should be run
+        (depth-first, subdirectories before their parent directory).
+    """
+    return list(iter_project(root, scope, dirs, modules))
+
+
+def parse_files(cd: ConfDir) -> List[Path]:
+    """Get (validated) paths of files listed by `gcgen_parse_files` of `cd`."""
+    if not hasattr(cd.module, "gcgen_parse_files"):
+        return []
+    try:
+        files = cd.module.gcgen_parse_files()
+    except Exception as e:
+        logger.critical(
+            "error during execution of `gcgen_parse_files` in %s",
+            cd.conf_path,
+            exc_info=True,
+        )
+        raise CompileParseFilesError(cd.conf_path) from e
 
+    paths = []
+    for file in files:
+        file = Path(file)
+        if str(file) != file.name:
+            logger.error(
+                "%s - entries in `gcgen_parse_files` must be plain filenames, not paths!",
+                file,
+            )
+            raise ParseFilesInvalidValue(file, cd.conf_path)
+
+        file = cd.path / file
+        if file.is_symlink():
+            # symlinks need to be resolved, otherwise the atomic
+            # file replace at the end of the parse step will fail
+            file = file.resolve()
+        if not file.exists():
+            logger.error("%s - Could not find file!", file)
+            raise ParseFileNotFoundError(file, cd.conf_path)
+        elif not file.is_file():
+            logger.error(
+                "%s - expected a file, got something else!",
+                file,
+                extra={"file": str(file), "conf": str(cd.conf_path)},
+            )
+            raise ParseFileNotFileError(file, cd.conf_path)
+        paths.append(file)
+    return paths
+
+
+def _run(
+    root: Path,
+    tag_start: str,
+    tag_end: str,
+    cd: ConfDir,
+    index: Optional[SnippetIndex] = None,
+    incremental: Optional[Incremental] = None,
+    cache: Optional[OutputCache] = None,
+    emit_configs: Optional[Dict[str, EmitterConfig]] = None,
+    tags_by_suffix: Optional[Dict[str, List[TagPair]]] = None,
+    segments: Optional[SegmentStore] = None,
+    profiler: Optional[MemoryProfiler] = None,
+    limits: Optional[RunLimits] = None,
+) -> List["_Pending"]:
+    gcgen_conf_path = cd.conf_path
     # operate from within the path containing the gcgen_conf.py we are currently processing
-    os.chdir(path)
+    os.chdir(cd.path)
     # parse snippets in any files explicitly listed as having them
-    if hasattr(gcgen_mod, "gcgen_parse_files"):
-        try:
-            files = gcgen_mod.gcgen_parse_files()
-        except Exception as e:
-            logger.critical(
-                f"error during execution of `gcgen_parse_files` in {gcgen_conf_path!s}",
-                exc_info=True,
-            )
-            raise CompileParseFilesError(gcgen_conf_path) from e
-        parser = Parser(tag_start, tag_end, scope, snippets_scope, indent_by, root)
+    files = parse_files(cd)
+    if files:
+        parser = Parser(
+            tag_start,
+            tag_end,
+            cd.scope,
+            cd.snippets_scope,
+            cd.indent_by,
+            root,
+            incremental,
+            cache,
+            emit_configs,
+            tags_by_suffix,
+            profiler,
+            limits,
+        )
+        parser.segments = segments
+        parser.index = index
         for file in files:
-            logger.info(f"Parsing {file!s}")
-            file = Path(file)
-            if str(file) != file.name:
-                logger.error(
-                    f"{file!s} - entries in `gcgen_parse_files` must be plain filenames, not paths!",
-                )
-                raise ParseFilesInvalidValue(file, gcgen_conf_path)
-
-            file = (path / file)
-            if file.is_symlink():
-                # symlinks need to be resolved, otherwise the atomic
-                # file replace at the end of the parse step will fail
-                file = file.resolve()
-            if not file.exists():
-                logger.error(
-                    f"{file!s} - Could not find file!",
-                )
-                raise ParseFileNotFoundError(file, gcgen_conf_path)
-            elif not file.is_file():
-                logger.error(
-                    f"{file!s} - expected a file, got something else!",
-                    extra={"file": str(file), "gcgen file": gcgen_conf_path},
-                )
-                raise ParseFileNotFileError(file, gcgen_conf_path)
-            file_scope = scope.derive()
-            parser.scope = file_scope
-            parser.parse(file, file)
+            if (
+                index is not None
+                # staged files changed since they were indexed
+                and current_file(file) == str(file)
+                and index.has_no_snippets(file)
+            ):
+                logger.debug("Skipping %s, no snippets", file)
+                continue
+            logger.info(
+                "Parsing %s",
+                file.name,
+                extra={"event": "parse_file", "file": str(file)},
+            )
+            parser.scope = cd.scope.derive()
+            if incremental is None or not file.is_relative_to(root):
+                # files outside of the project (e.g. resolved symlinks) are
+                # not tracked, their records could not be keyed.
+                parser.parse(file, file)
+            else:
+                relpath = file.relative_to(root)
+                try:
+                    parser.parse(file, file)
+                except BaseException:
+                    incremental.file_failed(relpath)
+                    raise
+                incremental.file_done(relpath)
 
     # parse generators (functions which may create arbitrarily many files)
-    for name, fn in get_mod_generator_fns(gcgen_mod).items():
-        local_scope = scope.derive()
+    # async generators are started in order, the caller runs them (see `run`)
+    pending: List[_Pending] = []
+    conf_relpath = gcgen_conf_path.relative_to(root)
+    for name, fn in get_mod_generator_fns(cd.module).items():
+        if incremental is not None:
+            # generators may write any file, they are always run. Their
+            # fingerprints are recorded to show what changed between runs.
+            incremental.record_generator(conf_relpath, name, fn)
+        local_scope = cd.scope.derive()
+        logger.info(
+            "Running generator %s",
+            name,
+            extra={
+                "event": "generator",
+                "generator": name,
+                "conf": str(gcgen_conf_path),
+            },
+        )
+        measure = (
+            profiler.measure("generator", name, conf_relpath)
+            if profiler is not None
+            else contextlib.nullcontext()
+        )
         try:
-            fn(local_scope)
+            with measure:
+                if limits is None:
+                    result = fn(local_scope)
+                else:
+                    result = limits.call_generator(
+                        fn, name, conf_relpath, lambda: fn(local_scope)
+                    )
         except Exception as e:
-            logger.error(
-                f"error executing generator function {name!s} in {gcgen_conf_path!s}",
-                exc_info=True,
-            )
+            _close_pending(pending)
+            _log_generator_error(name, gcgen_conf_path, e)
+            if isinstance(e, LimitExceededError):
+                raise
             raise CompileGeneratorFunctionError(name, gcgen_conf_path) from e
+        if inspect.isawaitable(result):
+            aw: Awaitable = _InDir(cd.path, result)
+            if limits is not None:
+                aw = limits.limit_async(fn, aw, name, conf_relpath)
+            pending.append(_Pending(name, fn, gcgen_conf_path, result, aw))
+    return pending
+
+
+class _Pending:
+    """An async generator started by `_run`, still to be awaited."""
+
+    __slots__ = "name", "fn", "conf_path", "result", "aw"
+
+    def __init__(
+        self, name: str, fn: Callable, conf_path: Path, result: Awaitable, aw: Awaitable
+    ):
+        self.name = name
+        self.fn = fn
+        self.conf_path = conf_path
+        # as returned by the generator, `aw` wraps it
+        self.result = result
+        self.aw = aw
+
+
+class _InDir:
+    """Drive awaitable `aw` from within directory `path`.
+
+    Async generators of different directories run concurrently, the working
+    directory is changed to that of the generator each time it resumes.
+    """
+
+    __slots__ = "path", "aw"
+
+    def __init__(self, path: Path, aw: Awaitable):
+        self.path = path
+        self.aw = aw
+
+    def __await__(self):
+        it = self.aw.__await__()
+        send, value = it.send, None
+        while True:
+            os.chdir(self.path)
+            try:
+                step = send(value)
+            except StopIteration as e:
+                return e.value
+            try:
+                send, value = it.send, (yield step)
+            except BaseException as e:
+                send, value = it.throw, e
+
+
+def _close_pending(pending: List[_Pending]) -> None:
+    """Close async generators which will not be awaited."""
+    for p in pending:
+        for aw in (p.aw, p.result):
+            if inspect.iscoroutine(aw):
+                aw.close()
 
-def compile(root: Path, tag_start: str = "<<?", tag_end: str = "?>>") -> None:
+
+def _gather(
+    root: Path,
+    pending: List[_Pending],
+    profiler: Optional[MemoryProfiler] = None,
+    limits: Optional[RunLimits] = None,
+) -> None:
+    """Run async generators `pending` concurrently until all complete."""
+    if not pending:
+        return
+    conf_relpaths = list(dict.fromkeys(p.conf_path.relative_to(root) for p in pending))
+    file: Any = conf_relpaths[0]
+    if len(conf_relpaths) > 1:
+        file = " & ".join(map(str, conf_relpaths))
+    names = " & ".join(p.name for p in pending)
+    measure = contextlib.nullcontext()
+    if profiler is not None:
+        # async generators run concurrently, they can only be measured together
+        measure = profiler.measure("generator", names, file)
+
+    def gather() -> List:
+        return get_runner().gather([p.aw for p in pending])
+
+    try:
+        with measure:
+            if limits is None:
+                results = gather()
+            else:
+                results = limits.call_generators(
+                    [(p.name, p.fn) for p in pending], file, gather
+                )
+    except LimitExceededError as e:
+        _log_generator_error(e.name, pending[0].conf_path, e)
+        raise
+    for p, result in zip(pending, results):
+        if isinstance(result, LimitExceededError):
+            _log_generator_error(p.name, p.conf_path, result)
+            raise result
+        if isinstance(result, BaseException):
+            _log_generator_error(p.name, p.conf_path, result)
+            raise CompileGeneratorFunctionError(p.name, p.conf_path) from result
+
+
+def _log_generator_error(name: str, conf_path: Path, exc: BaseException) -> None:
+    logger.error(
+        "error executing generator function %s in %s",
+        name,
+        conf_path,
+        exc_info=exc,
+        extra={
+            "event": "generator_error",
+            "generator": name,
+            "conf": str(conf_path),
+        },
+    )
+
+
+def compile(
+    root: Path,
+    tag_start: str = "<<?",
+    tag_end: str = "?>>",
+    max_concurrency: int = 8,
+    index: Optional[SnippetIndex] = None,
+    incremental: Optional[Incremental] = None,
+    cache: Optional[OutputCache] = None,
+    emit_configs: Optional[Dict[str, EmitterConfig]] = None,
+    tags_by_suffix: Optional[Dict[str, List[TagPair]]] = None,
+    segments: Optional[SegmentStore] = None,
+    durability: Optional[Durability] = None,
+    transactional: bool = False,
+    profiler: Optional[MemoryProfiler] = None,
+    limits: Optional[RunLimits] = None,
+) -> None:
+    """Run all snippets and generators of the project at `root`.
+
+    Args:
+        root: the project root.
+        tag_start: tag marking the start of a snippet.
+        tag_end: tag marking the end of a snippet.
+        max_concurrency: maximum number of async generators to run at once.
+        index: (optional) snippet index, files which the index shows to have
+            no snippets are skipped, the index is updated for parsed files.
+        incremental: (optional) state of the previous run, snippet calls
+            whose inputs are unchanged are not run again.
+        cache: (optional) store of snippet output, snippet calls whose output
+            is found in the store are not run. Pruned at the end of the run.
+        emit_configs: (optional) output settings of snippets by file suffix
+            (e.g. 'py'), the entry of the empty suffix ('') applies to all
+            other files.
+        tags_by_suffix: (optional) snippet tag pairs (start tag, end tag) by
+            file suffix (e.g. 'py'), other files use `tag_start` & `tag_end`.
+        segments: (optional) segment models of files parsed by earlier runs,
+            unchanged files are re-spliced by offset instead of scanned, the
+            models are updated for parsed files.
+        durability: (optional) when to sync written files to disk, files are
+            not synced by default.
+        transactional: if true, written files are only put in place once the
+            whole run succeeded, a failed run leaves every file untouched.
+        profiler: (optional) measures memory allocated by each snippet and
+            generator call.
+        limits: (optional) time and memory limits of snippet and generator
+            calls, calls exceeding them are aborted.
+    """
     # in case `root` is a relative path like '.', resolve to absolute path
     # for later use, where cwd changes.
     root = root.resolve()
 
-    indent_by = Scope()
-    indent_by[""] = "   "
-    _compile(root, tag_start, tag_end, root, Scope(), Scope(), indent_by)
+    models = ModelCache(root / ".gcgen" / "models", root)
+    scope = Scope()
+    scope["$models"] = models
+    run(
+        root,
+        iter_project(root, scope),
+        models,
+        tag_start=tag_start,
+        tag_end=tag_end,
+        max_concurrency=max_concurrency,
+        index=index,
+        incremental=incremental,
+        cache=cache,
+        emit_configs=emit_configs,
+        tags_by_suffix=tags_by_suffix,
+        segments=segments,
+        durability=durability,
+        transactional=transactional,
+        profiler=profiler,
+        limits=limits,
+    )
+
+
+def run(
+    root: Path,
+    conf_dirs: Iterable[ConfDir],
+    models: ModelCache,
+    tag_start: str = "<<?",
+    tag_end: str = "?>>",
+    max_concurrency: int = 8,
+    index: Optional[SnippetIndex] = None,
+    incremental: Optional[Incremental] = None,
+    cache: Optional[OutputCache] = None,
+    emit_configs: Optional[Dict[str, EmitterConfig]] = None,
+    tags_by_suffix: Optional[Dict[str, List[TagPair]]] = None,
+    segments: Optional[SegmentStore] = None,
+    durability: Optional[Durability] = None,
+    transactional: bool = False,
+    profiler: Optional[MemoryProfiler] = None,
+    limits: Optional[RunLimits] = None,
+) -> None:
+    """Run snippets and generators of already loaded directories.
+
+    Args:
+        root: the (resolved) project root.
+        conf_dirs: directories to run, as returned by `load_project` (or
+            `iter_project`, loading each directory just before it runs).
+        models: model cache of the project.
+        (see `compile` for the remaining arguments)
+    """
+    runner = AsyncRunner(max_concurrency)
+    prev_runner = set_runner(runner)
+    prev_models = set_model_cache(models)
+    txn = Transaction(durability) if transactional else None
+    prev_durability = set_durability(durability if txn is None else txn)
+    if profiler is not None:
+        profiler.start()
+    # async generators still to be awaited, those of sibling directories run
+    # concurrently.
+    pending: List[_Pending] = []
+    try:
+        for cd in conf_dirs:
+            # generators of sub-directories complete before their parent runs
+            inner = [p for p in pending if p.conf_path.parent.is_relative_to(cd.path)]
+            if inner:
+                pending = [p for p in pending if p not in inner]
+                try:
+                    _gather(root, inner, profiler, limits)
+                finally:
+                    _close_pending(inner)
+            pending += _run(
+                root,
+                tag_start,
+                tag_end,
+                cd,
+                index,
+                incremental,
+                cache,
+                emit_configs,
+                tags_by_suffix,
+                segments,
+                profiler,
+                limits,
+            )
+        inner, pending = pending, []
+        try:
+            _gather(root, inner, profiler, limits)
+        finally:
+            _close_pending(inner)
+        if txn is not None:
+            logger.info(
+                "Committing %d files",
+                len(txn),
+                extra={"event": "commit", "files": len(txn)},
+            )
+            txn.commit()
+            txn = None
+        if cache is not None:
+            cache.prune()
+    finally:
+        _close_pending(pending)
+        if profiler is not None:
+            profiler.stop()
+        if txn is not None:
+            # files written are discarded, their models and index entries
+            # do not describe the files left in place.
+            staged = [Path(p) for p in txn.targets()]
+            txn.abort()
+            for fpath in staged:
+                if segments is not None:
+                    segments.drop(fpath)
+                if index is not None:
+                    index.drop(fpath)
+        elif durability is not None:
+            # also sync files written before a failure
+            durability.sync()
+        set_durability(prev_durability)
+        set_model_cache(prev_models)
+        set_runner(prev_runner)
+        runner.close()
+
+
+def build_index(
+    root: Path,
+    tag_start: str = "<<?",
+    tag_end: str = "?>>",
+    index: Optional[SnippetIndex] = None,
+    tags_by_suffix: Optional[Dict[str, List[TagPair]]] = None,
+) -> SnippetIndex:
+    """Index all snippet calls of the project at `root` without running anything.
+
+    Project `gcgen_conf.py` files are loaded to find the files to parse, but
+    no snippets or generators are run.
+
+    Args:
+        root: the project root.
+        tag_start: tag marking the start of a snippet.
+        tag_end: tag marking the end of a snippet.
+        index: (optional) existing index to update, only files changed since
+            they were last indexed are scanned again.
+        tags_by_suffix: (optional) snippet tag pairs by file suffix.
+
+    Returns:
+        The index.
+    """
+    root = root.resolve()
+    if index is None:
+        index = SnippetIndex(root)
+    parser = ParserBase(tag_start, tag_end, tags_by_suffix)
+    models = ModelCache(root / ".gcgen" / "models", root)
+    scope = Scope()
+    scope["$models"] = models
+    prev_models = set_model_cache(models)
+    try:
+        seen = set()
+        for cd in load_project(root, scope):
+            os.chdir(cd.path)
+            for file in parse_files(cd):
+                index.update(file, parser)
+                seen.add(file)
+        index.retain(seen)
+    finally:
+        set_model_cache(prev_models)
+    return index
@@ -0,0 +1,260 @@
+"""
+Selective regeneration of snippet call sites.
+
+For each snippet call site, a key is derived from the fingerprint of the
+snippet function, its argument, the file being generated and the contents of
+the scope, including the snippets in reach of the call (`$snippets`). The key and a hash of the generated output are stored in a
+manifest alongside the outputs. On the next run, call sites whose key is
+unchanged and whose body was not edited by hand are not run again, the
+existing body is kept instead.
+
+Snippets which modify the scope are always run, as their changes to the scope
+affect subsequent snippets of the same file.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from gcgen.fingerprint import Fingerprinter, UnhashableError
+from gcgen.emitter import EmitterConfig
+from gcgen.scope import Scope
+
+
+MANIFEST_VERSION = 1
+# change to invalidate all call keys, e.g. when changing how output is emitted
+KEY_VERSION = "3"
+
+
+class CallRecord:
+    """Outcome of running the snippet of a call site."""
+
+    __slots__ = "name", "key", "body_hash", "mutates"
+
+    def __init__(self, name: str, key: Optional[str], body_hash: str, mutates: bool):
+        self.name = name
+        # None if the call site's inputs could not be fingerprinted
+        self.key = key
+        self.body_hash = body_hash
+        # true if the snippet modified the scope
+        self.mutates = mutates
+
+    def to_json(self) -> list:
+        return [self.name, self.key, self.body_hash, self.mutates]
+
+    @classmethod
+    def from_json(cls, val: list) -> "CallRecord":
+        return cls(*val)
+
+
+def hash_text(*chunks: str) -> str:
+    h = hashlib.sha1()
+    for chunk in chunks:
+        h.update(chunk.encode("utf-8"))
+    return h.hexdigest()
+
+
+class CallKeys:
+    """Computes the keys of snippet calls.
+
+    Args:
+        root: the (resolved) project root.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.fingerprints = Fingerprinter(root)
+
+    def scope_digest(
+        self, scope: Scope, cache: Optional[Dict[Any, Any]] = None
+    ) -> Optional[str]:
+        """Digest of all user-defined scope entries, None if not possible.
+
+        Entries whose key starts with '$' are skipped, except for the snippets
+        of `$snippets`, which snippets may call.
+
+        Args:
+            scope: the scope of the snippet call.
+            cache: (optional) digests of the scopes `scope` derives from, by
+                id. Only `scope` itself is digested anew, values of the scopes
+                it derives from must not change while cached.
+        """
+        try:
+            return self._digest(scope, "scope", self._entries, cache, False)
+        except UnhashableError:
+            return None
+
+    def _digest(
+        self,
+        scope: Scope,
+        kind: str,
+        entries: Callable[[Any, Scope, Optional[Dict]], None],
+        cache: Optional[Dict[Any, Any]],
+        cached: bool,
+    ) -> str:
+        """Digest of `scope` and of the scopes it derives from."""
+        ckey = (kind, id(scope))
+        if cached and cache is not None:
+            hit = cache.get(ckey)
+            if hit is not None:
+                if hit[1] is None:
+                    raise UnhashableError(scope)
+                return hit[1]
+        h = hashlib.sha1()
+        digest = None
+        try:
+            entries(h, scope, cache)
+            outer = scope.outer
+            if outer is not None:
+                h.update(
+                    self._digest(outer, kind, entries, cache, True).encode("utf-8")
+                )
+            digest = h.hexdigest()
+        finally:
+            if cached and cache is not None:
+                # keep a reference, ensuring the id is not reused
+                cache[ckey] = (scope, digest)
+        return digest
+
+    def _entries(self, h: Any, scope: Scope, cache: Optional[Dict]) -> None:
+        value = self.fingerprints.value
+        for key, val in sorted(scope.local_items(), key=lambda kv: kv[0]):
+            if isinstance(key, str) and key.startswith("$"):
+                if key == "$snippets" and isinstance(val, Scope):
+                    h.update(value(key))
+                    digest = self._digest(val, "snippets", self._snippets, cache, False)
+                    h.update(digest.encode("utf-8"))
+                continue
+            h.update(value(key))
+            h.update(value(val))
+        for key in sorted(scope.local_deleted()):
+            h.update(b"\0")
+            h.update(value(key))
+
+    def _snippets(self, h: Any, scope: Scope, cache: Optional[Dict]) -> None:
+        function = self.fingerprints.function
+        for name, fn in sorted(scope.local_items(), key=lambda kv: kv[0]):
+            h.update(name.encode("utf-8"))
+            h.update(function(fn).encode("utf-8"))
+        for name in sorted(scope.local_deleted()):
+            h.update(b"\0")
+            h.update(name.encode("utf-8"))
+
+    def call_key(
+        self,
+        snippet_fn: Any,
+        snippet_name: str,
+        raw_arg: str,
+        prefix: str,
+        emit_config: EmitterConfig,
+        fpath: Path,
+        scope_digest: Optional[str],
+    ) -> Optional[str]:
+        """Key identifying all inputs of a snippet call site."""
+        if scope_digest is None:
+            return None
+        return hash_text(
+            KEY_VERSION,
+            self.fingerprints.function(snippet_fn),
+            snippet_name,
+            raw_arg,
+            prefix,
+            repr(emit_config),
+            fpath.as_posix(),
+            scope_digest,
+        )
+
+
+class Incremental(CallKeys):
+    """Tracks call sites across runs to decide which snippets must be run.
+
+    Args:
+        root: the (resolved) project root.
+    """
+
+    def __init__(self, root: Path):
+        super().__init__(root)
+        # relative file path => call records, in order of appearance
+        self.files: Dict[str, List[CallRecord]] = {}
+        # relative conf path => generator name => fingerprint
+        self.generators: Dict[str, Dict[str, str]] = {}
+        self._pending: Dict[str, List[CallRecord]] = {}
+        self.skipped = 0
+        self.ran = 0
+
+    def previous(self, fpath: Path, ndx: int) -> Optional[CallRecord]:
+        """Record of call site `ndx` of `fpath` from the previous run."""
+        records = self.files.get(str(fpath))
+        if records is None or ndx >= len(records):
+            return None
+        return records[ndx]
+
+    def can_skip(
+        self, fpath: Path, ndx: int, key: Optional[str], body: List[str]
+    ) -> Optional[CallRecord]:
+        """Get previous record if call site is unchanged, otherwise None."""
+        if key is None:
+            return None
+        prev = self.previous(fpath, ndx)
+        if prev is None or prev.mutates or prev.key != key:
+            return None
+        if prev.body_hash != hash_text(*body):
+            # body was edited since, regenerate it.
+            return None
+        return prev
+
+    def record(self, fpath: Path, record: CallRecord, skipped: bool) -> None:
+        self._pending.setdefault(str(fpath), []).append(record)
+        if skipped:
+            self.skipped += 1
+        else:
+            self.ran += 1
+
+    def file_done(self, fpath: Path) -> None:
+        """Commit the records of `fpath` after it was parsed successfully."""
+        self.files[str(fpath)] = self._pending.pop(str(fpath), [])
+
+    def file_failed(self, fpath: Path) -> None:
+        self._pending.pop(str(fpath), None)
+
+    def record_generator(self, conf_path: Path, name: str, fn: Any) -> str:
+        fp = self.fingerprints.function(fn)
+        self.generators.setdefault(str(conf_path), {})[name] = fp
+        return fp
+
+    def save(self, fpath: Path) -> None:
+        """Write manifest to `fpath` (atomically)."""
+        data = {
+            "version": MANIFEST_VERSION,
+            "files": {
+                key: [r.to_json() for r in records]
+                for key, records in self.files.items()
+            },
+            "generators": self.generators,
+        }
+        fpath.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=fpath.parent, delete=False, encoding="utf-8"
+        ) as fh:
+            json.dump(data, fh)
+        os.replace(fh.name, fpath)
+
+    @classmethod
+    def load(cls, root: Path, fpath: Path) -> "Incremental":
+        """Load manifest from `fpath`, starting afresh if it is unreadable."""
+        inc = cls(root)
+        try:
+            with open(fpath, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return inc
+        if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+            return inc
+        inc.files = {
+            key: [CallRecord.from_json(r) for r in records]
+            for key, records in data["files"].items()
+        }
+        inc.generators = data.get("generators", {})
+        return inc
@@ -0,0 +1,495 @@
+"""
+Time and memory limits of snippet and generator calls.
+
+Limits are enforced in-process by a watchdog thread which checks the running
+call every `interval` seconds. A call exceeding its time budget, growing
+the process' resident memory by more than its cap, or (snippets) emitting more
+lines or characters than allowed, is interrupted by raising an exception in
+the thread running it, and reported as a `SnippetLimitError` or
+`GeneratorLimitError`.
+
+Interruption happens between Python bytecodes: pure Python loops and runaway
+recursion are stopped promptly. A call blocked in C code (e.g. waiting on I/O)
+is only stopped if it runs on the main thread, where the watchdog escalates
+to interrupting it like Ctrl-C would after a grace period.
+"""
+import _thread
+import asyncio
+import contextlib
+import ctypes
+import os
+import signal
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type, TypeVar
+
+from gcgen import decorators
+from gcgen.emitter import Section
+from gcgen.excbase import GcgenError
+from gcgen.log import get_logger
+
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class _LimitInterrupt(BaseException):
+    """Raised in a call exceeding its limits (not an `Exception`, such that
+    it isn't swallowed by `except Exception` clauses of the call)."""
+
+
+class LimitExceededError(GcgenError):
+    kind = "call"
+
+    def __init__(self, name: str, file: Any, limit: str, budget: float, used: float):
+        self.name = name
+        self.file = file
+        # 'time', 'memory', 'output lines' or 'output chars'
+        self.limit = limit
+        self.budget = budget
+        self.used = used
+        super().__init__(f"{self.kind} {name!r} ({file!s}) exceeded its {limit} limit")
+
+    def _fmt(self, value: float) -> str:
+        if self.limit == "time":
+            return f"{value:.1f}s"
+        if self.limit.startswith("output"):
+            return f"{value:.0f} {self.limit[len('output '):]}"
+        return f"{value / (1024 * 1024):.1f} MiB"
+
+    def printerr(self) -> None:
+        print(f"{self.kind.capitalize()} exceeded its {self.limit} limit:")
+        print("")
+        print(f"The {self.kind} was aborted for running too long, using too much")
+        print("memory or emitting too much output. The traceback listed above")
+        print("shows where it was interrupted. Raise the limit in the `[limits]`")
+        print("section of `gcgen_project.ini` (or on the decorator for time and")
+        print("memory limits) if this is expected.")
+        print("")
+        print("Details:")
+        print(f"  {self.kind.capitalize()} name: {self.name!r}")
+        print(f"  File: {self.file}")
+        print(f"  Limit: {self._fmt(self.budget)}")
+        print(f"  Used: {self._fmt(self.used)}")
+
+
+class SnippetLimitError(LimitExceededError):
+    kind = "snippet"
+
+
+class GeneratorLimitError(LimitExceededError):
+    kind = "generator"
+
+
+def _page_size() -> int:
+    try:
+        return os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return 4096
+
+
+_PAGE_SIZE = _page_size()
+
+
+def rss() -> Optional[int]:
+    """Resident memory of this process in bytes, None if unknown (non-Linux)."""
+    try:
+        with open("/proc/self/statm", "rb") as fh:
+            return int(fh.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Limits:
+    """Time budget (seconds) and memory cap (bytes) of calls, None is unlimited.
+
+    Snippet calls may also be limited in the number of lines (`max_lines`) and
+    characters (`max_chars`) of the section they build.
+    """
+
+    __slots__ = "timeout", "max_memory", "max_lines", "max_chars"
+
+    def __init__(
+        self,
+        timeout: Optional[float] = None,
+        max_memory: Optional[int] = None,
+        max_lines: Optional[int] = None,
+        max_chars: Optional[int] = None,
+    ):
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.max_lines = max_lines
+        self.max_chars = max_chars
+
+    def __bool__(self) -> bool:
+        return (
+            self.timeout is not None
+            or self.max_memory is not None
+            or self.max_lines is not None
+            or self.max_chars is not None
+        )
+
+    def output_exceeded(self, section: Section) -> Optional[Tuple[str, int, int]]:
+        """(limit, budget, used) if `section` is larger than allowed, else None."""
+        if self.max_lines is not None:
+            lines = section.lines
+            if lines > self.max_lines:
+                return ("output lines", self.max_lines, lines)
+        if self.max_chars is not None:
+            chars = section.chars
+            if chars > self.max_chars:
+                return ("output chars", self.max_chars, chars)
+        return None
+
+    def for_fn(self, fn: Any) -> "Limits":
+        """Limits of calls to `fn`, applying overrides set by its decorator."""
+        overrides = decorators.call_limits(fn)
+        if not overrides:
+            return self
+        timeout = overrides.get("timeout", self.timeout)
+        max_memory_mb = overrides.get("max_memory_mb")
+        max_memory = self.max_memory
+        if "max_memory_mb" in overrides:
+            max_memory = (
+                None if max_memory_mb is None else int(max_memory_mb * 1024 * 1024)
+            )
+        # 0 lifts the limit
+        return Limits(
+            timeout or None, max_memory or None, self.max_lines, self.max_chars
+        )
+
+
+def _raise_in(ident: int, exc: Optional[Type[BaseException]]) -> None:
+    """Raise `exc` in thread `ident` (or cancel a pending exception if None)."""
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(ident), None if exc is None else ctypes.py_object(exc)
+    )
+
+
+def _interrupt_main() -> None:
+    """Interrupt the main thread like Ctrl-C, also ending blocking system calls."""
+    if hasattr(signal, "pthread_kill"):
+        main = threading.main_thread().ident
+        assert main is not None
+        signal.pthread_kill(main, signal.SIGINT)
+    else:
+        _thread.interrupt_main()
+
+
+class _Watch:
+    __slots__ = (
+        "limits",
+        "error",
+        "name",
+        "file",
+        "section",
+        "ident",
+        "start",
+        "rss_start",
+        "fired",
+        "fired_at",
+        "escalated",
+    )
+
+    def __init__(
+        self,
+        limits: Limits,
+        error: Type[LimitExceededError],
+        name: str,
+        file: Any,
+        section: Optional[Section],
+    ):
+        self.limits = limits
+        self.error = error
+        self.name = name
+        self.file = file
+        self.section = section
+        self.ident = threading.get_ident()
+        self.start = time.monotonic()
+        self.rss_start = rss() if limits.max_memory is not None else None
+        # (limit, budget, used) once the limit is exceeded
+        self.fired: Optional[tuple] = None
+        self.fired_at = 0.0
+        self.escalated = False
+
+
+class Watchdog:
+    """Thread interrupting calls exceeding their limits.
+
+    Args:
+        interval: seconds between checks.
+        grace: seconds to wait for a call on the main thread to stop before
+            interrupting it like Ctrl-C would.
+        escalate: if false, calls on the main thread are never interrupted
+            like Ctrl-C would, e.g. as the main thread serves requests.
+    """
+
+    def __init__(
+        self, interval: float = 0.05, grace: float = 1.0, escalate: bool = True
+    ):
+        self.interval = interval
+        self.grace = grace
+        self.escalate = escalate
+        self._cond = threading.Condition()
+        self._watches: Dict[int, _Watch] = {}
+        self._thread: Optional[threading.Thread] = None
+        # SIGINTs sent by escalating, not yet handled by `_on_sigint`
+        self._sigints = 0
+        # calls on the main thread in progress, and the SIGINT handler
+        # replaced by `_on_sigint` while there are any
+        self._main_calls = 0
+        self._hooked = False
+        self._prev_sigint: Any = None
+
+    def call(
+        self,
+        limits: Limits,
+        error: Type[LimitExceededError],
+        name: str,
+        file: Any,
+        fn: Callable[[], T],
+        section: Optional[Section] = None,
+    ) -> T:
+        """Call `fn`, enforcing `limits`.
+
+        The output limits are checked against `section`, if given, while `fn`
+        runs.
+
+        Raises:
+            `error` if `fn` exceeded its limits.
+        """
+        w = _Watch(limits, error, name, file, section)
+        on_main = self.escalate and w.ident == threading.main_thread().ident
+        if on_main:
+            self._hook_sigint()
+        try:
+            self._add(w)
+            try:
+                return fn()
+            finally:
+                self._remove_safely(w)
+        except (_LimitInterrupt, KeyboardInterrupt) as e:
+            if w.fired is None or (
+                isinstance(e, KeyboardInterrupt) and not w.escalated
+            ):
+                raise
+            limit, budget, used = w.fired
+            raise error(name, file, limit, budget, used) from None
+        finally:
+            if on_main:
+                self._unhook_sigint()
+
+    def _remove_safely(self, w: _Watch) -> None:
+        # an interrupt may arrive any time until the watch is removed, even
+        # while waiting to enter `_remove`. Those of the watchdog are dropped,
+        # a Ctrl-C is raised once the watch is gone.
+        interrupted: Optional[KeyboardInterrupt] = None
+        while True:
+            try:
+                self._remove(w)
+                break
+            except _LimitInterrupt:
+                continue
+            except KeyboardInterrupt as e:
+                interrupted = e
+        if interrupted is not None:
+            raise interrupted
+
+    def _hook_sigint(self) -> None:
+        # (main thread) handle SIGINTs sent by escalating while calls run
+        self._main_calls += 1
+        if not self._hooked:
+            self._prev_sigint = signal.signal(signal.SIGINT, self._on_sigint)
+            self._hooked = True
+
+    def _unhook_sigint(self) -> None:
+        with self._cond:
+            self._main_calls -= 1
+            if self._main_calls or self._sigints:
+                # a SIGINT sent is yet to arrive, `_on_sigint` unhooks
+                return
+        self._restore_sigint()
+
+    def _restore_sigint(self) -> None:
+        signal.signal(signal.SIGINT, self._prev_sigint)
+        self._prev_sigint = None
+        self._hooked = False
+
+    def _on_sigint(self, signum: int, frame: Any) -> None:
+        with self._cond:
+            sent = self._sigints > 0
+            if sent:
+                self._sigints -= 1
+                escalated = any(
+                    w.escalated and w.ident == threading.main_thread().ident
+                    for w in self._watches.values()
+                )
+                unhook = not self._main_calls and not self._sigints
+        prev = self._prev_sigint
+        if not sent:
+            # Ctrl-C
+            if callable(prev):
+                prev(signum, frame)
+            elif prev != signal.SIG_IGN:
+                raise KeyboardInterrupt
+            return
+        if unhook:
+            self._restore_sigint()
+        if escalated:
+            raise _LimitInterrupt
+        # sent for a call which ended before it arrived, ignored
+
+    def _add(self, w: _Watch) -> None:
+        with self._cond:
+            self._watches[id(w)] = w
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._loop, name="gcgen-watchdog", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+
+    def _remove(self, w: _Watch) -> None:
+        with self._cond:
+            self._watches.pop(id(w), None)
+            if w.fired is not None:
+                # the call may have ended before the exception was raised,
+                # cancel it. Not raised again once the watch is removed.
+                _raise_in(w.ident, None)
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._watches:
+                    self._cond.wait()
+                self._check(time.monotonic())
+            time.sleep(self.interval)
+
+    def _check(self, now: float) -> None:
+        mem = None
+        for w in self._watches.values():
+            if w.fired is None:
+                timeout, max_memory = w.limits.timeout, w.limits.max_memory
+                if timeout is not None and now - w.start > timeout:
+                    w.fired = ("time", timeout, now - w.start)
+                elif max_memory is not None and w.rss_start is not None:
+                    if mem is None:
+                        mem = rss()
+                    if mem is not None and mem - w.rss_start > max_memory:
+                        w.fired = ("memory", max_memory, mem - w.rss_start)
+                if w.fired is None and w.section is not None:
+                    w.fired = w.limits.output_exceeded(w.section)
+                if w.fired is None:
+                    continue
+                w.fired_at = now
+                logger.debug(
+                    "%s %r exceeded its %s limit", w.error.kind, w.name, w.fired[0]
+                )
+            if (
+                self.escalate
+                and not w.escalated
+                and w.ident == threading.main_thread().ident
+                and now - w.fired_at > self.grace
+            ):
+                # likely blocked in C code, which Ctrl-C can interrupt. The
+                # watch is removed under `_cond`, it is still running.
+                w.escalated = True
+                self._sigints += 1
+                _raise_in(w.ident, None)
+                _interrupt_main()
+                continue
+            # again until it stops, in case the call swallowed the exception
+            _raise_in(w.ident, _LimitInterrupt)
+
+
+class RunLimits:
+    """Limits of the snippet and generator calls of a run."""
+
+    def __init__(
+        self,
+        snippet: Optional[Limits] = None,
+        generator: Optional[Limits] = None,
+        watchdog: Optional[Watchdog] = None,
+    ):
+        self.snippet = snippet or Limits()
+        self.generator = generator or Limits()
+        self._watchdog = watchdog
+
+    @property
+    def watchdog(self) -> Watchdog:
+        if self._watchdog is None:
+            self._watchdog = Watchdog()
+        return self._watchdog
+
+    def call_snippet(
+        self,
+        fn: Any,
+        name: str,
+        file: Any,
+        call: Callable[[], T],
+        section: Optional[Section] = None,
+    ) -> T:
+        """Run `call`, running snippet `fn` emitting into `section`, within the
+        limits of the snippet."""
+        limits = self.snippet.for_fn(fn)
+        if not limits:
+            return call()
+        result = self.watchdog.call(
+            limits, SnippetLimitError, name, file, call, section
+        )
+        if section is not None:
+            # output emitted since the watchdog last checked
+            exceeded = limits.output_exceeded(section)
+            if exceeded is not None:
+                raise SnippetLimitError(name, file, *exceeded)
+        return result
+
+    def call_generator(self, fn: Any, name: str, file: Any, call: Callable[[], T]) -> T:
+        """Run `call`, running generator `fn`, within the limits of the generator."""
+        limits = self.generator.for_fn(fn)
+        if not limits:
+            return call()
+        return self.watchdog.call(limits, GeneratorLimitError, name, file, call)
+
+    def limit_async(self, fn: Any, aw: Awaitable, name: str, file: Any) -> Awaitable:
+        """Enforce the time budget of `async def` generator `fn` on `aw`.
+
+        Only works if the generator yields to the event loop, see
+        `call_generators` for generators blocking the loop.
+        """
+        timeout = self.generator.for_fn(fn).timeout
+        if timeout is None:
+            return aw
+
+        async def limited() -> Any:
+            task = asyncio.ensure_future(aw)
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+            if not done:
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+                raise GeneratorLimitError(name, file, "time", timeout, timeout)
+            return task.result()
+
+        return limited()
+
+    def call_generators(
+        self, pending: List[Tuple[str, Any]], file: Any, call: Callable[[], T]
+    ) -> T:
+        """Run `call`, running `async def` generators `pending` ((name, fn) pairs).
+
+        Enforces the most generous of their limits, such that generators
+        blocking the event loop are still interrupted.
+        """
+        limits = [self.generator.for_fn(fn) for _, fn in pending]
+        timeouts = [lim.timeout for lim in limits]
+        caps = [lim.max_memory for lim in limits]
+        combined = Limits(
+            None if None in timeouts or not timeouts else max(timeouts),  # type: ignore
+            None if None in caps or not caps else max(caps),  # type: ignore
+        )
+        if not combined:
+            return call()
+        name = " & ".join(name for name, _ in pending)
+        return self.watchdog.call(combined, GeneratorLimitError, name, file, call)
@@ -1,9 +1,39 @@
+import json
 import logging
-from typing import Optional, List, cast
+from pathlib import Path
+from typing import Optional, List, Union, cast
 from enum import Enum
 
 format = logging.Formatter("%(levelname)s - %(name)s: %(message)s")
 
+# attributes present on every `LogRecord`, anything else was passed via `extra`.
+_RECORD_ATTRS = frozenset(
+    logging.LogRecord("", logging.NOTSET, "", 0, "", None, None).__dict__
+) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as single-line JSON objects.
+
+    Any fields passed to the log call using `extra` (e.g.
+    `logger.info("parsing %s", f, extra={"event": "parse", "file": str(f)})`)
+    are included as fields of the JSON object.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, val in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = val
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
 
 class LogLevel(Enum):
     NOTSET = logging.NOTSET
@@ -48,7 +78,7 @@ def get_logger(
             l.setLevel(_fallback_loglevels[name])
         return l
     else:
-        return logging.getLogger()
+        return logging.getLogger(name)
 
 
 def loggers_set_log_level(level: LogLevel):
@@ -58,6 +88,22 @@ def loggers_set_log_level(level: LogLevel):
         logger.setLevel(level.value)
 
 
+def log_to_file(fpath: Union[Path, str], json_format: bool = False) -> logging.Handler:
+    """add handler writing all log output to `fpath`.
+
+    Args:
+        fpath: the file to write log output to (appends if it exists).
+        json_format: if true, write one JSON object per line rather than text.
+
+    Returns:
+        The installed handler.
+    """
+    fh = logging.FileHandler(fpath, encoding="utf-8")
+    fh.setFormatter(JsonFormatter() if json_format else format)
+    logging.getLogger().addHandler(fh)
+    return fh
+
+
 if __name__ != "__main__":
     # configure root logger to log to console
     # (wait with adding a file-handler until we know the project root)
@@ -0,0 +1,121 @@
+"""
+Content-addressed store of snippet output.
+
+Snippet output is stored under the key of the snippet call (see
+`gcgen.incremental.CallKeys.call_key`), which covers the snippet function,
+its argument, the file and the scope. The store may be restored onto fresh
+checkouts (e.g. CI runners), such that snippets whose inputs are unchanged
+need not be run at all.
+
+The store may be shared by several processes (and hosts, given a shared
+filesystem): entries are written to a temporary file and then renamed into
+place, such that readers, which take no locks, only ever see complete entries.
+Since entries are addressed by their content's key, concurrent writers of the
+same entry write the same content.
+"""
+import os
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from gcgen.log import get_logger
+
+
+logger = get_logger(__name__)
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+class OutputCache:
+    """Store of emitted snippet output, keyed by snippet call key.
+
+    Args:
+        cache_dir: directory holding the cached entries.
+        max_size: once the store exceeds this size (in bytes), the least
+            recently used entries are evicted by `prune`.
+    """
+
+    def __init__(self, cache_dir: Path, max_size: int = DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def get(self, key: str) -> Optional[str]:
+        """Get output stored under `key`, None if not found."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            # mark as recently used, for eviction
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return data.decode("utf-8")
+
+    def put(self, key: str, output: str) -> None:
+        """Store `output` under `key`.
+
+        Storing is best-effort, failing to write the entry is not an error.
+        """
+        path = self._path(key)
+        if path.exists():
+            # written by another run or process, content is the same.
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "wb", dir=path.parent, prefix=".", delete=False
+            ) as fh:
+                fh.write(output.encode("utf-8"))
+        except OSError:
+            logger.warning("failed to write output cache entry %s", path, exc_info=True)
+            return
+        try:
+            os.replace(fh.name, path)
+        except OSError:
+            logger.warning("failed to write output cache entry %s", path, exc_info=True)
+            Path(fh.name).unlink(missing_ok=True)
+
+    def prune(self) -> int:
+        """Evict least recently used entries until within `max_size`.
+
+        Returns:
+            The number of entries evicted.
+        """
+        entries: List[Tuple[int, int, Path]] = []
+        total = 0
+        for path in self.cache_dir.glob("??/*"):
+            if path.name.startswith("."):
+                # entry being written, possibly by another process
+                continue
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+            total += st.st_size
+        if total <= self.max_size:
+            return 0
+
+        evicted = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        logger.debug("evicted %d entries from output cache", evicted)
+        return evicted
@@ -0,0 +1,229 @@
+"""
+Memory profiling of snippets and generators.
+
+When profiling, every snippet call and generator call is measured using
+`tracemalloc`, recording:
+
+    peak:     the most memory allocated at once during the call, on top of
+              what was allocated before it.
+    retained: memory still allocated once the call returned, for snippets
+              this is mostly the `Section` they built.
+    lines, chars: (snippets) size of the `Section` they built.
+    sites:    (opt-in) the source lines which allocated the most (retained)
+              memory.
+
+The run-wide high-water mark is the peak of all memory allocated (traced)
+during the run.
+"""
+import contextlib
+import json
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from gcgen.emitter import Section
+from gcgen.log import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# (file:line, size, number of allocations)
+Site = Tuple[str, int, int]
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+class MemoryRecord:
+    """Memory used by one snippet or generator call."""
+
+    __slots__ = "kind", "name", "file", "peak", "retained", "sites", "lines", "chars"
+
+    def __init__(
+        self,
+        kind: str,
+        name: str,
+        file: Optional[str],
+        peak: int,
+        retained: int,
+        sites: List[Site],
+        lines: Optional[int] = None,
+        chars: Optional[int] = None,
+    ):
+        # 'snippet' or 'generator'
+        self.kind = kind
+        self.name = name
+        # file calling the snippet, or gcgen_conf.py file of the generator
+        self.file = file
+        self.peak = peak
+        self.retained = retained
+        self.sites = sites
+        # size of the section built by a snippet
+        self.lines = lines
+        self.chars = chars
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "file": self.file,
+            "peak": self.peak,
+            "retained": self.retained,
+            "lines": self.lines,
+            "chars": self.chars,
+            "sites": [
+                {"site": site, "size": size, "count": count}
+                for site, size, count in self.sites
+            ],
+        }
+
+
+class MemoryProfiler:
+    """Measures memory allocated by snippet and generator calls.
+
+    Calls are measured using `tracemalloc.get_traced_memory`, which is cheap.
+    Recording allocation sites takes a snapshot of all traced memory before
+    and after each call, which is slow, and is thus off by default.
+
+    Args:
+        top: number of allocation sites to record per call, 0 records none.
+        nframes: number of frames of the traceback of each allocation to keep,
+            more frames slow down the run further.
+    """
+
+    def __init__(self, top: int = 0, nframes: int = 1):
+        self.top = top
+        self.nframes = nframes
+        self.records: List[MemoryRecord] = []
+        self.high_water = 0
+        self._started = False
+        self._filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.nframes)
+            self._started = True
+        tracemalloc.reset_peak()
+
+    def stop(self) -> None:
+        if not tracemalloc.is_tracing():
+            return
+        self.high_water = max(self.high_water, tracemalloc.get_traced_memory()[1])
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+    @contextlib.contextmanager
+    def measure(
+        self,
+        kind: str,
+        name: str,
+        file: Optional[Any] = None,
+        output: Optional[Section] = None,
+    ) -> Iterator[None]:
+        """Measure the memory allocated by the body of the `with` statement.
+
+        If given, the size of section `output` is recorded as well.
+        """
+        if not tracemalloc.is_tracing():
+            yield
+            return
+        before_snap = tracemalloc.take_snapshot() if self.top else None
+        # do not lose the run's high-water mark when resetting the peak
+        self.high_water = max(self.high_water, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            self.high_water = max(self.high_water, peak)
+            sites: List[Site] = []
+            if before_snap is not None:
+                after_snap = tracemalloc.take_snapshot()
+                stats = after_snap.filter_traces(self._filters).compare_to(
+                    before_snap.filter_traces(self._filters), "lineno"
+                )
+                for stat in stats[: self.top]:
+                    if stat.size_diff <= 0:
+                        break
+                    frame = stat.traceback[0]
+                    sites.append(
+                        (
+                            f"{frame.filename}:{frame.lineno}",
+                            stat.size_diff,
+                            stat.count_diff,
+                        )
+                    )
+            record = MemoryRecord(
+                kind,
+                name,
+                None if file is None else str(file),
+                peak - before,
+                current - before,
+                sites,
+                None if output is None else output.lines,
+                None if output is None else output.chars,
+            )
+            self.records.append(record)
+            # logged as measured, to identify the culprit of runs killed for
+            # running out of memory.
+            logger.info(
+                "memory: %s %s: peak %s, retained %s",
+                kind,
+                name,
+                format_size(record.peak),
+                format_size(record.retained),
+                extra={
+                    "event": "memory",
+                    kind: name,
+                    "file": record.file,
+                    "peak": record.peak,
+                    "retained": record.retained,
+                },
+            )
+
+    def reset(self) -> None:
+        self.records = []
+        self.high_water = 0
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "high_water": self.high_water,
+            "calls": [r.to_json() for r in self.records],
+        }
+
+    def save(self, fpath: Path) -> None:
+        fpath.parent.mkdir(parents=True, exist_ok=True)
+        with open(fpath, "w", encoding="utf-8") as fh:
+            json.dump(self.to_json(), fh, indent=2)
+
+    def report(self, limit: int = 20) -> str:
+        """Human-readable report of the calls with the highest peaks."""
+        records = sorted(self.records, key=lambda r: r.peak, reverse=True)[:limit]
+        lines = [
+            f"Memory profile, {len(records)} of {len(self.records)} calls by peak:",
+            f"{'peak':>10}  {'retained':>10}  {'kind':<9}  name (file)",
+        ]
+        for r in records:
+            where = f" ({r.file})" if r.file else ""
+            if r.lines is not None:
+                where += f", output: {r.lines} lines, {r.chars} chars"
+            lines.append(
+                f"{format_size(r.peak):>10}  {format_size(r.retained):>10}  {r.kind:<9}  {r.name}{where}"
+            )
+            for site, size, count in r.sites:
+                lines.append(
+                    f"{'':>24}{format_size(size):>10}  {site} ({count} blocks)"
+                )
+        lines.append(f"Run high-water mark: {format_size(self.high_water)}")
+        return "\n".join(lines)
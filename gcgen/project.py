@@ -0,0 +1,49 @@
+"""
+Locating the root of a gcgen project.
+
+Kept apart from `gcgen.generate` such that clients of the daemon can find it
+without importing everything needed to run a project.
+"""
+from pathlib import Path
+
+from gcgen.excbase import GcgenError
+
+
+class ProjectRootNotFoundError(GcgenError):
+    def __init__(self, start: Path):
+        self.start = start
+        super().__init__(f"Failed to find project root relative to {start!s}")
+
+    def printerr(self) -> None:
+        print("Failed to find project root directory")
+        print("")
+        print("gcgen cannot determine the root of your project.")
+        print(
+            "The project root can be defined (i.e. `-p path/to/project`), or inferred."
+        )
+        print("The inferrence algorithm works as follows:")
+        print("From the current directory up to the root directory:")
+        print("1) search for a `gcgen_project.ini` file")
+        print("2) (if not found) restart search, look for a `.git` folder")
+        print("")
+        print("Neither was found, and gcgen gave up.")
+        print("TIP:")
+        print("  * Either specify the project root (`-p path/to/project/root`)")
+        print("  * (OR) create a `gcgen_project.ini` file in the project root folder")
+
+
+def find_project_root(start: Path) -> Path:
+    """Find directory closest to `start` which is determined to be a project root."""
+    search_path = [start, *start.parents]
+    for directory in search_path:
+        for elem in ["gcgen_project.ini", ".git"]:
+            p = directory / elem
+            if p.exists():
+                return directory
+    raise ProjectRootNotFoundError(start)
+
+
+__all__ = [
+    "ProjectRootNotFoundError",
+    "find_project_root",
+]
@@ -1,4 +1,5 @@
 from functools import reduce
+from typing import Any, List, Optional, Tuple
 
 _TOMBSTONE = object()
 
@@ -112,6 +113,19 @@ class Scope:
         """Update scope with all entries from `other`."""
         self._dict.update(other)
 
+    @property
+    def outer(self) -> Optional["Scope"]:
+        """The scope this scope was derived from, None if not derived."""
+        return self._outer
+
+    def local_items(self) -> List[Tuple[Any, Any]]:
+        """Entries set in this scope itself, not in the scopes it derives from."""
+        return [(k, v) for k, v in self._dict.items() if v != _TOMBSTONE]
+
+    def local_deleted(self) -> List[Any]:
+        """Keys of entries deleted in this scope itself."""
+        return [k for k, v in self._dict.items() if v == _TOMBSTONE]
+
     def to_dict(self) -> dict:
         """flatten scopes out to a dict."""
         dicts = []
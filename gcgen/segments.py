@@ -0,0 +1,364 @@
+"""
+Segment model of files with snippets.
+
+A file is modelled as a sequence of segments: verbatim spans, which gcgen
+copies as-is, and snippet bodies, which are replaced by the output of their
+snippet. Segments record their byte offsets, so once a file is modelled, it
+can be re-spliced without scanning its lines for snippet tags again. Models
+are recorded as files are parsed and are valid for as long as the file's
+size and modification time are unchanged.
+
+Tools may use `SegmentStore` (or `scan_segments`) to inspect the snippets of
+a file without running them.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional
+
+from gcgen.snippetparser import ParserBase, SnippetMatch
+
+
+SEGMENTS_VERSION = 1
+
+
+def decode(data: bytes) -> str:
+    """Decode file contents as gcgen reads files (UTF-8, universal newlines)."""
+    text = data.decode("utf-8", errors="ignore")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def decode_lines(data: bytes) -> Iterator[str]:
+    for line in data.splitlines(keepends=True):
+        yield decode(line)
+
+
+class Segment:
+    """A verbatim span or snippet body of a file.
+
+    `start` and `end` are the byte offsets of the span, or of the snippet's
+    body, which does not include the lines with the snippet's start and end
+    tags. The start tag line is part of the preceding verbatim span, the end
+    tag line belongs to the snippet and ends at `end_line_end`.
+    """
+
+    __slots__ = (
+        "start",
+        "end",
+        "name",
+        "raw_arg",
+        "prefix",
+        "line_start",
+        "line_end",
+        "body_hash",
+        "end_line_end",
+    )
+
+    def __init__(
+        self,
+        start: int,
+        end: int,
+        name: Optional[str] = None,
+        raw_arg: str = "",
+        prefix: str = "",
+        line_start: int = 0,
+        line_end: int = 0,
+        body_hash: str = "",
+        end_line_end: int = 0,
+    ):
+        self.start = start
+        self.end = end
+        # snippet name, None for verbatim spans
+        self.name = name
+        self.raw_arg = raw_arg
+        self.prefix = prefix
+        # line numbers (1-based) of the snippet start and end tags
+        self.line_start = line_start
+        self.line_end = line_end
+        self.body_hash = body_hash
+        self.end_line_end = end_line_end
+
+    @property
+    def is_snippet(self) -> bool:
+        return self.name is not None
+
+    def to_json(self) -> list:
+        if self.name is None:
+            return [self.start, self.end]
+        return [
+            self.start,
+            self.end,
+            self.name,
+            self.raw_arg,
+            self.prefix,
+            self.line_start,
+            self.line_end,
+            self.body_hash,
+            self.end_line_end,
+        ]
+
+    @classmethod
+    def from_json(cls, val: list) -> "Segment":
+        return cls(*val)
+
+    def __repr__(self) -> str:
+        if self.name is None:
+            return f"Segment({self.start}, {self.end})"
+        return f"Segment({self.start}, {self.end}, name={self.name!r})"
+
+
+class FileSegments:
+    """Segments of a file, valid while the file's size and mtime are unchanged."""
+
+    __slots__ = "mtime_ns", "size", "segments"
+
+    def __init__(self, mtime_ns: int, size: int, segments: List[Segment]):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.segments = segments
+
+    def snippets(self) -> List[Segment]:
+        return [seg for seg in self.segments if seg.name is not None]
+
+    def matches(
+        self,
+        data: bytes,
+        write: Optional[Callable[[str], Any]] = None,
+        bodies: bool = False,
+    ) -> Iterator[SnippetMatch]:
+        """Like `ParserBase.scan`, but slicing `data` (the file's contents) by offset."""
+        for seg in self.segments:
+            if seg.name is None:
+                if write is not None:
+                    write(decode(data[seg.start : seg.end]))
+                continue
+            yield SnippetMatch(
+                seg.name,
+                seg.raw_arg,
+                seg.prefix,
+                seg.line_start,
+                seg.line_end,
+                list(decode_lines(data[seg.start : seg.end])) if bodies else [],
+                decode(data[seg.end : seg.end_line_end]),
+            )
+
+
+class SegmentTracker:
+    """Writer recording the segments of the output of `ParserBase.parse`."""
+
+    def __init__(self, w: Any, newline: str = "\n"):
+        self._w = w
+        self._newline = newline
+        self.pos = 0
+        self.lines = 0
+        self.segments: List[Segment] = []
+        self._verbatim_start = 0
+        self._body: Optional[Any] = None
+        self._line_start = 0
+
+    def write(self, text: str) -> None:
+        self._w.write(text)
+        # as written by `BinaryWriter`
+        if self._newline != "\n":
+            data = text.replace("\n", self._newline).encode("utf-8")
+        else:
+            data = text.encode("utf-8")
+        self.pos += len(data)
+        self.lines += text.count("\n")
+        if self._body is not None:
+            self._body.update(data)
+
+    def writelines(self, lines: List[str]) -> None:
+        for line in lines:
+            self.write(line)
+
+    def begin_snippet(self) -> None:
+        if self.pos > self._verbatim_start:
+            self.segments.append(Segment(self._verbatim_start, self.pos))
+        self._verbatim_start = self.pos
+        # the start tag line was the last line written
+        self._line_start = self.lines
+        self._body = hashlib.sha1()
+
+    def end_snippet(self, m: SnippetMatch) -> None:
+        """Record snippet body written since `begin_snippet`, then write end line."""
+        assert self._body is not None
+        body_hash = self._body.hexdigest()
+        self._body = None
+        start, end = self._verbatim_start, self.pos
+        line_end = self.lines + 1
+        self.write(m.end_line)
+        self.segments.append(
+            Segment(
+                start,
+                end,
+                m.name,
+                m.raw_arg,
+                m.prefix,
+                self._line_start,
+                line_end,
+                body_hash,
+                self.pos,
+            )
+        )
+        self._verbatim_start = self.pos
+
+    def finish(self, mtime_ns: int, size: int) -> FileSegments:
+        if self.pos > self._verbatim_start:
+            self.segments.append(Segment(self._verbatim_start, self.pos))
+        return FileSegments(mtime_ns, size, self.segments)
+
+
+class SegmentStore:
+    """Segment models of the files of a project, keyed by path relative to `root`.
+
+    Args:
+        root: the project root.
+        tags: identifies the snippet tags used to scan files, models made
+            using other tags are discarded on load.
+    """
+
+    def __init__(self, root: Path, tags: str = ""):
+        self.root = root
+        self.tags = tags
+        self.files: Dict[str, FileSegments] = {}
+
+    def _key(self, fpath: Path) -> Optional[str]:
+        try:
+            return str(fpath.resolve().relative_to(self.root))
+        except ValueError:
+            return None
+
+    def lookup(self, fpath: Path) -> Optional[FileSegments]:
+        """Get segments of `fpath`, if present and up-to-date."""
+        key = self._key(fpath)
+        model = self.files.get(key) if key is not None else None
+        if model is None:
+            return None
+        try:
+            st = fpath.stat()
+        except OSError:
+            return None
+        if st.st_mtime_ns != model.mtime_ns or st.st_size != model.size:
+            return None
+        return model
+
+    def lines(self, fh: BinaryIO) -> Iterator[str]:
+        """Lines of binary file `fh`, as scanned when no model is available."""
+        for line in fh:
+            if b"\r" in line:
+                # a lone '\r' also ends a line (universal newlines)
+                yield from decode_lines(line)
+            else:
+                yield decode(line)
+
+    def tracker(self, w: Any, newline: str = "\n") -> SegmentTracker:
+        return SegmentTracker(w, newline)
+
+    def update(self, fpath: Path, tracker: SegmentTracker, st: os.stat_result) -> None:
+        """Record segments of `fpath`, just written using `tracker`.
+
+        Args:
+            fpath: the file written.
+            st: status of the file written, it may not be in place yet (see
+                `gcgen.transaction`), renaming it keeps its modification time.
+            tracker: writer the file's contents were written through.
+        """
+        key = self._key(fpath)
+        if key is None:
+            return
+        if st.st_size != tracker.pos:
+            # written in another encoding or with translated newlines, the
+            # offsets recorded are wrong.
+            self.files.pop(key, None)
+            return
+        self.files[key] = tracker.finish(st.st_mtime_ns, st.st_size)
+
+    def drop(self, fpath: Path) -> None:
+        """Drop model of `fpath`, e.g. as the file written was discarded."""
+        key = self._key(fpath)
+        if key is not None:
+            self.files.pop(key, None)
+
+    def save(self, fpath: Path) -> None:
+        """Write segment models to `fpath` (atomically)."""
+        data = {
+            "version": SEGMENTS_VERSION,
+            "tags": self.tags,
+            "files": {
+                key: {
+                    "mtime_ns": m.mtime_ns,
+                    "size": m.size,
+                    "segments": [seg.to_json() for seg in m.segments],
+                }
+                for key, m in self.files.items()
+            },
+        }
+        fpath.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=fpath.parent, delete=False, encoding="utf-8"
+        ) as fh:
+            json.dump(data, fh)
+        os.replace(fh.name, fpath)
+
+    @classmethod
+    def load(cls, root: Path, fpath: Path, tags: str = "") -> "SegmentStore":
+        """Load segment models from `fpath`, returns an empty store if unreadable."""
+        store = cls(root, tags)
+        try:
+            with open(fpath, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return store
+        if not isinstance(data, dict) or data.get("version") != SEGMENTS_VERSION:
+            return store
+        if data.get("tags", "") != tags:
+            return store
+        for key, m in data["files"].items():
+            store.files[key] = FileSegments(
+                m["mtime_ns"],
+                m["size"],
+                [Segment.from_json(seg) for seg in m["segments"]],
+            )
+        return store
+
+
+def scan_segments(fpath: Path, parser: ParserBase) -> FileSegments:
+    """Build segment model of `fpath` by scanning it, without running snippets."""
+    with open(fpath, "rb") as fh:
+        data = fh.read()
+    st = os.stat(fpath)
+    segments: List[Segment] = []
+    pos = 0
+    offset = 0
+    offsets = [0]
+    for line in data.splitlines(keepends=True):
+        offset += len(line)
+        offsets.append(offset)
+    for m in parser.scan(decode_lines(data), fpath):
+        # line numbers are 1-based, offsets[n] is the end of line n
+        start = offsets[m.line_start]
+        end = offsets[m.line_end - 1]
+        if start > pos:
+            segments.append(Segment(pos, start))
+        segments.append(
+            Segment(
+                start,
+                end,
+                m.name,
+                m.raw_arg,
+                m.prefix,
+                m.line_start,
+                m.line_end,
+                hashlib.sha1(data[start:end]).hexdigest(),
+                offsets[m.line_end],
+            )
+        )
+        pos = offsets[m.line_end]
+    if len(data) > pos:
+        segments.append(Segment(pos, len(data)))
+    return FileSegments(st.st_mtime_ns, st.st_size, segments)
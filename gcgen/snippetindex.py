@@ -0,0 +1,235 @@
+"""
+Index of the snippet calls of a project.
+
+The index records every snippet call of each parsed file, allowing to find
+all callers of a snippet and to skip files without any snippets entirely.
+Entries are invalidated by changes to the file's size or modification time.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from gcgen.snippetparser import ParserBase, SnippetMatch
+
+
+INDEX_VERSION = 1
+
+
+class SnippetCall:
+    """A snippet call recorded in the index."""
+
+    __slots__ = "line", "name", "raw_arg", "body_hash"
+
+    def __init__(self, line: int, name: str, raw_arg: str, body_hash: str):
+        self.line = line
+        self.name = name
+        self.raw_arg = raw_arg
+        self.body_hash = body_hash
+
+    def __eq__(self, other):
+        return isinstance(other, SnippetCall) and self.to_json() == other.to_json()
+
+    def __repr__(self):
+        return f"SnippetCall({self.line!r}, {self.name!r}, {self.raw_arg!r})"
+
+    def to_json(self) -> list:
+        return [self.line, self.name, self.raw_arg, self.body_hash]
+
+    @classmethod
+    def from_json(cls, val: list) -> "SnippetCall":
+        return cls(*val)
+
+
+class FileEntry:
+    __slots__ = "mtime_ns", "size", "calls"
+
+    def __init__(self, mtime_ns: int, size: int, calls: List[SnippetCall]):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.calls = calls
+
+
+def body_hash(lines: Iterable[str]) -> str:
+    h = hashlib.sha1()
+    for line in lines:
+        h.update(line.encode("utf-8"))
+    return h.hexdigest()
+
+
+class CallRecorder:
+    """Writer recording the snippet calls of the output of `ParserBase.parse`.
+
+    Calls are recorded as scanning the file once written would find them.
+    """
+
+    __slots__ = "_w", "lines", "calls", "_body", "_line_start"
+
+    def __init__(self, w: Any):
+        self._w = w
+        self.lines = 0
+        self.calls: List[SnippetCall] = []
+        self._body: Optional[Any] = None
+        self._line_start = 0
+
+    def write(self, text: str) -> None:
+        self._w.write(text)
+        self.lines += text.count("\n")
+        if self._body is not None:
+            self._body.update(text.encode("utf-8", "surrogatepass"))
+
+    def writelines(self, lines: Iterable[str]) -> None:
+        for line in lines:
+            self.write(line)
+
+    def begin_snippet(self) -> None:
+        # the start tag line was the last line written
+        self._line_start = self.lines
+        self._body = hashlib.sha1()
+
+    def end_snippet(self, m: SnippetMatch) -> None:
+        """Record snippet call, its body written since `begin_snippet`."""
+        assert self._body is not None
+        call = SnippetCall(self._line_start, m.name, m.raw_arg, self._body.hexdigest())
+        self.calls.append(call)
+        self._body = None
+
+
+class SnippetIndex:
+    """Index of snippet calls, keyed by file path relative to `root`.
+
+    Args:
+        root: the project root.
+        tags: identifies the snippet tags used to scan files, entries made
+            using other tags are discarded on load.
+    """
+
+    def __init__(self, root: Path, tags: str = ""):
+        self.root = root
+        self.tags = tags
+        self.files: Dict[str, FileEntry] = {}
+
+    def _key(self, fpath: Path) -> Optional[str]:
+        try:
+            return str(fpath.relative_to(self.root))
+        except ValueError:
+            # outside of the project (e.g. a resolved symlink), not indexed
+            return None
+
+    def lookup(self, fpath: Path) -> Optional[FileEntry]:
+        """Get index entry of `fpath`, if present and up-to-date."""
+        key = self._key(fpath)
+        entry = self.files.get(key) if key is not None else None
+        if entry is None:
+            return None
+        try:
+            st = fpath.stat()
+        except OSError:
+            return None
+        if st.st_mtime_ns != entry.mtime_ns or st.st_size != entry.size:
+            return None
+        return entry
+
+    def has_no_snippets(self, fpath: Path) -> bool:
+        """True iff. the index shows `fpath` to be unchanged and without snippets."""
+        entry = self.lookup(fpath)
+        return entry is not None and not entry.calls
+
+    def update(self, fpath: Path, parser: ParserBase) -> FileEntry:
+        """(Re-)index `fpath` using the tag detection of `parser`, unless up-to-date."""
+        entry = self.lookup(fpath)
+        if entry is not None:
+            return entry
+        st = fpath.stat()
+        with open(fpath, "r", encoding="utf-8", errors="ignore") as src:
+            calls = [
+                SnippetCall(m.line_start, m.name, m.raw_arg, body_hash(m.body))
+                for m in parser.scan(src, fpath, bodies=True)
+            ]
+        entry = FileEntry(st.st_mtime_ns, st.st_size, calls)
+        key = self._key(fpath)
+        if key is not None:
+            self.files[key] = entry
+        return entry
+
+    def recorder(self, w: Any) -> CallRecorder:
+        return CallRecorder(w)
+
+    def record(self, fpath: Path, st: os.stat_result, recorder: CallRecorder) -> None:
+        """Record calls of `fpath`, just written using `recorder`.
+
+        Args:
+            fpath: the file written.
+            st: status of the file written, it may not be in place yet.
+            recorder: writer the file's contents were written through.
+        """
+        key = self._key(fpath)
+        if key is not None:
+            self.files[key] = FileEntry(st.st_mtime_ns, st.st_size, recorder.calls)
+
+    def drop(self, fpath: Path) -> None:
+        """Drop entry of `fpath`, e.g. as the file written was discarded."""
+        key = self._key(fpath)
+        if key is not None:
+            self.files.pop(key, None)
+
+    def retain(self, fpaths: Iterable[Path]) -> None:
+        """Drop entries of all files not in `fpaths`."""
+        keep = {self._key(f) for f in fpaths}
+        for key in list(self.files):
+            if key not in keep:
+                del self.files[key]
+
+    def callers(self, snippet_name: str) -> List[Tuple[str, int]]:
+        """Get (file, line) of each call to snippet `snippet_name`."""
+        return [
+            (fpath, call.line)
+            for fpath, entry in sorted(self.files.items())
+            for call in entry.calls
+            if call.name == snippet_name
+        ]
+
+    def save(self, fpath: Path) -> None:
+        """Write index to `fpath` (atomically)."""
+        data = {
+            "version": INDEX_VERSION,
+            "tags": self.tags,
+            "files": {
+                key: {
+                    "mtime_ns": e.mtime_ns,
+                    "size": e.size,
+                    "calls": [c.to_json() for c in e.calls],
+                }
+                for key, e in self.files.items()
+            },
+        }
+        fpath.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=fpath.parent, delete=False, encoding="utf-8"
+        ) as fh:
+            json.dump(data, fh)
+        os.replace(fh.name, fpath)
+
+    @classmethod
+    def load(cls, root: Path, fpath: Path, tags: str = "") -> "SnippetIndex":
+        """Load index from `fpath`, returns an empty index if unreadable."""
+        index = cls(root, tags)
+        try:
+            with open(fpath, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return index
+        if not isinstance(data, dict) or data.get("version") != INDEX_VERSION:
+            return index
+        if data.get("tags", "") != tags:
+            # files may contain snippets using tags unknown when indexed
+            return index
+        for key, e in data["files"].items():
+            index.files[key] = FileEntry(
+                e["mtime_ns"],
+                e["size"],
+                [SnippetCall.from_json(c) for c in e["calls"]],
+            )
+        return index
@@ -1,13 +1,26 @@
 from pathlib import Path
-from os import replace as os_replace
-from io import TextIOWrapper
-from re import compile as re_compile
+from re import compile as re_compile, escape as re_escape
 from gcgen.log import get_logger, LogLevel
 from gcgen.excbase import GcgenError
+from gcgen.durability import current_file, replace_file
+from gcgen.emitter.binary import BinaryWriter, is_utf8
+from gcgen.emitter.emitter import Writer
 from gcgen.api.types import Json
 import json
+import logging
+import os
 from json.decoder import JSONDecodeError
-from typing import Optional
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 
 logger = get_logger(__name__)
@@ -105,10 +118,229 @@ class SnippetJsonValueError(SnippetParseError):
         print(f"  JSON Decode error: {str(self.json_err)}")
 
 
+class SnippetArgSchemaError(SnippetParseError):
+    def __init__(
+        self,
+        file: Path,
+        snippet: str,
+        value: str,
+        problems: List[str],
+        line_start: int,
+    ):
+        self.file = file
+        self.snippet = snippet
+        self.line_start = line_start
+        self.value = value
+        self.problems = problems
+
+        super().__init__(
+            "snippet argument does not match the snippet's schema",
+            file,
+            snippet,
+            line_start,
+            line_start,
+        )
+
+    def printerr(self) -> None:
+        print("Snippet argument validation error:")
+        print("")
+        print("Argument does not match the schema of the snippet")
+        print("")
+        print("Details:")
+        print(f"  File: {self.file}")
+        print(f"  Snippet: {self.snippet!r}")
+        print(f"  Snippet start line: {self.line_start}")
+        print(f"  Raw value: {self.value!r}")
+        print(f"  Problems:")
+        for problem in self.problems:
+            print(f"    * {problem}")
+
+
+class SnippetArgErrors(SnippetParseError):
+    def __init__(self, file: Path, errors: List[SnippetParseError]):
+        self.file = file
+        self.errors = errors
+        super().__init__(f"{file!s}: {len(errors)} invalid snippet arguments")
+
+    def printerr(self) -> None:
+        print(f"Found {len(self.errors)} invalid snippet arguments in {self.file}")
+        for err in self.errors:
+            print("")
+            err.printerr()
+
+
+ArgError = Union[JSONDecodeError, List[str]]
+
+
+class SnippetMatch:
+    """A snippet found while scanning a file."""
+
+    __slots__ = (
+        "name",
+        "raw_arg",
+        "prefix",
+        "line_start",
+        "line_end",
+        "body",
+        "end_line",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        raw_arg: str,
+        prefix: str,
+        line_start: int,
+        line_end: int,
+        body: List[str],
+        end_line: str,
+    ):
+        self.name = name
+        # argument as written in the file, empty string if no argument given
+        self.raw_arg = raw_arg
+        # whitespace preceding the snippet start tag
+        self.prefix = prefix
+        self.line_start = line_start
+        self.line_end = line_end
+        # lines between the snippet start and end lines, only if asked for
+        # (see `ParserBase.scan`)
+        self.body = body
+        self.end_line = end_line
+
+
+TagPair = Tuple[str, str]
+
+
+class TagSet:
+    """Snippet tag pairs (start tag, end tag) recognized in a file.
+
+    With a single pair, lines are scanned using `str.find`, otherwise all
+    start tags are matched in one pass using a combined regular expression.
+
+    Raises:
+        ValueError: if no pairs are given, or two pairs share a start tag.
+    """
+
+    __slots__ = "pairs", "_ends", "_rgx", "_start", "_end"
+
+    def __init__(self, pairs: Iterable[TagPair]):
+        self.pairs: List[TagPair] = list(pairs)
+        if not self.pairs:
+            raise ValueError("no snippet tags given")
+        self._ends: Dict[str, str] = {}
+        for start, end in self.pairs:
+            if not start or not end:
+                raise ValueError("snippet tags must not be empty")
+            if start in self._ends:
+                raise ValueError(f"snippet start tag {start!r} given more than once")
+            self._ends[start] = end
+        self._start, self._end = self.pairs[0]
+        self._rgx = None
+        if len(self.pairs) > 1:
+            # longest first, such that a tag which is a prefix of another
+            # does not shadow it.
+            starts = sorted(self._ends, key=len, reverse=True)
+            self._rgx = re_compile("|".join(re_escape(start) for start in starts))
+
+    def find(self, line: str) -> Optional[Tuple[int, int, str, str]]:
+        """Find snippet start tag in `line`.
+
+        Returns:
+            None if the line does not open a snippet, otherwise the offsets of
+            the start tag and of the end tag within the line, followed by the
+            start and end tags.
+        """
+        rgx = self._rgx
+        if rgx is None:
+            start = self._start
+            s_start = line.find(start)
+            if s_start == -1:
+                return None
+            end = self._end
+        else:
+            m = rgx.search(line)
+            if m is None:
+                return None
+            s_start = m.start()
+            start = m.group()
+            end = self._ends[start]
+        # note: we deliberately start the search PAST the opening tag
+        # (to support opening- and closing snippet tag being the same)
+        # - we then add the offset of the end of the opening snippet tag to `s_end`
+        # to again get the full line offset of where the end snippet tag is.
+        s_end = line.find(end, s_start + len(start))
+        if s_end == -1:
+            return None
+        return s_start, s_end, start, end
+
+
 class ParserBase:
-    def __init__(self, snippet_start: str, snippet_end: str):
+    """Scans files for snippets.
+
+    Args:
+        snippet_start: start tag of snippets.
+        snippet_end: end tag of snippets.
+        tags_by_suffix: (optional) tag pairs to use for files by suffix (e.g.
+            'py'), files of other types use `snippet_start` & `snippet_end`.
+    """
+
+    def __init__(
+        self,
+        snippet_start: str,
+        snippet_end: str,
+        tags_by_suffix: Optional[Dict[str, List[TagPair]]] = None,
+    ):
         self.snippet_start = snippet_start
         self.snippet_end = snippet_end
+        self._tags = TagSet([(snippet_start, snippet_end)])
+        self._tags_by_suffix = {
+            suffix: TagSet(pairs) for suffix, pairs in (tags_by_suffix or {}).items()
+        }
+        # raw argument string => parsed value (or decode error)
+        self._arg_cache: Dict[str, Union[Json, JSONDecodeError]] = {}
+        # snippet call being processed by `on_snippet`, and its position
+        # among the snippet calls of the file.
+        self.match: Optional[SnippetMatch] = None
+        self.match_index = -1
+        # (optional) `gcgen.segments.SegmentStore`, segment models of files
+        # parsed earlier, used instead of scanning unchanged files.
+        self.segments: Optional[Any] = None
+        # (optional) `gcgen.snippetindex.SnippetIndex`, updated with the
+        # snippet calls of the files written by `parse`.
+        self.index: Optional[Any] = None
+        # if true, snippet bodies are kept in `SnippetMatch.body` for
+        # `on_snippet` to use, otherwise they are skipped.
+        self.keep_bodies = False
+
+    def validate_arg(
+        self, snippet_name: str, snippet_arg: Json, raw_arg: str
+    ) -> List[str]:
+        """Validate argument of snippet, return list of problems found (if any).
+
+        Called for each snippet before `on_snippet`, the default implementation
+        accepts any argument.
+        """
+        return []
+
+    def parse_arg(self, raw_arg: str) -> Union[Json, JSONDecodeError]:
+        """Parse raw snippet argument, returning the value or the decode error.
+
+        NOTE: parsed values are cached by their raw string and thus shared
+        between all snippet calls with the same argument, treat as read-only.
+        """
+        try:
+            return self._arg_cache[raw_arg]
+        except KeyError:
+            pass
+        if raw_arg.strip() in ("", "null"):
+            val = None
+        else:
+            try:
+                val = json.loads(raw_arg)
+            except JSONDecodeError as e:
+                val = e
+        self._arg_cache[raw_arg] = val
+        return val
 
     def on_snippet(
         self,
@@ -116,135 +348,229 @@ class ParserBase:
         snippet_name: str,
         snippet_arg: Json,
         src_path: Path,
-        fh: TextIOWrapper,
+        fh: Writer,
     ):
         pass
 
+    def file_format(self, fpath: Path) -> Tuple[str, str]:
+        """Get the (encoding, newline) of file `fpath`, used to read & write it."""
+        return "utf-8", "\n"
+
+    def tags(self, fpath: Path) -> TagSet:
+        """Get the snippet tags of file `fpath`."""
+        return self._tags_by_suffix.get(fpath.suffix[1:], self._tags)
+
+    def find_tag(self, line: str) -> Optional[Tuple[int, int]]:
+        """Find (default) snippet start tag in `line`.
+
+        Returns:
+            None if the line does not open a snippet, otherwise the offsets of
+            the start tag and of the end tag within the line.
+        """
+        tag = self._tags.find(line)
+        return None if tag is None else tag[:2]
+
+    def scan(
+        self,
+        src: Iterable[str],
+        fpath: Path,
+        write: Optional[Callable[[str], Any]] = None,
+        bodies: bool = False,
+    ) -> Iterator[SnippetMatch]:
+        """Scan lines of `src` for snippets.
+
+        Args:
+            src: the lines of the file to scan.
+            fpath: path of the file, used in error reporting.
+            write: (optional) called with every line outside of snippet
+                bodies, including the snippet start line, but excluding the
+                snippet end line (`SnippetMatch.end_line`).
+            bodies: if true, collect the lines of each snippet's body into
+                `SnippetMatch.body`, otherwise the body is left empty.
+
+        Returns:
+            An iterator yielding a `SnippetMatch` as each snippet end is found.
+        """
+        find_tag = self.tags(fpath).find
+        debug = logger.isEnabledFor(logging.DEBUG)
+        src = iter(src)
+        lineno = 0
+        while True:
+            inside_snippet = False
+            for line in src:
+                lineno += 1
+                if write is not None:
+                    write(line)
+                tag = find_tag(line)
+                if tag is None:
+                    continue
+                s_start, s_end, snippet_start, snippet_end = tag
+                prefix = line[0:s_start]
+                inside_snippet = True
+
+                parts = (
+                    line[s_start + len(snippet_start) : s_end].lstrip().split(None, 1)
+                )
+                # -> parts: [<snippet_name: str>, <rest (args): str>]
+                # if len(parts) == 1 -> No args
+                # otherwise, arg.
+                snippet_name = parts[0]
+                snippet_arg_raw = parts[1] if len(parts) > 1 else ""
+
+                # break out of loop, we are processing an open snippet now.
+                break
+
+            if not inside_snippet:
+                # we exhausted the file line iterator without finding a new opening
+                # snippet, hence we stop here (no error)
+                return
+
+            end_of_snippet = f"{prefix}{snippet_start}"
+            prefix_match = rgx_ws_prefix.match(prefix)
+            assert (
+                prefix_match is not None
+            ), "regex failed to extract line whitespace prefix"
+            snippet_prefix = prefix_match.group(1)
+            if debug:
+                logger.debug("snippet_name: %s", snippet_name)
+                logger.debug("raw prefix %r (len: %d)", prefix, len(prefix))
+                logger.debug(
+                    "snippet prefix: %r (len: %d)",
+                    snippet_prefix,
+                    len(snippet_prefix),
+                )
+            snippet_line_start = lineno
+            body: List[str] = []
+
+            for line in src:
+                lineno += 1
+                if not line.startswith(end_of_snippet):
+                    if bodies:
+                        body.append(line)
+                    continue
+
+                # Should be [<snippet_name: str>, <snippet_end: str>, <OPT extra junk on the line>]
+                snip_line_parts = line[len(end_of_snippet) :].split()
+                if len(snip_line_parts) < 2 or snip_line_parts[1] != snippet_end:
+                    raise Exception(f"malformed snippet {line!r}")
+                elif len(snip_line_parts[0]) > 0 and snip_line_parts[0][0] != "/":
+                    raise NestedSnippetsError(
+                        fpath, snippet_name, snippet_line_start, lineno
+                    )
+                elif snip_line_parts[0] != f"/{snippet_name}":
+                    raise Exception(f"invalid snippet end tag {line!r}")
+                yield SnippetMatch(
+                    snippet_name,
+                    snippet_arg_raw,
+                    snippet_prefix,
+                    snippet_line_start,
+                    lineno,
+                    body,
+                    line,
+                )
+                inside_snippet = False
+                break
+
+            if inside_snippet:
+                # we exhausted the file line iterator without finding a corresponding
+                # snippet end, so we abort, this is an error
+                raise UnclosedSnippetError(
+                    fpath,
+                    snippet_name,
+                    snippet_line_start,
+                    lineno,
+                )
+
     def parse(self, fpath: Path, dpath: Path):
-        snippet_start = self.snippet_start
-        snippet_start_len = len(snippet_start)
-        snippet_end = self.snippet_end
-        dst: Optional[TextIOWrapper]
+        arg_errors: List[SnippetParseError] = []
+        dst: Optional[BinaryWriter]
 
+        encoding, newline = self.file_format(fpath)
+        utf8 = is_utf8(encoding)
         if fpath == dpath:
-            dst = open(Path(str(dpath) + ".gcgen.tmp"), mode="w")
+            fh = open(Path(str(dpath) + ".gcgen.tmp"), mode="wb")
         else:
-            dst = open(dpath, mode="w")
+            fh = open(dpath, mode="wb")
+        dst = BinaryWriter(fh, encoding, newline)
 
         try:
             if fpath.is_symlink():
                 return
-            with open(fpath, "r", encoding="utf-8", errors="ignore") as src:
-                prefix = snippet_name = ""  # only to satisfy type checker.
-                lineno = 0
-                while True:
-                    inside_snippet = False
-                    for line in src:
-                        lineno += 1
-                        dst.write(line)
-                        s_start = line.find(snippet_start)
-                        if s_start == -1:
-                            continue
-                        # note: we deliberately start the search PAST the opening tag
-                        # (to support opening- and closing snippet tag being the same)
-                        # - we then add the offset of the end of the opening snippet tag to `s_end`
-                        # to again get the full line offset of where the end snippet tag is.
-                        s_end = line[s_start + snippet_start_len :].find(snippet_end)
-                        if s_end == -1:
-                            continue
-                        s_end += snippet_start_len + s_start
-                        prefix = line[0:s_start]
-                        inside_snippet = True
-
-                        parts = (
-                            line[s_start + len(snippet_start) : s_end]
-                            .lstrip()
-                            .split(None, 1)
-                        )
-                        # -> parts: [<snippet_name: str>, <rest (args): str>]
-                        # if len(parts) == 1 -> No args
-                        # otherwise, arg.
-                        snippet_name = parts[0]
-                        if len(parts) == 1:
-                            snippet_arg = None
-                        else:
-                            snippet_arg = parts[1]
-                            if snippet_arg.strip() in ("", "null"):
-                                snippet_arg = None
-                            else:
-                                try:
-                                    snippet_arg_raw = snippet_arg
-                                    snippet_arg = json.loads(snippet_arg)
-                                except JSONDecodeError as e:
-                                    raise SnippetJsonValueError(
-                                        fpath,
-                                        snippet_name,
-                                        snippet_arg_raw,
-                                        e,
-                                        lineno,
-                                    ) from e
-
-                        # break out of loop, we are processing an open snippet now.
-                        break
-
-                    if not inside_snippet:
-                        # we exhausted the file line iterator without finding a new opening
-                        # snippet, hence we stop here (no error)
-                        break
-
-                    end_of_snippet = f"{prefix}{snippet_start}"
-                    prefix_match = rgx_ws_prefix.match(prefix)
-                    assert (
-                        prefix_match is not None
-                    ), "regex failed to extract line whitespace prefix"
-                    snippet_prefix = prefix_match.group(1)
-                    logger.debug(f"snippet_name: {snippet_name}")
-                    logger.debug(f"raw prefix {prefix!r} (len: {len(prefix)})")
-                    logger.debug(
-                        f"snippet prefix: {snippet_prefix!r} (len: {len(snippet_prefix)})"
+            store = self.segments
+            if store is not None and not utf8:
+                # segment offsets are only recorded for UTF-8 files
+                store = None
+            index = self.index
+            # transactional runs read files written earlier in the run from
+            # their staged contents
+            src_path = current_file(fpath)
+            out: Any = dst
+            recorder = tracker = None
+            if index is not None:
+                out = recorder = index.recorder(out)
+            if store is None:
+                # universal newlines, lines written are translated to `newline`
+                src = open(src_path, "r", encoding=encoding, errors="ignore")
+                matches = self.scan(src, fpath, out.write, self.keep_bodies)
+            else:
+                out = tracker = store.tracker(out, newline)
+                src = open(src_path, "rb")
+                # models describe the file in place, not the staged one
+                model = store.lookup(fpath) if src_path == str(fpath) else None
+                if model is None:
+                    matches = self.scan(
+                        store.lines(src), fpath, out.write, self.keep_bodies
                     )
-                    snippet_line_start = lineno
-
-                    for line in src:
-                        lineno += 1
-                        if not line.startswith(end_of_snippet):
-                            continue
-
-                        # Should be [<snippet_name: str>, <snippet_end: str>, <OPT extra junk on the line>]
-                        snip_line_parts = line[len(end_of_snippet) :].split()
-                        if (
-                            len(snip_line_parts) < 2
-                            or snip_line_parts[1] != snippet_end
-                        ):
-                            raise Exception(f"malformed snippet {line!r}")
-                        elif (
-                            len(snip_line_parts[0]) > 0 and snip_line_parts[0][0] != "/"
-                        ):
-                            raise NestedSnippetsError(
-                                fpath, snippet_name, snippet_line_start, lineno
+                else:
+                    # re-splice by offset, the file is as we last wrote it.
+                    matches = model.matches(src.read(), out.write, self.keep_bodies)
+            with src:
+                for ndx, m in enumerate(matches):
+                    snippet_arg = self.parse_arg(m.raw_arg)
+                    if isinstance(snippet_arg, JSONDecodeError):
+                        arg_errors.append(
+                            SnippetJsonValueError(
+                                fpath, m.name, m.raw_arg, snippet_arg, m.line_start
                             )
-                        elif snip_line_parts[0] != f"/{snippet_name}":
-                            raise Exception(f"invalid snippet end tag {line!r}")
-                        self.on_snippet(
-                            snippet_prefix, snippet_name, snippet_arg, fpath, dst
-                        )
-                        dst.write(line)  # retain the snippet end line
-                        inside_snippet = False
-                        break
-
-                    if inside_snippet:
-                        # we exhausted the file line iterator without finding a corresponding
-                        # snippet end, so we abort, this is an error
-                        raise UnclosedSnippetError(
-                            fpath,
-                            snippet_name,
-                            snippet_line_start,
-                            lineno,
                         )
+                    else:
+                        problems = self.validate_arg(m.name, snippet_arg, m.raw_arg)
+                        if problems:
+                            arg_errors.append(
+                                SnippetArgSchemaError(
+                                    fpath, m.name, m.raw_arg, problems, m.line_start
+                                )
+                            )
+                    if not arg_errors:
+                        # no point in running snippets once the file has
+                        # errors, keep scanning to report all of them.
+                        self.match, self.match_index = m, ndx
+                        if recorder is not None:
+                            recorder.begin_snippet()
+                        if tracker is not None:
+                            tracker.begin_snippet()
+                        self.on_snippet(m.prefix, m.name, snippet_arg, fpath, out)
+                        if recorder is not None:
+                            recorder.end_snippet(m)
+                    if tracker is not None and not arg_errors:
+                        tracker.end_snippet(m)
+                    else:
+                        out.write(m.end_line)  # retain the snippet end line
 
+            if len(arg_errors) == 1:
+                raise arg_errors[0]
+            elif arg_errors:
+                raise SnippetArgErrors(fpath, arg_errors)
             dst.close()
-            os_replace(dst.name, str(fpath.absolute()))
+            # stat before replacing, transactional runs only stage the file
+            st = os.stat(dst.name)
+            replace_file(dst.name, fpath.absolute())
             dst = None
+            if tracker is not None:
+                store.update(fpath, tracker, st)
+            if recorder is not None:
+                index.record(fpath, st, recorder)
         finally:
             if dst:
+                dst.discard()
                 Path(dst.name).unlink()
@@ -0,0 +1,168 @@
+"""
+Commit all files written by a run at once, or none of them.
+
+In a transactional run, files written by snippets and generators are left in
+their temporary files (next to their targets, so renaming them is atomic)
+instead of being renamed over their targets right away. Once every directory
+ran successfully, the temporary files are renamed over their targets in one
+batch. If the run fails, the temporary files are removed and no file of the
+project is touched.
+
+Should renaming fail part way (e.g. a target directory was removed), the files
+already renamed are restored from backups taken just before renaming.
+"""
+import os
+import shutil
+from typing import Dict, List, Optional, Set, Tuple
+
+from gcgen.durability import Durability, StrPath
+from gcgen.excbase import GcgenError
+from gcgen.log import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class TransactionCommitError(GcgenError):
+    def __init__(self, dst: str, restored: int):
+        self.dst = dst
+        self.restored = restored
+        super().__init__(f"failed to commit {dst}, run rolled back")
+
+    def printerr(self) -> None:
+        print("Failed to commit generated files")
+        print("")
+        print("The run succeeded, but a generated file could not be moved into")
+        print("place. Files already moved into place were restored, no file")
+        print("of the project was changed.")
+        print("Inspect the traceback listed above for details.")
+        print("")
+        print("Details:")
+        print(f"  File: {self.dst}")
+        print(f"  Files restored: {self.restored}")
+
+
+def _backup(dst: str) -> Optional[str]:
+    """Keep a copy of `dst` (if it exists) to restore on rollback."""
+    if not os.path.exists(dst):
+        return None
+    backup = dst + ".gcgen.bak"
+    if os.path.lexists(backup):
+        os.unlink(backup)
+    try:
+        # cheap, the contents stay in place
+        os.link(dst, backup)
+    except OSError:
+        shutil.copy2(dst, backup)
+    return backup
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class Transaction(Durability):
+    """Stages replacements of files until `commit`.
+
+    Args:
+        durability: (optional) how to sync files on commit, files are not
+            synced by default.
+    """
+
+    def __init__(self, durability: Optional[Durability] = None):
+        self.durability = durability or Durability()
+        super().__init__(self.durability.mode)
+        # target => temporary file with its new contents
+        self._staged: Dict[str, str] = {}
+        # targets whose staged contents were read since they were staged
+        self._read: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._staged)
+
+    def targets(self) -> List[str]:
+        """(Absolute) paths of the files staged to be replaced."""
+        return list(self._staged)
+
+    def replace_file(self, tmp: StrPath, dst: StrPath) -> None:
+        """Stage replacing `dst` by `tmp`."""
+        dst, tmp = os.path.abspath(dst), os.path.abspath(tmp)
+        prev = self._staged.get(dst)
+        if prev is not None and prev != tmp:
+            if dst not in self._read:
+                # not derived from the staged contents, which are lost
+                logger.warning(
+                    "%s written more than once in the run, keeping the last write",
+                    dst,
+                    extra={"event": "rewritten", "file": dst},
+                )
+            _unlink(prev)
+        self._read.discard(dst)
+        self._staged[dst] = tmp
+
+    def current(self, path: StrPath) -> str:
+        """Staged temporary file of `path` if written in this run, else `path`.
+
+        Files (e.g. written by generators) parsed later in the run are read
+        from their staged contents.
+        """
+        dst = os.path.abspath(path)
+        tmp = self._staged.get(dst)
+        if tmp is None:
+            return str(path)
+        self._read.add(dst)
+        return tmp
+
+    def sync(self) -> None:
+        # nothing is in place before `commit`
+        pass
+
+    def commit(self) -> None:
+        """Rename all staged files over their targets, rolling back on failure."""
+        staged, self._staged = self._staged, {}
+        self._read = set()
+        logger.debug("committing %d files", len(staged))
+        done: List[Tuple[str, Optional[str]]] = []
+        dst = ""
+        try:
+            for dst, tmp in staged.items():
+                backup = _backup(dst)
+                try:
+                    self.durability.replace_file(tmp, dst)
+                except BaseException:
+                    if backup is not None:
+                        _unlink(backup)
+                    raise
+                done.append((dst, backup))
+        except Exception as e:
+            restored = self._rollback(done, staged)
+            raise TransactionCommitError(dst, restored) from e
+        for _, backup in done:
+            if backup is not None:
+                _unlink(backup)
+        self.durability.sync()
+
+    def _rollback(
+        self, done: List[Tuple[str, Optional[str]]], staged: Dict[str, str]
+    ) -> int:
+        for dst, backup in reversed(done):
+            if backup is not None:
+                os.replace(backup, dst)
+            else:
+                _unlink(dst)
+        committed = {dst for dst, _ in done}
+        for dst, tmp in staged.items():
+            if dst not in committed:
+                _unlink(tmp)
+        return len(done)
+
+    def abort(self) -> None:
+        """Discard all staged files."""
+        staged, self._staged = self._staged, {}
+        self._read = set()
+        logger.debug("discarding %d staged files", len(staged))
+        for tmp in staged.values():
+            _unlink(tmp)
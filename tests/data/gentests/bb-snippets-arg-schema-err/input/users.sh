@@ -0,0 +1,8 @@
+# <<? mk_user {"username": "jane"} ?>>
+# <<? /mk_user ?>>
+# <<? mk_user {"groups": ["wheel"]} ?>>
+# <<? /mk_user ?>>
+# <<? mk_user {"username": "joe", "groups": ["wheel"; "docker"]} ?>>
+# <<? /mk_user ?>>
+# <<? mk_user {"username": 1} ?>>
+# <<? /mk_user ?>>
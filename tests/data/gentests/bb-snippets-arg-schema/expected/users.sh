@@ -0,0 +1,6 @@
+# <<? mk_user {"username": "jane", "groups": ["wheel"]} ?>>
+useradd -G wheel jane
+# <<? /mk_user ?>>
+# <<? mk_user {"username": "jane", "groups": ["wheel"]} ?>>
+useradd -G wheel jane
+# <<? /mk_user ?>>
@@ -0,0 +1,22 @@
+from typing import List
+from gcgen.api import Section, Scope, Json, snippet
+
+
+USER = {
+    "type": "object",
+    "properties": {
+        "username": {"type": "string"},
+        "groups": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["username"],
+    "additionalProperties": False,
+}
+
+
+@snippet("mk_user", schema=USER)
+def _mk_user(s: Section, _: Scope, val: Json):
+    s.emitln(f"useradd -G {','.join(val.get('groups', []))} {val['username']}")
+
+
+def gcgen_parse_files() -> List[str]:
+    return ["users.sh"]
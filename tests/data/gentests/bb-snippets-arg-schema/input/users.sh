@@ -0,0 +1,4 @@
+# <<? mk_user {"username": "jane", "groups": ["wheel"]} ?>>
+# <<? /mk_user ?>>
+# <<? mk_user {"username": "jane", "groups": ["wheel"]} ?>>
+# <<? /mk_user ?>>
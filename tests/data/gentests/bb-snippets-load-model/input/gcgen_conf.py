@@ -0,0 +1,31 @@
+import json
+from pathlib import Path
+from typing import List
+from gcgen.api import snippet, load_model, Section, Scope, Json
+
+LOADS = []
+
+
+def load_json(path: Path):
+    LOADS.append(path)
+    return json.loads(path.read_text())
+
+
+SCHEMA = Path(__file__).parent / "schema.json"
+
+
+def gcgen_scope_extend(scope: Scope):
+    scope["schema"] = load_model(SCHEMA, load_json)
+
+
+@snippet("fields")
+def _fields(s: Section, scope: Scope, _: Json):
+    schema = scope["$models"].load(SCHEMA, load_json)
+    assert schema is scope["schema"]
+    for field in schema["fields"]:
+        s.emitln(f"{field};")
+    s.emitln(f"// loads: {len(LOADS)}")
+
+
+def gcgen_parse_files() -> List[str]:
+    return ["model.txt"]
@@ -0,0 +1,16 @@
+import asyncio
+from gcgen.api import generator, Scope
+from gcgen.api.write_file import write_file
+
+
+@generator
+async def generate_b(scope: Scope):
+    started = scope["started"]
+    started.add("b")
+    # only completes with "a" started if generators of both directories overlap
+    for _ in range(200):
+        if "a" in started:
+            break
+        await asyncio.sleep(0.01)
+    async with write_file("out.txt") as e:
+        e.emitln(f"b: saw a {'a' in started}")
@@ -0,0 +1,15 @@
+from pathlib import Path
+from gcgen.api import generator, Scope
+from gcgen.api.write_file import write_file
+
+
+def gcgen_scope_extend(scope: Scope):
+    scope["started"] = set()
+
+
+@generator
+async def generate_summary(_: Scope):
+    # generators of sub-directories completed before this one started
+    async with write_file("summary.txt") as e:
+        for d in ("a", "b"):
+            e.emitln(Path(d, "out.txt").read_text().strip())
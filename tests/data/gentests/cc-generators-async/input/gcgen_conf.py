@@ -0,0 +1,35 @@
+import asyncio
+from typing import List
+from gcgen.api import generator, snippet, Section, Scope, Json
+from gcgen.api.write_file import write_file
+
+
+async def read_name(name: str) -> str:
+    await asyncio.sleep(0.01)
+    return name
+
+
+@snippet("greet")
+async def _greet(s: Section, _: Scope, val: Json):
+    name = await read_name(val)
+    s.emitln(f"Hello, {name}!")
+
+
+@generator
+async def generate_foo(_: Scope):
+    name = await read_name("Foo")
+    async with write_file("foo.txt") as e:
+        e.emitln("Hello, World")
+        e.emitln(f"Regards, {name}")
+
+
+@generator
+async def generate_bar(_: Scope):
+    name = await read_name("Bar")
+    async with write_file("bar.txt") as e:
+        e.emitln("Hello, World")
+        e.emitln(f"Regards, {name}")
+
+
+def gcgen_parse_files() -> List[str]:
+    return ["greetings.txt"]
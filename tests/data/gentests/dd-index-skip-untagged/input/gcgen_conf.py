@@ -0,0 +1,11 @@
+from typing import List
+from gcgen.api import Section, Scope, Json, snippet
+
+
+@snippet("hello")
+def _hello(s: Section, _: Scope, __: Json):
+    s.emitln("hello!")
+
+
+def gcgen_parse_files() -> List[str]:
+    return ["tagged.txt", "untagged.txt"]
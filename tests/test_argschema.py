@@ -0,0 +1,66 @@
+import pytest
+from gcgen.argschema import compile_schema
+
+
+def test_empty_schema_accepts_anything():
+    v = compile_schema({})
+    assert v(None, "$") == []
+    assert v({"a": [1, 2]}, "$") == []
+
+
+@pytest.mark.parametrize(
+    "typ, ok, bad",
+    [
+        ("null", None, 0),
+        ("boolean", True, 1),
+        ("integer", 1, True),
+        ("number", 1.5, "1.5"),
+        ("string", "s", 1),
+        ("array", [1], {}),
+        ("object", {}, []),
+        (["string", "null"], None, 1),
+    ],
+)
+def test_type(typ, ok, bad):
+    v = compile_schema({"type": typ})
+    assert v(ok, "$") == []
+    assert len(v(bad, "$")) == 1
+
+
+def test_bounds_and_enum():
+    v = compile_schema({"type": "integer", "minimum": 1, "maximum": 3})
+    assert v(2, "$") == []
+    assert v(0, "$") == ["$: must be >= 1"]
+    assert v(4, "$") == ["$: must be <= 3"]
+    v = compile_schema({"enum": ["a", "b"]})
+    assert v("a", "$") == []
+    assert v("c", "$") == ["$: must be one of ['a', 'b']"]
+
+
+def test_object_reports_all_problems():
+    v = compile_schema(
+        {
+            "type": "object",
+            "properties": {
+                "username": {"type": "string", "minLength": 1},
+                "groups": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": ["username"],
+            "additionalProperties": False,
+        }
+    )
+    assert v({"username": "jane", "groups": ["wheel"]}, "$") == []
+    assert v({"groups": ["wheel", 1], "shell": "zsh"}, "$") == [
+        "$: missing key 'username'",
+        "$.groups[1]: expected string, got int",
+        "$: unexpected key 'shell'",
+    ]
+
+
+def test_invalid_schema():
+    with pytest.raises(ValueError):
+        compile_schema({"type": "list"})
+    with pytest.raises(ValueError):
+        compile_schema({"pattern": "^a"})
+    with pytest.raises(ValueError):
+        compile_schema([])
@@ -0,0 +1,45 @@
+import asyncio
+import pytest
+from gcgen.asyncrunner import AsyncRunner
+
+
+def test_gather_limits_concurrency():
+    runner = AsyncRunner(max_concurrency=2)
+    running = 0
+    peak = 0
+
+    async def task(n: int) -> int:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return n
+
+    try:
+        assert runner.gather([task(n) for n in range(6)]) == list(range(6))
+    finally:
+        runner.close()
+    assert peak == 2
+
+
+def test_gather_returns_exceptions_in_order():
+    runner = AsyncRunner()
+
+    async def ok():
+        return "ok"
+
+    async def fail():
+        raise RuntimeError("fail")
+
+    try:
+        results = runner.gather([ok(), fail(), ok()])
+    finally:
+        runner.close()
+    assert results[0] == results[2] == "ok"
+    assert isinstance(results[1], RuntimeError)
+
+
+def test_invalid_max_concurrency():
+    with pytest.raises(ValueError):
+        AsyncRunner(max_concurrency=0)
@@ -0,0 +1,120 @@
+import pickle
+from io import StringIO
+
+import pytest
+
+from gcgen.emitter import (
+    Emitter,
+    Section,
+    SectionDecodeError,
+    StreamingSection,
+    Template,
+    decode_section,
+    encode_section,
+)
+from gcgen.emitter.codec import FLAG_SIMPLE, iter_encoded
+
+
+def _build(lazy: bool = True) -> Section:
+    s = Section()
+    s.emitln("int main() {").indent()
+    decls = Section()
+    s.add_section(decls)
+    s.emit("return ", "0").emitln(";")
+    s.emit("")
+    s.dedent().emitln("}")
+    s.ensure_padding_lines(1)
+    if lazy:
+        s.emitln_many(f"// {i}" for i in range(3))
+        s.extend_from(Section().emitln(f"f{i}();") for i in range(2))
+    else:
+        s.emit_lines([f"// {i}" for i in range(3)])
+        for i in range(2):
+            s.add_section(Section().emitln(f"f{i}();"))
+    decls.emitln("int x = 0;").emitln("int y = 0;")
+    decls.add_section(Section().emit("ünïcode \udc80"))
+    return s
+
+
+def _emit(e: Emitter, s: Section) -> str:
+    buf = StringIO()
+    e.emit(s, buf)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize(
+    "e",
+    [
+        Emitter(prefix=""),
+        Emitter(prefix="# ", indent_by="\t", newline="\r\n", trim_trailing_ws=True),
+    ],
+)
+def test_roundtrip(e):
+    expected = _emit(e, _build())
+    data = encode_section(_build())
+    s = decode_section(data)
+    assert _emit(e, s) == expected
+
+    buf = StringIO()
+    e.emit_encoded(data, buf)
+    assert buf.getvalue() == expected
+
+    # lazy contents are consumed, and counted, once encoded
+    orig = _build(lazy=False)
+    assert _emit(e, orig) == expected
+    assert (s.lines, s.chars, s.sections) == (orig.lines, orig.chars, orig.sections)
+    # decoded sections can be built upon
+    s.emitln("// end")
+
+
+def test_simple_sections():
+    s = Section().emit("a").emitln("b").emitln("a").freshline()
+    data = encode_section(s)
+    assert data[5] & FLAG_SIMPLE
+    # strings are stored once
+    assert data.count(b"a") == 1
+    decoded = decode_section(data)
+    assert decoded.simple
+    assert list(decoded.iterator()) == list(s.iterator())
+
+    e = Emitter(prefix="> ")
+    buf = StringIO()
+    e.emit_encoded(data, buf)
+    assert buf.getvalue() == _emit(e, s)
+
+    assert not encode_section(Section().emit(""))[5] & FLAG_SIMPLE
+
+
+def test_holes():
+    s = Section().emit("x = ").hole("val").emitln(";")
+    t = Template(decode_section(encode_section(s)))
+    assert t.names == {"val"}
+    # holes are skipped, as when emitting the section
+    expected = Section().emit("x = ").emitln(";")
+    assert list(iter_encoded(encode_section(s))) == list(expected.iterator())
+
+
+class _Sub(Section):
+    __slots__ = ()
+
+
+def test_pickle():
+    s = pickle.loads(pickle.dumps(_build(lazy=False)))
+    assert _emit(Emitter(prefix=""), s) == _emit(Emitter(prefix=""), _build())
+    assert type(pickle.loads(pickle.dumps(_Sub()))) is _Sub
+    # pickling is not encoding, lazy contents are refused but not consumed
+    s = _build()
+    with pytest.raises(TypeError):
+        pickle.dumps(s)
+    assert _emit(Emitter(prefix=""), s) == _emit(Emitter(prefix=""), _build())
+    with pytest.raises(TypeError):
+        pickle.dumps(StreamingSection(Emitter(prefix=""), StringIO()))
+
+
+@pytest.mark.parametrize("cut", [0, 3, 10, -1])
+def test_invalid_data(cut):
+    data = encode_section(_build())
+    with pytest.raises(SectionDecodeError):
+        decode_section(data[:cut])
+    with pytest.raises(SectionDecodeError):
+        decode_section(data[:4] + bytes([99]) + data[5:])
@@ -0,0 +1,154 @@
+import threading
+from pathlib import Path
+
+import pytest
+
+from gcgen import daemon
+from test_gentests import load_gentest
+
+
+@pytest.fixture
+def served_project():
+    with load_gentest("bb-snippets-nested") as gtc:
+        root = gtc.input_path.resolve()
+        project = daemon.Project(root)
+        project.load()
+        sock_path = daemon.socket_path(root)
+        server = daemon.make_server(project, sock_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            yield gtc, project, sock_path
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+
+
+def _regen(sock_path: Path, *paths: Path):
+    req = {"op": "regen", "paths": [str(p) for p in paths]}
+    return list(daemon.request(sock_path, req))
+
+
+def test_regen_paths(served_project):
+    gtc, project, sock_path = served_project
+    root = project.root
+    inner = root / "inner" / "innerfile.txt"
+    outer = root / "outerfile.txt"
+
+    # only the directory of the requested file is run
+    msgs = _regen(sock_path, outer)
+    assert msgs[-1]["event"] == "done"
+    assert msgs[-1]["dirs"] == [str(root)]
+    assert outer.read_text() == (gtc.expected_path / "outerfile.txt").read_text()
+    assert (
+        inner.read_text() != (gtc.expected_path / "inner" / "innerfile.txt").read_text()
+    )
+
+    msgs = _regen(sock_path)
+    assert msgs[-1]["event"] == "done"
+    assert not msgs[-1]["reloaded"]
+    assert (
+        inner.read_text() == (gtc.expected_path / "inner" / "innerfile.txt").read_text()
+    )
+
+
+def test_regen_nearest_conf_dir(served_project, tmp_path):
+    _, project, sock_path = served_project
+    root = project.root
+    generated = root / "gen" / "out.txt"
+    generated.parent.mkdir()
+    generated.write_text("")
+
+    # no `gcgen_conf.py` in `gen`, the project root's regenerates it
+    msgs = _regen(sock_path, generated)
+    assert msgs[-1]["event"] == "done"
+    assert msgs[-1]["dirs"] == [str(root)]
+
+    msgs = _regen(sock_path, tmp_path / "elsewhere.txt")
+    assert msgs[-1]["event"] == "error"
+    assert "elsewhere.txt" in msgs[-1]["message"]
+
+
+def test_regen_forwards_output(served_project):
+    _, project, sock_path = served_project
+    project.after_run = lambda: print("report")
+    msgs = _regen(sock_path)
+    assert msgs[-1]["event"] == "done"
+    assert msgs[-1]["output"] == "report\n"
+
+
+def test_reload_on_conf_change(served_project):
+    gtc, project, sock_path = served_project
+    conf = project.root / "gcgen_conf.py"
+    conf.write_text(conf.read_text() + "\nraise RuntimeError('broken')\n")
+    msgs = _regen(sock_path)
+    assert msgs[-1]["event"] == "error"
+    assert "broken" in msgs[-1]["details"]
+
+    conf.write_text(conf.read_text().replace("raise RuntimeError('broken')", ""))
+    msgs = _regen(sock_path)
+    assert msgs[-1]["event"] == "done"
+    assert msgs[-1]["reloaded"]
+
+
+SCOPE_CONF = """\
+from typing import List
+from gcgen.api import snippet, Section, Scope, Json
+
+CALLS = []
+
+
+def gcgen_scope_extend(scope: Scope) -> None:
+    CALLS.append(None)
+    scope["n"] = len(CALLS)
+
+
+@snippet("n")
+def _n(s: Section, scope: Scope, arg: Json):
+    s.emitln(str(scope["n"]))
+
+
+def gcgen_parse_files() -> List[str]:
+    return ["out.txt"]
+"""
+
+
+def test_scopes_derived_per_run(tmp_path):
+    root = (tmp_path / "proj").resolve()
+    root.mkdir()
+    (root / "gcgen_project.ini").write_text("")
+    (root / "gcgen_conf.py").write_text(SCOPE_CONF)
+    out = root / "out.txt"
+    out.write_text("<<? n ?>>\n<<? /n ?>>\n")
+    project = daemon.Project(root)
+    project.load()
+    module = project.conf_dirs[0].module
+
+    assert project.regen([])["reloaded"] is False
+    assert out.read_text() == "<<? n ?>>\n1\n<<? /n ?>>\n"
+    scope = project.conf_dirs[0].scope
+
+    # the module is kept, its scope is built anew
+    assert project.regen([])["reloaded"] is False
+    assert out.read_text() == "<<? n ?>>\n2\n<<? /n ?>>\n"
+    assert project.conf_dirs[0].module is module
+    assert project.conf_dirs[0].scope is not scope
+
+
+def test_socket_private(served_project):
+    _, _, sock_path = served_project
+    # accessible to its owner only
+    assert sock_path.stat().st_mode & 0o077 == 0
+
+
+def test_not_running(tmp_path):
+    with pytest.raises(daemon.DaemonNotRunningError):
+        daemon.regen(tmp_path / "daemon.sock", [])
+
+
+def test_already_running(served_project):
+    _, project, sock_path = served_project
+    assert list(daemon.request(sock_path, {"op": "ping"})) == [{"event": "done"}]
+    with pytest.raises(daemon.DaemonRunningError):
+        daemon.make_server(project, sock_path)
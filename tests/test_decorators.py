@@ -1,5 +1,12 @@
 import pytest
-from gcgen.decorators import snippet, has_snippet, is_snippet, is_generator, generator
+from gcgen.decorators import (
+    snippet,
+    has_snippet,
+    is_snippet,
+    is_generator,
+    generator,
+    snippet_validator,
+)
 
 
 def test_has_snippet_on_snippetfn():
@@ -43,3 +50,19 @@ def test_is_generator():
 
     assert is_generator(foo)
     assert not is_generator(bar)
+
+
+def test_snippet_schema():
+    @snippet("one", schema={"type": "string"})
+    def foo():
+        pass
+
+    validator = snippet_validator(foo)
+    assert validator("a", "$") == []
+    assert validator(1, "$") != []
+    assert snippet_validator(lambda: None) is None
+
+
+def test_snippet_schema_invalid():
+    with pytest.raises(ValueError):
+        snippet("one", schema={"type": "nope"})
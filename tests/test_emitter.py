@@ -1,4 +1,12 @@
-from gcgen.emitter import Section, Emitter, SectionDedentError
+from gcgen.emitter import (
+    Section,
+    Emitter,
+    SectionDedentError,
+    SectionConsumedError,
+    StreamingSection,
+    Template,
+)
+from gcgen.emitter.emitter import EmitState
 from gcgen.emitter.special_chars import Padding
 from pathlib import Path
 from contextlib import contextmanager
@@ -186,3 +194,275 @@ def test_padding_between_elems(n):
     io = StringIO()
     e.emit(s, io)
     assert io.getvalue() == expected
+
+
+def _build_mixed(s: Section):
+    s.ensure_padding_lines(2)
+    for i in range(20):
+        s.emit("line ", str(i))
+        s.emitln(";")
+        if i % 5 == 0:
+            s.indent()
+            s.emit("indented")
+            s.dedent()
+            s.ensure_padding_lines(1)
+    sub = Section()
+    s.add_section(sub)
+    s.emitln("after sub")
+    sub.emitln("sub one")
+    s.emit("no trailing newline")
+    s.ensure_padding_lines(3)
+
+
+def test_streaming_section_same_output():
+    e = Emitter(prefix="# ", indent_by="  ")
+    s = Section()
+    _build_mixed(s)
+    expected = StringIO()
+    e.emit(s, expected)
+
+    actual = StringIO()
+    ss = StreamingSection(e, actual, flush_at=4)
+    _build_mixed(ss)
+    ss.close()
+    assert actual.getvalue() == expected.getvalue()
+
+
+def test_streaming_section_writes_before_close():
+    out = StringIO()
+    s = StreamingSection(Emitter(prefix=""), out, flush_at=8)
+    for i in range(100):
+        s.emitln(f"line {i}")
+        assert len(s._buf) < 8
+    assert out.getvalue().startswith("line 0\nline 1\n")
+
+    # contents after a sub-section are held back until close
+    sub = Section()
+    s.add_section(sub)
+    written = out.getvalue()
+    s.emitln("after")
+    sub.emitln("inside")
+    assert out.getvalue() == written
+    s.close()
+    assert out.getvalue().endswith("line 99\ninside\nafter\n")
+
+
+def _emit_general(e: Emitter, s: Section) -> str:
+    buf = StringIO()
+    state = EmitState()
+    e.feed(state, s.iterator(), buf)
+    e.finish(state, buf)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("prefix", ["", "# "])
+@pytest.mark.parametrize(
+    "ops",
+    [
+        [],
+        ["fl"],
+        ["nl"],
+        ["fl", "a", "fl"],
+        ["a", "b", "nl", "c"],
+        ["nl", "nl", "a", "fl", "fl", "nl", "b"],
+        ["a", "nl", "fl", "b", "fl"],
+    ],
+)
+def test_simple_section_fast_path(prefix, ops):
+    s = Section()
+    for op in ops:
+        if op == "nl":
+            s.newline()
+        elif op == "fl":
+            s.freshline()
+        else:
+            s.emit(op)
+    assert s.simple
+    e = Emitter(prefix=prefix)
+    buf = StringIO()
+    e.emit(s, buf)
+    assert buf.getvalue() == _emit_general(e, s)
+
+
+def test_simple_section_tracking():
+    assert Section().emitln("a").freshline().simple
+    assert not Section().emit("").simple
+    assert not Section().indent().simple
+    assert not Section().ensure_padding_lines(1).simple
+    assert not Section().add_section(Section()).simple
+
+
+@pytest.mark.parametrize("prefix", ["", "# "])
+def test_newline_and_trim_policy(prefix):
+    e = Emitter(prefix=prefix, newline="\r\n", trim_trailing_ws=True)
+    s = Section().emitln("one  ").emit(" ").newline().emitln("two\t")
+    assert s.simple
+    buf = StringIO()
+    e.emit(s, buf)
+    p = prefix.rstrip()
+    assert buf.getvalue() == f"{prefix}one\r\n{p}\r\n{prefix}two\r\n"
+    assert buf.getvalue() == _emit_general(e, s)
+
+    s = Section().emitln("one ").indent().emitln("two ").dedent().emit("three ")
+    expected = f"{prefix}one\r\n{prefix} two\r\n{prefix}three"
+    assert _emit_general(e, s) == expected
+
+
+def test_indentation_cached():
+    e = Emitter(prefix="// ", indent_by="  ")
+    assert e.indentation(3) == "//       "
+    assert e.indentation(3) is e.indentation(3)
+    assert e.indentation(0) == "// "
+
+
+def test_emit_raw_emit_lines_same_output():
+    e = Emitter(prefix="# ", indent_by="  ")
+    expected = Section().emit("a", "b").emitln("c").emitln("d").emitln("e")
+    s = Section().emit_raw("a", "b").emit_lines(["c"]).emit_lines(x for x in "de")
+    assert s.simple
+    assert _emit_general(e, s) == _emit_general(e, expected)
+
+    assert not Section().emit_lines(["a", ""]).simple
+    assert not Section().emit_raw("").simple
+
+
+def test_emit_raw_validates_in_debug_mode(monkeypatch):
+    # unchecked by default
+    Section().emit_raw("a\nb")
+    monkeypatch.setattr(Section, "debug", True)
+    with pytest.raises(ValueError):
+        Section().emit_raw("a\nb")
+    with pytest.raises(TypeError):
+        Section().emit_lines(["a", 1])  # type: ignore
+
+
+def test_streaming_section_emit_lines():
+    out = StringIO()
+    s = StreamingSection(Emitter(prefix=""), out, flush_at=8)
+    s.emit_lines(f"line {i}" for i in range(10))
+    assert out.getvalue().startswith("line 0\n")
+    s.close()
+    assert out.getvalue().endswith("line 9\n")
+
+
+def test_emitln_many_extend_from_same_output():
+    e = Emitter(prefix="# ", indent_by="  ")
+    fields = ["a", "b", "c"]
+
+    def field_section(name):
+        return Section().emitln(f"{name}:").indent().emitln("int")
+
+    expected = Section().emit("head").indent()
+    for f in fields:
+        expected.emitln(f)
+    for f in fields:
+        expected.add_section(field_section(f))
+    expected.dedent().emitln("tail")
+
+    s = Section().emit("head").indent()
+    s.emitln_many(f for f in fields)
+    s.extend_from(field_section(f) for f in fields)
+    s.dedent().emitln("tail")
+    assert not s.simple
+    assert _emit_general(e, s) == _emit_general(e, expected)
+
+
+def test_emitln_many_lazy():
+    consumed = []
+
+    def lines():
+        for i in range(3):
+            consumed.append(i)
+            yield f"line {i}"
+
+    s = Section().emitln_many(lines())
+    assert str(s) == "<LAZYLINES>"
+    assert consumed == []
+    buf = StringIO()
+    Emitter(prefix="").emit(s, buf)
+    assert buf.getvalue() == "line 0\nline 1\nline 2\n"
+    with pytest.raises(SectionConsumedError):
+        Emitter(prefix="").emit(s, StringIO())
+
+
+def _getter() -> Section:
+    s = Section()
+    s.emit("def get_").hole("name").emitln("(self):").indent()
+    s.emit("return self._").hole("name").newline().dedent()
+    return s
+
+
+def test_template_render():
+    e = Emitter(prefix="", indent_by="    ")
+    t = Template(_getter())
+    assert t.names == {"name"}
+    out = Section()
+    for name in ["a", "b"]:
+        out.add_section(t.render(name=name))
+        out.ensure_padding_lines(1)
+    assert _emit_general(e, out) == (
+        "def get_a(self):\n    return self._a\n\ndef get_b(self):\n    return self._b\n"
+    )
+
+
+def test_template_render_section_value_and_simple():
+    t = Template(Section().emit("x = ").hole("val").emitln(";"))
+    s = t.render(val="1")
+    assert s.simple
+    buf = StringIO()
+    Emitter(prefix="# ").emit(s, buf)
+    assert buf.getvalue() == "# x = 1;\n"
+
+    s = t.render(val=Section().emit("f(").emit("2").emit(")"))
+    assert not s.simple
+    assert _emit_general(Emitter(prefix=""), s) == "x = f(2);\n"
+
+    with pytest.raises(KeyError):
+        t.render()
+
+
+def test_template_unaffected_by_later_changes():
+    src = Section().emitln("one")
+    t = Template(src)
+    src.emitln("two")
+    assert _emit_general(Emitter(prefix=""), t.render()) == "one\n"
+
+
+def test_section_size_counts():
+    s = Section()
+    s.emit("int x;").emitln(" // x")
+    s.indent()
+    s.emit_lines(["a", "bc"])
+    sub = Section()
+    inner = Section().emit("deep")
+    sub.emitln("nested").add_section(inner)
+    s.add_section(sub)
+    s.freshline()
+    assert (s.lines, s.chars, s.sections) == (5, 24, 2)
+    # sub-sections are counted as they grow
+    sub.emitln("more")
+    assert (s.lines, s.chars) == (6, 28)
+    # as do sections nested further
+    deep = Section()
+    inner.add_section(deep)
+    deep.emit_raw("abc").newline()
+    assert (s.lines, s.chars, s.sections) == (8, 31, 3)
+    assert (sub.lines, sub.chars, sub.sections) == (4, 17, 2)
+    # the trailing freshline is counted, though the output already ends a line
+    assert _emit_general(Emitter(prefix=""), s).count("\n") == s.lines - 1
+
+
+def test_template_render_size_counts():
+    t = Template(_getter())
+    s = t.render(name="field")
+    assert (s.lines, s.chars) == (2, len("def get_field(self):return self._field"))
+    s = t.render(name=Section().emit("x"))
+    assert (s.lines, s.sections) == (2, 2)
+
+
+def test_streaming_section_size_counts():
+    s = StreamingSection(Emitter(prefix=""), StringIO(), flush_at=8)
+    for i in range(10):
+        s.emitln(f"line {i}")
+    # flushed contents are still counted
+    assert (s.lines, s.chars) == (10, 60)
@@ -10,6 +10,8 @@ from gcgen.snippetparser import (
     UnclosedSnippetError,
     NestedSnippetsError,
     SnippetJsonValueError,
+    SnippetArgSchemaError,
+    SnippetArgErrors,
 )
 import pytest
 import logging
@@ -184,3 +186,38 @@ def test_bb_snippets_always_end_last_line():
 def test_cc_generators_write_test():
     "write two files using a generator"
     gentest_test_eql("cc-generators-write-test", ["foo.txt", "bar.txt"])
+
+
+def test_cc_generators_async():
+    "async generators and snippets are run on the event loop"
+    gentest_test_eql("cc-generators-async", ["foo.txt", "bar.txt", "greetings.txt"])
+
+
+def test_cc_generators_async_dirs():
+    """async generators of sibling directories run concurrently, before their parent's"""
+    gentest_test_eql("cc-generators-async-dirs", ["summary.txt"])
+
+
+def test_bb_snippets_load_model():
+    "models loaded via `load_model` are shared through the scope"
+    gentest_test_eql("bb-snippets-load-model", ["model.txt"])
+
+
+def test_bb_snippets_arg_schema():
+    gentest_test_eql("bb-snippets-arg-schema", ["users.sh"])
+
+
+def test_bb_snippets_arg_schema_err():
+    """all invalid arguments of a file are reported at once, the file is untouched."""
+    with load_gentest("bb-snippets-arg-schema-err") as gtc:
+        before = (gtc.input_path / "users.sh").read_text()
+        with pytest.raises(SnippetArgErrors) as exc_info:
+            generate.compile(gtc.input_path)
+        errors = exc_info.value.errors
+        assert [type(e) for e in errors] == [
+            SnippetArgSchemaError,
+            SnippetJsonValueError,
+            SnippetArgSchemaError,
+        ]
+        assert [e.line_start for e in errors] == [3, 5, 7]
+        assert (gtc.input_path / "users.sh").read_text() == before
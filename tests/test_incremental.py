@@ -0,0 +1,263 @@
+import multiprocessing
+import os
+import sys
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from gcgen import generate
+from gcgen.fingerprint import Fingerprinter, UnhashableError
+from gcgen.incremental import Incremental
+from gcgen.outputcache import OutputCache
+from test_gentests import load_gentest
+
+
+def _compile(root: Path, manifest: Path) -> Incremental:
+    inc = Incremental.load(root, manifest)
+    generate.compile(root, incremental=inc)
+    inc.save(manifest)
+    return inc
+
+
+def test_value_digest():
+    fp = Fingerprinter(Path(__file__).parent)
+    assert fp.value({"a": 1, "b": [1, 2]}) == fp.value({"b": [1, 2], "a": 1})
+    assert fp.value([1, 2]) != fp.value([2, 1])
+    assert fp.value(1) != fp.value("1")
+    lst = [1]
+    before = fp.value(lst)
+    lst.append(2)
+    assert fp.value(lst) != before
+    with pytest.raises(UnhashableError):
+        fp.value(object())
+
+
+def test_function_fingerprint():
+    fp = Fingerprinter(Path(__file__).parent)
+
+    def make(n: int):
+        def f(x):
+            return x + n
+
+        return f
+
+    def g(x):
+        return x + 2
+
+    assert fp.function(make(1)) == fp.function(make(1))
+    assert fp.function(make(1)) != fp.function(make(2))
+    assert fp.function(make(1)) != fp.function(g)
+
+
+def test_incremental_skips_unchanged_calls(tmp_path):
+    with load_gentest("bb-snippets-mod-file-scope") as gtc:
+        root = gtc.input_path.resolve()
+        manifest = tmp_path / "manifest.json"
+        expected = (gtc.expected_path / "greetings.txt").read_text()
+
+        inc = _compile(root, manifest)
+        assert (inc.ran, inc.skipped) == (3, 0)
+        assert (root / "greetings.txt").read_text() == expected
+
+        # snippets modifying the scope are always run, the greetings are not.
+        inc = _compile(root, manifest)
+        assert (inc.ran, inc.skipped) == (1, 2)
+        assert (root / "greetings.txt").read_text() == expected
+
+        # hand-edited bodies are regenerated
+        fpath = root / "greetings.txt"
+        fpath.write_text(fpath.read_text().replace("Jane", "Janet"))
+        inc = _compile(root, manifest)
+        assert (inc.ran, inc.skipped) == (2, 1)
+        assert (root / "greetings.txt").read_text() == expected
+
+
+CONF = """\
+from typing import List
+from gcgen.api import snippet, Section, Scope, Json
+import helpers
+
+
+@snippet("greet")
+def _greet(s: Section, scope: Scope, arg: Json):
+    s.emitln(helpers.greeting(arg))
+
+
+def gcgen_parse_files() -> List[str]:
+    return ["out.txt"]
+"""
+
+
+def _write_helpers(root: Path, greeting: str):
+    (root / "helpers.py").write_text(
+        f"def greeting(name):\n    return f'{greeting}, {{name}}!'\n"
+    )
+    sys.modules.pop("helpers", None)
+
+
+def test_incremental_detects_helper_module_change(tmp_path, monkeypatch):
+    root = (tmp_path / "proj").resolve()
+    root.mkdir()
+    (root / "gcgen_project.ini").write_text("")
+    (root / "gcgen_conf.py").write_text(CONF)
+    (root / "out.txt").write_text('<<? greet "Bob" ?>>\n<<? /greet ?>>\n')
+    _write_helpers(root, "Hello")
+    monkeypatch.syspath_prepend(str(root))
+    manifest = root / ".gcgen" / "manifest.json"
+
+    try:
+        inc = _compile(root, manifest)
+        assert (inc.ran, inc.skipped) == (1, 0)
+        inc = _compile(root, manifest)
+        assert (inc.ran, inc.skipped) == (0, 1)
+
+        _write_helpers(root, "Howdy")
+        inc = _compile(root, manifest)
+        assert (inc.ran, inc.skipped) == (1, 0)
+        assert (root / "out.txt").read_text() == (
+            '<<? greet "Bob" ?>>\nHowdy, Bob!\n<<? /greet ?>>\n'
+        )
+    finally:
+        sys.modules.pop("helpers", None)
+
+
+CALLER_CONF = """\
+from typing import List
+from gcgen.api import snippet, get_snippet, Section, Scope, Json
+
+
+@snippet("outer")
+def _outer(s: Section, scope: Scope, arg: Json):
+    get_snippet(scope, "inner")(s, scope, arg)
+
+
+@snippet("inner")
+def _inner(s: Section, scope: Scope, arg: Json):
+    s.emitln("{greeting}, " + arg + "!")
+
+
+def gcgen_parse_files() -> List[str]:
+    return ["out.txt"]
+"""
+
+
+def test_incremental_detects_called_snippet_change(tmp_path):
+    root = (tmp_path / "proj").resolve()
+    root.mkdir()
+    (root / "gcgen_project.ini").write_text("")
+    (root / "gcgen_conf.py").write_text(CALLER_CONF.format(greeting="Hello"))
+    (root / "out.txt").write_text('<<? outer "Bob" ?>>\n<<? /outer ?>>\n')
+    manifest = root / ".gcgen" / "manifest.json"
+
+    inc = _compile(root, manifest)
+    assert (inc.ran, inc.skipped) == (1, 0)
+    inc = _compile(root, manifest)
+    assert (inc.ran, inc.skipped) == (0, 1)
+
+    # `outer` is unchanged, but calls `inner` through `$snippets`
+    (root / "gcgen_conf.py").write_text(CALLER_CONF.format(greeting="Howdy"))
+    inc = _compile(root, manifest)
+    assert (inc.ran, inc.skipped) == (1, 0)
+    assert (root / "out.txt").read_text() == (
+        '<<? outer "Bob" ?>>\nHowdy, Bob!\n<<? /outer ?>>\n'
+    )
+
+
+def test_incremental_symlink_outside_project(tmp_path):
+    root = tmp_path / "proj"
+    root.mkdir()
+    (tmp_path / "outside.txt").write_text("no snippets\n")
+    (root / "gcgen_project.ini").write_text("")
+    (root / "gcgen_conf.py").write_text(
+        "def gcgen_parse_files():\n    return ['f.txt']\n"
+    )
+    (root / "f.txt").symlink_to(tmp_path / "outside.txt")
+    # parsed, but not tracked
+    inc = _compile(root, root / ".gcgen" / "manifest.json")
+    assert inc.files == {}
+    assert (tmp_path / "outside.txt").read_text() == "no snippets\n"
+
+
+def test_output_cache_restores_fresh_checkout(tmp_path):
+    cache = OutputCache(tmp_path / "cache")
+    with load_gentest("bb-snippets-mod-file-scope") as gtc:
+        generate.compile(gtc.input_path, cache=cache)
+        assert (cache.hits, cache.misses) == (0, 3)
+        expected = (gtc.expected_path / "greetings.txt").read_text()
+        assert (gtc.input_path / "greetings.txt").read_text() == expected
+
+    # only the greetings are stored, `modify-scope` changes the scope
+    assert len([p for p in (tmp_path / "cache").glob("??/*")]) == 2
+
+    with load_gentest("bb-snippets-mod-file-scope") as gtc:
+        cache.hits = cache.misses = 0
+        # strip generated output, as on a checkout lacking generated files
+        fpath = gtc.input_path / "greetings.txt"
+        fpath.write_text(fpath.read_text().replace("Hello, John Doe!\n", ""))
+        generate.compile(gtc.input_path, cache=cache)
+        assert (cache.hits, cache.misses) == (2, 1)
+        assert fpath.read_text() == expected
+
+
+def test_output_cache_hit_builds_nothing(tmp_path, monkeypatch):
+    cache = OutputCache(tmp_path / "cache")
+    with load_gentest("bb-snippets-mod-file-scope") as gtc:
+        generate.compile(gtc.input_path, cache=cache)
+
+    built = []
+
+    class Section(generate.Section):
+        def __init__(self, *args, **kwargs):
+            built.append(self)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(generate, "Section", Section)
+    with load_gentest("bb-snippets-mod-file-scope") as gtc:
+        cache.hits = cache.misses = 0
+        generate.compile(gtc.input_path, cache=cache)
+        assert (cache.hits, cache.misses) == (2, 1)
+        # only for `modify-scope`, which is not cached
+        assert len(built) == 1
+
+
+def test_output_cache_prune(tmp_path):
+    cache = OutputCache(tmp_path, max_size=10)
+    for ndx, key in enumerate(["aa01", "bb02", "cc03"]):
+        cache.put(key, "x" * 4)
+        os.utime(tmp_path / key[:2] / key, ns=(ndx, ndx))
+    assert cache.get("aa01") == "xxxx"  # marks entry as recently used
+    assert cache.prune() == 1
+    assert cache.get("bb02") is None
+    assert cache.get("aa01") == "xxxx"
+    assert cache.get("cc03") == "xxxx"
+
+
+_KEYS = [f"{ndx:02x}{ndx:038x}" for ndx in range(16)]
+
+
+def _hammer_cache(cache_dir: str) -> List[str]:
+    # small enough that entries are evicted while others read and write them
+    cache = OutputCache(Path(cache_dir), max_size=8 * 4096)
+    problems = []
+    for ndx in range(300):
+        key = _KEYS[ndx % len(_KEYS)]
+        content = key * 100
+        out = cache.get(key)
+        if out is not None and out != content:
+            problems.append(f"{key}: got {len(out)} chars")
+        cache.put(key, content)
+        if ndx % 25 == 0:
+            cache.prune()
+    return problems
+
+
+def test_output_cache_shared_between_processes(tmp_path):
+    with multiprocessing.Pool(4) as pool:
+        results = pool.map(_hammer_cache, [str(tmp_path)] * 8)
+    assert [p for problems in results for p in problems] == []
+    # no temporary files left behind
+    assert list(tmp_path.glob("??/.*")) == []
+    cache = OutputCache(tmp_path)
+    for key in _KEYS:
+        assert cache.get(key) in (None, key * 100)
@@ -0,0 +1,209 @@
+import signal
+import time
+from pathlib import Path
+
+import pytest
+
+from gcgen import generate
+from gcgen.api import generator, snippet
+from gcgen.limits import (
+    GeneratorLimitError,
+    Limits,
+    RunLimits,
+    SnippetLimitError,
+    Watchdog,
+)
+
+
+CONF = """\
+import asyncio
+import time
+from typing import List
+from gcgen.api import generator, snippet, Section, Scope, Json
+
+
+@snippet("spin", timeout=0.2)
+def _spin(s: Section, scope: Scope, arg: Json):
+    try:
+        while True:
+            pass
+    except Exception:
+        pass
+
+
+@snippet("hog", max_memory_mb=64)
+def _hog(s: Section, scope: Scope, arg: Json):
+    data = []
+    while True:
+        data.append(b"x" * (1024 * 1024))
+        time.sleep(0.001)
+
+
+@snippet("quick")
+def _quick(s: Section, scope: Scope, arg: Json):
+    s.emitln("done")
+
+
+@snippet("flood")
+def _flood(s: Section, scope: Scope, arg: Json):
+    while True:
+        s.emitln("spam")
+
+
+@snippet("burst")
+def _burst(s: Section, scope: Scope, arg: Json):
+    s.emit_lines(["x" * 100] * arg)
+
+
+@generator(timeout=0.2)
+def sleepy(scope: Scope):
+    time.sleep(10)
+
+
+@generator(timeout=0.2)
+async def async_sleepy(scope: Scope):
+    await asyncio.sleep(10)
+
+
+def gcgen_parse_files() -> List[str]:
+    return ["out.txt"]
+"""
+
+
+def _project(root: Path, body: str, generators: bool = False) -> None:
+    conf = CONF
+    if not generators:
+        conf = conf.replace("@generator(timeout=0.2)\n", "")
+    (root / "gcgen_project.ini").write_text("")
+    (root / "gcgen_conf.py").write_text(conf)
+    (root / "out.txt").write_text(body)
+
+
+def test_snippet_timeout(tmp_path):
+    root = tmp_path.resolve()
+    _project(root, "<<? quick ?>>\n<<? /quick ?>>\n<<? spin ?>>\n<<? /spin ?>>\n")
+    start = time.monotonic()
+    with pytest.raises(SnippetLimitError) as exc_info:
+        generate.compile(root, limits=RunLimits())
+    assert time.monotonic() - start < 5
+    e = exc_info.value
+    assert (e.name, str(e.file), e.limit) == ("spin", "out.txt", "time")
+    assert e.used >= 0.2
+
+
+def test_snippet_memory_cap(tmp_path):
+    root = tmp_path.resolve()
+    _project(root, "<<? hog ?>>\n<<? /hog ?>>\n")
+    with pytest.raises(SnippetLimitError) as exc_info:
+        generate.compile(root, limits=RunLimits())
+    assert exc_info.value.limit == "memory"
+    assert exc_info.value.used > 64 * 1024 * 1024
+
+
+def test_project_limits(tmp_path):
+    root = tmp_path.resolve()
+    _project(root, "<<? quick ?>>\n<<? /quick ?>>\n")
+    generate.compile(root, limits=RunLimits(snippet=Limits(timeout=5)))
+    assert (root / "out.txt").read_text() == "<<? quick ?>>\ndone\n<<? /quick ?>>\n"
+
+
+def test_generator_timeouts(tmp_path):
+    root = tmp_path.resolve()
+    _project(root, "", generators=True)
+    start = time.monotonic()
+    with pytest.raises(GeneratorLimitError) as exc_info:
+        generate.compile(root, limits=RunLimits())
+    # the blocking sleep on the main thread is interrupted after a grace period
+    assert time.monotonic() - start < 5
+    assert exc_info.value.name == "sleepy"
+
+
+def test_escalation_leaves_no_interrupt_behind():
+    wd = Watchdog(interval=0.01, grace=0.05)
+    prev = signal.getsignal(signal.SIGINT)
+    with pytest.raises(GeneratorLimitError):
+        wd.call(
+            Limits(timeout=0.05), GeneratorLimitError, "g", "f", lambda: time.sleep(5)
+        )
+    # no watch left behind to interrupt what follows
+    assert wd._watches == {}
+    time.sleep(0.1)
+    assert signal.getsignal(signal.SIGINT) is prev
+
+
+def test_late_escalation_sigint_ignored():
+    wd = Watchdog()
+    prev = signal.getsignal(signal.SIGINT)
+
+    def escalate_late() -> None:
+        # as if the SIGINT was sent just before the call ended
+        with wd._cond:
+            wd._sigints += 1
+
+    wd.call(Limits(timeout=5), GeneratorLimitError, "g", "f", escalate_late)
+    signal.raise_signal(signal.SIGINT)
+    assert signal.getsignal(signal.SIGINT) is prev
+    # a later Ctrl-C is not swallowed
+    with pytest.raises(KeyboardInterrupt):
+        signal.raise_signal(signal.SIGINT)
+
+
+def test_no_escalation():
+    wd = Watchdog(interval=0.01, grace=0.05, escalate=False)
+    prev = signal.getsignal(signal.SIGINT)
+    start = time.monotonic()
+    # blocked in C code on the main thread, only stops once the sleep ends
+    with pytest.raises(GeneratorLimitError):
+        wd.call(
+            Limits(timeout=0.05), GeneratorLimitError, "g", "f", lambda: time.sleep(0.5)
+        )
+    assert time.monotonic() - start >= 0.5
+    assert signal.getsignal(signal.SIGINT) is prev
+
+
+def test_async_generator_timeout(tmp_path):
+    root = tmp_path.resolve()
+    _project(root, "", generators=True)
+    (root / "gcgen_conf.py").write_text(
+        (root / "gcgen_conf.py").read_text().replace("time.sleep(10)", "pass")
+    )
+    with pytest.raises(GeneratorLimitError) as exc_info:
+        generate.compile(root, limits=RunLimits())
+    assert exc_info.value.name == "async_sleepy"
+
+
+def test_decorator_overrides():
+    @snippet("a", timeout=0)
+    def a(*_):
+        pass
+
+    @generator(max_memory_mb=1)
+    def b(_):
+        pass
+
+    project = Limits(timeout=10, max_memory=None)
+    assert not project.for_fn(a)
+    lim = project.for_fn(b)
+    assert (lim.timeout, lim.max_memory) == (10, 1024 * 1024)
+
+
+def test_snippet_output_caps(tmp_path):
+    root = tmp_path.resolve()
+    _project(root, "<<? flood ?>>\n<<? /flood ?>>\n")
+    limits = RunLimits(snippet=Limits(max_lines=10000))
+    start = time.monotonic()
+    with pytest.raises(SnippetLimitError) as exc_info:
+        generate.compile(root, limits=limits)
+    # rejected while still running
+    assert time.monotonic() - start < 5
+    e = exc_info.value
+    assert (e.name, e.limit, e.budget) == ("flood", "output lines", 10000)
+    assert e.used > 10000
+
+    # output emitted in between two checks of the watchdog
+    (root / "out.txt").write_text("<<? burst 3 ?>>\n<<? /burst ?>>\n")
+    limits = RunLimits(snippet=Limits(max_chars=250))
+    with pytest.raises(SnippetLimitError) as exc_info:
+        generate.compile(root, limits=limits)
+    assert (exc_info.value.limit, exc_info.value.used) == ("output chars", 300)
+    assert (root / "out.txt").read_text() == "<<? burst 3 ?>>\n<<? /burst ?>>\n"
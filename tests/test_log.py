@@ -0,0 +1,75 @@
+import json
+import logging
+from io import StringIO
+from pathlib import Path
+from gcgen import generate
+from gcgen.api import Section, Scope, Json, snippet
+from gcgen.log import JsonFormatter, log_to_file
+
+
+@snippet("hello")
+def _hello(s: Section, _: Scope, __: Json):
+    s.emitln("hello, world")
+
+
+def mk_parser(root: Path) -> generate.Parser:
+    snippets = Scope()
+    snippets["hello"] = _hello
+    indent_by = Scope()
+    indent_by[""] = " "
+    return generate.Parser("<<?", "?>>", Scope(), snippets, indent_by, root)
+
+
+def test_on_snippet_no_section_str_at_warning(monkeypatch, tmp_path):
+    """the generated section must not be stringified unless debug logging is on."""
+    calls = []
+
+    def section_str(self):
+        calls.append(self)
+        return ""
+
+    monkeypatch.setattr(Section, "__str__", section_str)
+    level = generate.logger.level
+    parser = mk_parser(tmp_path)
+    out = StringIO()
+    try:
+        generate.logger.setLevel(logging.WARNING)
+        parser.on_snippet("", "hello", None, tmp_path / "file.txt", out)
+        assert out.getvalue() == "hello, world\n"
+        assert calls == []
+
+        generate.logger.setLevel(logging.DEBUG)
+        parser.on_snippet("", "hello", None, tmp_path / "file.txt", out)
+        assert calls, "section should be stringified when debug logging is on"
+    finally:
+        generate.logger.setLevel(level)
+
+
+def test_json_formatter_includes_extra_fields():
+    record = logging.LogRecord(
+        "gcgen.test", logging.INFO, __file__, 1, "parsing %s", ("foo.txt",), None
+    )
+    record.event = "parse_file"
+    record.file = "foo.txt"
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["msg"] == "parsing foo.txt"
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "gcgen.test"
+    assert entry["event"] == "parse_file"
+    assert entry["file"] == "foo.txt"
+
+
+def test_log_to_file_json(tmp_path):
+    log_file = tmp_path / "log.jsonl"
+    logger = logging.getLogger("gcgen.test_log_to_file")
+    logger.setLevel(logging.INFO)
+    handler = log_to_file(log_file, json_format=True)
+    try:
+        logger.info("one", extra={"event": "first"})
+        logger.info("two %d", 2)
+    finally:
+        logging.getLogger().removeHandler(handler)
+        handler.close()
+    entries = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert [e["msg"] for e in entries] == ["one", "two 2"]
+    assert entries[0]["event"] == "first"
@@ -0,0 +1,85 @@
+import json
+import os
+from pathlib import Path
+from gcgen.api.models import ModelCache
+
+
+def test_load_model_once(tmp_path):
+    calls = []
+
+    def loader(p: Path):
+        calls.append(p)
+        return json.loads(p.read_text())
+
+    schema = tmp_path / "schema.json"
+    schema.write_text('{"a": 1}')
+    cache = ModelCache()
+    m1 = cache.load(schema, loader)
+    m2 = cache.load(str(schema), loader)
+    assert m1 == {"a": 1}
+    assert m1 is m2
+    assert len(calls) == 1
+
+
+def test_load_model_reloads_on_change(tmp_path):
+    schema = tmp_path / "schema.json"
+    schema.write_text('{"a": 1}')
+    cache = ModelCache()
+    assert cache.load(schema, lambda p: json.loads(p.read_text())) == {"a": 1}
+    schema.write_text('{"a": 22}')
+    assert cache.load(schema, lambda p: json.loads(p.read_text())) == {"a": 22}
+
+
+def _json_loader(p: Path):
+    _json_loader.calls += 1
+    return json.loads(p.read_text())
+
+
+_json_loader.calls = 0
+
+
+def test_load_model_persisted(tmp_path):
+    schema = tmp_path / "schema.json"
+    schema.write_text('{"a": 1}')
+    cache_dir = tmp_path / ".gcgen" / "models"
+
+    _json_loader.calls = 0
+    assert ModelCache(cache_dir).load(schema, _json_loader, persist=True) == {"a": 1}
+    # a new cache (i.e. a new run) reads the persisted model
+    assert ModelCache(cache_dir).load(schema, _json_loader, persist=True) == {"a": 1}
+    assert _json_loader.calls == 1
+
+    st = schema.stat()
+    schema.write_text('{"a": 2}')
+    os.utime(schema, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    assert ModelCache(cache_dir).load(schema, _json_loader, persist=True) == {"a": 2}
+    assert _json_loader.calls == 2
+
+
+def _define_loader(source: str):
+    """Define function `load` anew from `source`, as separate modules would."""
+    ns: dict = {"json": json, "Path": Path}
+    exec(source, ns)
+    return ns["load"]
+
+
+def test_load_model_shared_by_equivalent_define_loader(tmp_path):
+    schema = tmp_path / "schema.json"
+    schema.write_text('{"a": 1}')
+    src = "def load(p):\n    return json.loads(p.read_text())\n"
+    first, second = _define_loader(src), _define_loader(src)
+    assert first is not second
+    cache = ModelCache(root=tmp_path)
+    assert cache.load(schema, first) is cache.load(schema, second)
+
+
+def test_load_model_persisted_loader_changed(tmp_path):
+    schema = tmp_path / "schema.json"
+    schema.write_text('{"a": 1}')
+    cache_dir = tmp_path / ".gcgen" / "models"
+    old = _define_loader("def load(p):\n    return json.loads(p.read_text())\n")
+    new = _define_loader("def load(p):\n    return sorted(json.loads(p.read_text()))\n")
+    assert ModelCache(cache_dir, tmp_path).load(schema, old, persist=True) == {"a": 1}
+    # the persisted model of the old loader is not reused
+    assert ModelCache(cache_dir, tmp_path).load(schema, new, persist=True) == ["a"]
+    assert ModelCache(cache_dir, tmp_path).load(schema, old, persist=True) == {"a": 1}
@@ -5,6 +5,7 @@ from tempfile import NamedTemporaryFile
 from dataclasses import dataclass
 from typing import Optional
 from contextlib import contextmanager
+import pytest
 
 # one way to test
 # inherit from parser base, impl `on_snippet`
@@ -114,3 +115,131 @@ def test_prog_w_json_args():
                 args={"username": "jane", "groups": ["wheel", "docker"]},
             ),
         ]
+
+
+def test_prog_w_json_args_parsed_once():
+    """identical raw arguments are only parsed once"""
+    with tmpfile_of_str(prog_w_json_args + prog_w_json_args) as fpath:
+        parser = CapturingParser("<<?", "?>>")
+        parser.parse(fpath, fpath)
+        users = [r.args for r in parser._results if r.name == "mk_user"]
+        assert len(users) == 2
+        assert users[0] is users[1]
+
+
+def test_emitters_cached_per_suffix_and_prefix():
+    from gcgen.emitter import EmitterConfig
+    from gcgen.generate import Parser
+    from gcgen.scope import Scope
+
+    indent_by = Scope()
+    indent_by.update({"": "   ", "py": "    "})
+    parser = Parser(
+        "<<?",
+        "?>>",
+        Scope(),
+        Scope(),
+        indent_by,
+        Path(__file__).parent,
+        emit_configs={"c": EmitterConfig(indent_by=None, newline="\r\n")},
+    )
+    assert parser.emitter("py", "# ") is parser.emitter("py", "# ")
+    assert parser.emitter("py", "# ") is not parser.emitter("py", "")
+    assert parser.emit_config("py").indent_by == "    "
+    assert parser.emit_config("txt").indent_by == "   "
+    assert parser.emit_config("c").newline == "\r\n"
+    assert parser.emit_config("py").newline == "\n"
+
+
+def test_tag_set_multiple_pairs():
+    tags = snippetparser.TagSet([("<<?", "?>>"), ("{{%", "%}}"), ("{{", "}}")])
+    assert tags.find("no tags here") is None
+    assert tags.find("// <<? foo ?>>") == (3, 11, "<<?", "?>>")
+    # the longer start tag wins
+    assert tags.find("<!-- {{% foo %}} -->") == (5, 13, "{{%", "%}}")
+    assert tags.find("{{ foo }}") == (0, 7, "{{", "}}")
+    # start tag without end tag on the line
+    assert tags.find("{{% foo") is None
+
+    with pytest.raises(ValueError):
+        snippetparser.TagSet([("<<?", "?>>"), ("<<?", "!>>")])
+    with pytest.raises(ValueError):
+        snippetparser.TagSet([])
+
+
+prog_w_mixed_tags = """\
+<!-- {{% hello %}} -->
+<!-- {{% /hello %}} -->
+<<? ignored ?>>
+<<? /ignored ?>>
+# [[ world ]]
+# [[ /world ]]
+"""
+
+
+def test_tags_by_suffix():
+    parser = snippetparser.ParserBase(
+        "<<?", "?>>", {"html": [("{{%", "%}}"), ("[[", "]]")]}
+    )
+    with tmpfile_of_str(prog_w_mixed_tags) as fpath:
+        html = fpath.with_suffix(".html")
+        fpath.rename(html)
+        try:
+            with open(html) as fh:
+                assert [m.name for m in parser.scan(fh, html)] == ["hello", "world"]
+            with open(html) as fh:
+                assert [m.name for m in parser.scan(fh, fpath)] == ["ignored"]
+        finally:
+            html.unlink()
+
+
+def test_file_format_per_suffix(tmp_path):
+    from gcgen import generate
+    from gcgen.emitter import EmitterConfig
+    from gcgen.incremental import Incremental
+
+    root = tmp_path.resolve()
+    (root / "gcgen_project.ini").write_text("")
+    (root / "gcgen_conf.py").write_text(
+        "from gcgen.api import snippet\n"
+        "\n"
+        "@snippet('greet')\n"
+        "def _greet(s, scope, arg):\n"
+        "    s.emitln(f'Grüße, {arg}!')\n"
+        "\n"
+        "def gcgen_parse_files():\n"
+        "    return ['run.bat', 'legacy.txt']\n"
+    )
+    bat = b'@echo off\r\nrem <<? greet "Bob" ?>>\r\nrem <<? /greet ?>>\r\n'
+    (root / "run.bat").write_bytes(bat)
+    legacy = '# é\n<<? greet "Zoë" ?>>\n<<? /greet ?>>\n'
+    (root / "legacy.txt").write_bytes(legacy.encode("latin-1"))
+    emit_configs = {
+        "bat": EmitterConfig(indent_by=None, newline="\r\n"),
+        "txt": EmitterConfig(indent_by=None, encoding="latin-1"),
+    }
+
+    manifest = tmp_path / "manifest.json"
+    for skipped in (0, 2):
+        inc = Incremental.load(root, manifest)
+        generate.compile(root, incremental=inc, emit_configs=emit_configs)
+        inc.save(manifest)
+        # output read back compares equal to the output written
+        assert inc.skipped == skipped
+        # verbatim lines and snippet output alike use the file's line endings
+        assert (root / "run.bat").read_bytes() == (
+            b'@echo off\r\nrem <<? greet "Bob" ?>>\r\n'
+            b"Gr\xc3\xbc\xc3\x9fe, Bob!\r\nrem <<? /greet ?>>\r\n"
+        )
+        assert (root / "legacy.txt").read_bytes() == (
+            '# é\n<<? greet "Zoë" ?>>\nGrüße, Zoë!\n<<? /greet ?>>\n'.encode("latin-1")
+        )
+
+
+def test_scan_bodies_on_request():
+    parser = snippetparser.ParserBase("<<?", "?>>")
+    src = ["<<? foo ?>>\n", "line 1\n", "line 2\n", "<<? /foo ?>>\n"]
+    assert [m.body for m in parser.scan(src, Path("x.txt"))] == [[]]
+    assert [m.body for m in parser.scan(src, Path("x.txt"), bodies=True)] == [
+        ["line 1\n", "line 2\n"]
+    ]
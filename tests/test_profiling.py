@@ -0,0 +1,76 @@
+import json
+from pathlib import Path
+
+from gcgen import generate
+from gcgen.profiling import MemoryProfiler
+
+
+CONF = """\
+from typing import List
+from gcgen.api import generator, snippet, Section, Scope, Json
+
+
+@snippet("lines")
+def _lines(s: Section, scope: Scope, arg: Json):
+    for i in range(arg):
+        s.emitln(f"line {i}")
+
+
+@generator
+def big_temporary(scope: Scope):
+    data = bytearray(8 * 1024 * 1024)
+    del data
+
+
+def gcgen_parse_files() -> List[str]:
+    return ["out.txt"]
+"""
+
+
+def test_profile_memory(tmp_path):
+    root = tmp_path.resolve()
+    (root / "gcgen_project.ini").write_text("")
+    (root / "gcgen_conf.py").write_text(CONF)
+    (root / "out.txt").write_text("<<? lines 10000 ?>>\n<<? /lines ?>>\n")
+
+    profiler = MemoryProfiler(top=5)
+    generate.compile(root, profiler=profiler)
+
+    snippet, gen = profiler.records
+    assert (snippet.kind, snippet.name, snippet.file) == ("snippet", "lines", "out.txt")
+    # the section holding the lines is still alive once the snippet returns
+    assert snippet.retained > 100_000
+    assert snippet.peak >= snippet.retained
+    assert snippet.sites and snippet.sites[0][1] > 0
+    assert snippet.lines == 10000
+
+    assert (gen.kind, gen.name, gen.file) == (
+        "generator",
+        "big_temporary",
+        "gcgen_conf.py",
+    )
+    assert gen.peak >= 8 * 1024 * 1024
+    assert gen.retained < 1024 * 1024
+    assert gen.lines is None
+    assert profiler.high_water >= gen.peak
+
+    report = profiler.report()
+    assert "big_temporary (gcgen_conf.py)" in report
+    assert "Run high-water mark" in report
+    profiler.save(root / "profile.json")
+    data = json.loads((root / "profile.json").read_text())
+    assert [c["name"] for c in data["calls"]] == ["lines", "big_temporary"]
+
+
+def test_profile_memory_without_sites(tmp_path):
+    root = tmp_path.resolve()
+    (root / "gcgen_project.ini").write_text("")
+    (root / "gcgen_conf.py").write_text(CONF)
+    (root / "out.txt").write_text("<<? lines 100 ?>>\n<<? /lines ?>>\n")
+
+    profiler = MemoryProfiler()
+    generate.compile(root, profiler=profiler)
+    snippet, gen = profiler.records
+    # sites are opt-in, the allocations are measured regardless
+    assert snippet.sites == [] and gen.sites == []
+    assert gen.peak >= 8 * 1024 * 1024
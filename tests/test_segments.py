@@ -0,0 +1,110 @@
+import io
+from pathlib import Path
+
+from gcgen import generate
+from gcgen.snippetparser import ParserBase
+from gcgen.segments import SegmentStore, decode_lines, scan_segments
+from test_gentests import load_gentest
+
+
+def test_segments_resplice_unchanged_files(tmp_path):
+    with load_gentest("bb-snippets-mod-file-scope") as gtc:
+        root = gtc.input_path.resolve()
+        fpath = root / "greetings.txt"
+        store_path = tmp_path / "segments.json"
+        expected = (gtc.expected_path / "greetings.txt").read_text()
+
+        store = SegmentStore.load(root, store_path)
+        assert store.lookup(fpath) is None
+        generate.compile(root, segments=store)
+        store.save(store_path)
+        assert fpath.read_text() == expected
+
+        # the model is valid for the file just written, and matches the model
+        # obtained by scanning it.
+        store = SegmentStore.load(root, store_path)
+        model = store.lookup(fpath)
+        assert model is not None
+        scanned = scan_segments(fpath, ParserBase("<<?", "?>>"))
+        assert [s.to_json() for s in model.segments] == [
+            s.to_json() for s in scanned.segments
+        ]
+        assert [s.name for s in model.snippets()] == ["greet", "modify-scope", "greet"]
+
+        # re-splicing by offset produces the same output
+        generate.compile(root, segments=store)
+        assert fpath.read_text() == expected
+        assert store.lookup(fpath) is not None
+
+        # hand-edited files are scanned again
+        fpath.write_text("header\n" + fpath.read_text().replace("Jane", "Janet"))
+        assert store.lookup(fpath) is None
+        generate.compile(root, segments=store)
+        assert fpath.read_text() == "header\n" + expected
+
+
+def test_segments_discarded_on_tag_change(tmp_path):
+    root = tmp_path.resolve()
+    fpath = root / "f.txt"
+    fpath.write_text("a\n<<? s ?>>\nbody\n<<? /s ?>>\nb\n")
+    store = SegmentStore(root, tags="x")
+    store.files["f.txt"] = scan_segments(fpath, ParserBase("<<?", "?>>"))
+    store.save(root / "segments.json")
+
+    assert SegmentStore.load(root, root / "segments.json", "x").lookup(fpath)
+    assert SegmentStore.load(root, root / "segments.json", "y").files == {}
+
+
+def test_scan_segments_offsets(tmp_path):
+    fpath = tmp_path / "f.txt"
+    data = "a\n<<? s {} ?>>\nbody\n<<? /s ?>>\nb"
+    fpath.write_text(data)
+    model = scan_segments(fpath, ParserBase("<<?", "?>>"))
+    raw = fpath.read_bytes()
+    verbatim, snippet, end = model.segments
+    assert raw[verbatim.start : verbatim.end] == b"a\n<<? s {} ?>>\n"
+    assert (snippet.name, snippet.raw_arg) == ("s", "{} ")
+    assert (snippet.line_start, snippet.line_end) == (2, 4)
+    assert raw[snippet.start : snippet.end] == b"body\n"
+    assert raw[snippet.end : snippet.end_line_end] == b"<<? /s ?>>\n"
+    assert raw[end.start : end.end] == b"b"
+
+
+def test_store_lines_universal_newlines(tmp_path):
+    data = b"a\r\nb\rc\nd"
+    lines = list(SegmentStore(tmp_path).lines(io.BytesIO(data)))
+    assert lines == ["a\n", "b\n", "c\n", "d"]
+    assert lines == list(decode_lines(data))
+
+
+def test_segments_crlf_files(tmp_path):
+    from gcgen.emitter import EmitterConfig
+
+    root = tmp_path.resolve()
+    (root / "gcgen_project.ini").write_text("")
+    (root / "gcgen_conf.py").write_text(
+        "from gcgen.api import snippet\n"
+        "\n"
+        "@snippet('greet')\n"
+        "def _greet(s, scope, arg):\n"
+        "    s.emitln(f'Hello, {arg}!')\n"
+        "\n"
+        "def gcgen_parse_files():\n"
+        "    return ['run.bat']\n"
+    )
+    fpath = root / "run.bat"
+    fpath.write_bytes(b'@echo off\r\n<<? greet "Bob" ?>>\r\n<<? /greet ?>>\r\n')
+    emit_configs = {"bat": EmitterConfig(indent_by=None, newline="\r\n")}
+    expected = b'@echo off\r\n<<? greet "Bob" ?>>\r\nHello, Bob!\r\n<<? /greet ?>>\r\n'
+
+    store = SegmentStore(root)
+    generate.compile(root, segments=store, emit_configs=emit_configs)
+    assert fpath.read_bytes() == expected
+    # offsets are those of the bytes written
+    model = store.lookup(fpath)
+    assert model is not None
+    (snippet,) = model.snippets()
+    assert fpath.read_bytes()[snippet.start : snippet.end] == b"Hello, Bob!\r\n"
+
+    generate.compile(root, segments=store, emit_configs=emit_configs)
+    assert fpath.read_bytes() == expected
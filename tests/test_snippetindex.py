@@ -0,0 +1,88 @@
+from gcgen import generate
+from gcgen.snippetindex import SnippetIndex, body_hash
+from test_gentests import load_gentest
+
+
+def test_build_index_callers():
+    with load_gentest("bb-snippets-nested") as gtc:
+        index = generate.build_index(gtc.input_path)
+        assert index.callers("foo") == [
+            ("inner/innerfile.txt", 5),
+            ("outerfile.txt", 5),
+        ]
+        assert index.callers("bar") == [
+            ("inner/innerfile.txt", 9),
+            ("outerfile.txt", 9),
+        ]
+        assert index.callers("nope") == []
+        entry = index.files["outerfile.txt"]
+        assert [c.raw_arg for c in entry.calls] == ["", ""]
+        assert entry.calls[0].body_hash == body_hash([])
+
+
+def test_index_save_load(tmp_path):
+    with load_gentest("bb-snippets-nested") as gtc:
+        root = gtc.input_path.resolve()
+        index = generate.build_index(root)
+        index.save(tmp_path / "index.json")
+        loaded = SnippetIndex.load(root, tmp_path / "index.json")
+        assert loaded.callers("foo") == index.callers("foo")
+        assert loaded.lookup(root / "outerfile.txt") is not None
+
+        # changing the file invalidates its entry
+        with open(root / "outerfile.txt", "a") as fh:
+            fh.write("more\n")
+        assert loaded.lookup(root / "outerfile.txt") is None
+
+    assert SnippetIndex.load(tmp_path, tmp_path / "missing.json").files == {}
+
+
+def test_compile_with_index_skips_untagged_files():
+    with load_gentest("dd-index-skip-untagged") as gtc:
+        root = gtc.input_path.resolve()
+        index = generate.build_index(root)
+        assert index.has_no_snippets(root / "untagged.txt")
+        assert not index.has_no_snippets(root / "tagged.txt")
+
+        inode = (root / "untagged.txt").stat().st_ino
+        generate.compile(root, index=index)
+        # untouched, not replaced by a regenerated copy
+        assert (root / "untagged.txt").stat().st_ino == inode
+        assert (root / "tagged.txt").read_text() == (
+            gtc.expected_path / "tagged.txt"
+        ).read_text()
+        # index is kept up-to-date for parsed files
+        entry = index.lookup(root / "tagged.txt")
+        assert entry is not None
+        assert entry.calls[0].body_hash == body_hash(["hello!\n"])
+
+
+def test_compile_records_calls_as_scanned():
+    """calls recorded while parsing match those found scanning the output"""
+    with load_gentest("bb-snippets-nested") as gtc:
+        root = gtc.input_path.resolve()
+        index = SnippetIndex(root)
+        generate.compile(root, index=index)
+        scanned = generate.build_index(root)
+        assert set(index.files) == set(scanned.files)
+        for key, entry in scanned.files.items():
+            # entries are up-to-date, none were scanned again
+            assert index.lookup(root / key) is index.files[key]
+            assert index.files[key].calls == entry.calls
+
+
+def test_compile_with_index_symlink_outside_project(tmp_path):
+    root = tmp_path / "proj"
+    root.mkdir()
+    (tmp_path / "outside.txt").write_text("no snippets\n")
+    (root / "gcgen_project.ini").write_text("")
+    (root / "gcgen_conf.py").write_text(
+        "def gcgen_parse_files():\n    return ['f.txt']\n"
+    )
+    (root / "f.txt").symlink_to(tmp_path / "outside.txt")
+    index = SnippetIndex(root)
+    # the resolved file is outside of the project, it is parsed but not indexed
+    generate.compile(root, index=index)
+    generate.build_index(root, index=index)
+    assert index.files == {}
+    assert (tmp_path / "outside.txt").read_text() == "no snippets\n"
@@ -0,0 +1,167 @@
+from pathlib import Path
+
+import pytest
+
+from gcgen import generate
+from gcgen.segments import SegmentStore
+from gcgen.snippetindex import SnippetIndex
+from gcgen.transaction import Transaction, TransactionCommitError
+
+
+CONF = """\
+from typing import List
+from gcgen.api import snippet, Section, Scope, Json
+
+
+@snippet("greet")
+def _greet(s: Section, scope: Scope, arg: Json):
+    s.emitln(f"Hello, {arg}!")
+
+
+def gcgen_parse_files() -> List[str]:
+    return ["out.txt"]
+"""
+
+SUB_CONF = """\
+from gcgen.api import generator, write_file
+
+
+@generator
+def gen_file(scope):
+    with write_file("gen.txt") as s:
+        s.emitln("generated")
+    if {fail}:
+        raise RuntimeError("fail")
+"""
+
+ORIGINAL = '<<? greet "Bob" ?>>\n<<? /greet ?>>\n'
+
+
+def _project(root: Path, fail: bool) -> None:
+    (root / "gcgen_project.ini").write_text("")
+    (root / "gcgen_conf.py").write_text(CONF)
+    (root / "out.txt").write_text(ORIGINAL)
+    (root / "sub").mkdir()
+    (root / "sub" / "gcgen_conf.py").write_text(SUB_CONF.format(fail=fail))
+
+
+def _files(root: Path):
+    return sorted(
+        str(p.relative_to(root))
+        for p in root.rglob("*")
+        if p.is_file() and "__pycache__" not in p.parts
+    )
+
+
+def test_transactional_run_failure_leaves_project_untouched(tmp_path):
+    root = tmp_path.resolve()
+    _project(root, fail=True)
+    before = _files(root)
+    with pytest.raises(generate.CompileGeneratorFunctionError):
+        generate.compile(root, transactional=True)
+    assert (root / "out.txt").read_text() == ORIGINAL
+    assert _files(root) == before
+
+
+def test_transactional_run_commits_all_files(tmp_path):
+    root = tmp_path.resolve()
+    _project(root, fail=False)
+    generate.compile(root, transactional=True)
+    assert (root / "out.txt").read_text() == (
+        '<<? greet "Bob" ?>>\nHello, Bob!\n<<? /greet ?>>\n'
+    )
+    assert (root / "sub" / "gen.txt").read_text() == "generated\n"
+    assert not [f for f in _files(root) if f.endswith((".tmp", ".bak"))]
+
+
+def test_transactional_run_keeps_segment_models(tmp_path):
+    root = tmp_path.resolve()
+    _project(root, fail=False)
+    store = SegmentStore(root)
+    generate.compile(root, transactional=True, segments=store)
+    # recorded from the staged file, valid once it was put in place
+    assert store.lookup(root / "out.txt") is not None
+
+
+def test_transactional_run_failure_drops_segment_models(tmp_path):
+    root = tmp_path.resolve()
+    _project(root, fail=False)
+    # fails once `out.txt` was parsed (and its file staged)
+    with open(root / "gcgen_conf.py", "a") as fh:
+        fh.write(SUB_CONF.format(fail=True))
+    store = SegmentStore(root)
+    with pytest.raises(generate.CompileGeneratorFunctionError):
+        generate.compile(root, transactional=True, segments=store)
+    assert (root / "out.txt").read_text() == ORIGINAL
+    assert store.files == {}
+
+
+GEN_PARSED_CONF = """\
+from gcgen.api import generator, write_file
+
+
+@generator
+def gen_out(scope):
+    with write_file("../out.txt") as s:
+        s.emitln('<<? greet "Jane" ?>>')
+        s.emitln("<<? /greet ?>>")
+"""
+
+
+@pytest.mark.parametrize("use_index", [False, True])
+def test_transactional_run_parses_staged_file(tmp_path, caplog, use_index):
+    root = tmp_path.resolve()
+    _project(root, fail=False)
+    (root / "sub" / "gcgen_conf.py").write_text(GEN_PARSED_CONF)
+    index = SnippetIndex(root) if use_index else None
+    if index is not None:
+        # indexed before the generator wrote the file
+        (root / "out.txt").write_text("old\n")
+        generate.compile(root, index=index)
+    # the generator (in `sub`) runs before `out.txt` is parsed
+    generate.compile(root, transactional=True, index=index)
+    assert (root / "out.txt").read_text() == (
+        '<<? greet "Jane" ?>>\nHello, Jane!\n<<? /greet ?>>\n'
+    )
+    assert "more than once" not in caplog.text
+    assert not [f for f in _files(root) if f.endswith((".tmp", ".bak"))]
+
+
+def test_staged_twice_warns(tmp_path, caplog):
+    dst = tmp_path / "a.txt"
+    txn = Transaction()
+    for n in range(2):
+        tmp = tmp_path / f"a.txt.{n}.tmp"
+        tmp.write_text(f"{n}\n")
+        txn.replace_file(tmp, dst)
+    assert "written more than once" in caplog.text
+    assert not (tmp_path / "a.txt.0.tmp").exists()
+
+    # rewriting the staged contents after reading them is expected
+    caplog.clear()
+    with open(txn.current(dst)) as fh:
+        (tmp_path / "a.txt.2.tmp").write_text(fh.read() + "2\n")
+    txn.replace_file(tmp_path / "a.txt.2.tmp", dst)
+    assert "more than once" not in caplog.text
+    txn.commit()
+    assert dst.read_text() == "1\n2\n"
+
+
+def test_commit_failure_rolls_back(tmp_path):
+    a, b = tmp_path / "a.txt", tmp_path / "sub" / "b.txt"
+    b.parent.mkdir()
+    a.write_text("old a\n")
+    txn = Transaction()
+    for dst, text in ((a, "new a\n"), (b, "new b\n")):
+        tmp = dst.parent / (dst.name + ".tmp")
+        tmp.write_text(text)
+        txn.replace_file(tmp, dst)
+    # the target directory of the second file vanishes before commit
+    (b.parent / "b.txt.tmp").unlink()
+    b.parent.rmdir()
+
+    with pytest.raises(TransactionCommitError) as exc_info:
+        txn.commit()
+    assert exc_info.value.restored == 1
+    assert a.read_text() == "old a\n"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.txt"]
@@ -386,3 +386,127 @@ def test_transform_handler_cannot_be_wrapped():
 
     t = Transformer()
     assert t.transform(B("b1")) == B("b1")
+
+
+class Opaque:
+    def __init__(self, label: str):
+        self.label = label
+
+
+def test_memo_transform_reuses_results():
+    """
+    Test that structurally identical subtrees are only transformed once.
+    """
+    calls = []
+
+    class Transformer(MemoNodeTransformer):
+        @on_transform(A)
+        def transform_a(self, node: A) -> Any:
+            return AA(elems=[self.transform(e) for e in node.elems])
+
+        @on_transform(B)
+        def transform_b(self, node: B) -> Any:
+            calls.append(node.label)
+            return BB(label=node.label)
+
+        @on_transform(C)
+        def transform_c(self, node: C) -> Any:
+            return CC(label=node.label)
+
+    t = Transformer()
+    tree = A(elems=[B("b1"), B("b1"), A(elems=[B("b1"), B("b2")])])
+    expected = AA(elems=[BB("b1"), BB("b1"), AA(elems=[BB("b1"), BB("b2")])])
+    assert t.transform(tree) == expected
+    assert calls == ["b1", "b2"]
+
+    # changing one subtree only re-transforms that subtree
+    calls.clear()
+    tree.elems[2].elems[1] = B("b3")
+    assert t.transform(tree).elems[2] == AA(elems=[BB("b1"), BB("b3")])
+    assert calls == ["b3"]
+
+
+def test_memo_transform_unhashable_not_memoized():
+    """
+    Test that nodes which cannot be hashed are transformed on every call.
+    """
+    calls = []
+
+    class Transformer(MemoNodeTransformer):
+        @on_transform(Opaque)
+        def transform_opaque(self, node: Opaque) -> Any:
+            calls.append(node.label)
+            return B(node.label)
+
+    t = Transformer()
+    assert t.node_hash(Opaque("o")) is None
+    assert t.transform(Opaque("o")) == B("o")
+    assert t.transform(Opaque("o")) == B("o")
+    assert calls == ["o", "o"]
+
+
+def test_memo_transform_on_hash():
+    """
+    Test that `on_hash` handlers allow memoizing custom node types.
+    """
+    calls = []
+
+    class Transformer(MemoNodeTransformer):
+        @on_hash(Opaque)
+        def hash_opaque(self, node: Opaque) -> Any:
+            return node.label
+
+        @on_transform(Opaque)
+        def transform_opaque(self, node: Opaque) -> Any:
+            calls.append(node.label)
+            return B(node.label)
+
+    t = Transformer()
+    assert t.node_hash(Opaque("o")) == t.node_hash(Opaque("o"))
+    assert t.node_hash(Opaque("o")) != t.node_hash(Opaque("p"))
+    assert t.transform(Opaque("o")) == B("o")
+    assert t.transform(Opaque("o")) == B("o")
+    assert calls == ["o"]
+
+
+def test_memo_transform_save_load(tmp_path):
+    """
+    Test that a persisted memo table is reused by a new transformer instance
+    and ignored if the memo version changes.
+    """
+    calls = []
+
+    class Transformer(MemoNodeTransformer):
+        @on_transform(B)
+        def transform_b(self, node: B) -> Any:
+            calls.append(node.label)
+            return node.label.upper()
+
+    memo_file = tmp_path / "memo.pickle"
+    t1 = Transformer()
+    assert t1.transform(B("b1")) == "B1"
+    t1.save_memo(memo_file)
+
+    t2 = Transformer()
+    assert t2.load_memo(memo_file)
+    assert t2.transform(B("b1")) == "B1"
+    assert calls == ["b1"]
+
+    class TransformerV2(Transformer):
+        memo_version = "2"
+
+    t3 = TransformerV2()
+    assert not t3.load_memo(memo_file)
+    assert not t3.load_memo(tmp_path / "missing.pickle")
+
+
+def test_memo_node_hash_outside_transform():
+    """
+    Test that hashing a node outside of `transform` keeps no stale digest.
+    """
+    t = MemoNodeTransformer()
+    node = B("b1")
+    before = t.node_hash(node)
+    assert not t._digests
+    node.label = "b2"
+    assert t.node_hash(node) != before
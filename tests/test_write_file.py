@@ -0,0 +1,67 @@
+import os
+
+from gcgen.api import write_file
+from gcgen.durability import Durability, set_durability
+import pytest
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_write_file(tmp_path, stream):
+    fpath = tmp_path / "out.txt"
+    with write_file(fpath, indent_by="  ", stream=stream) as s:
+        s.emitln("one").indent()
+        s.emitln("two").dedent()
+    assert fpath.read_text() == "one\n  two\n"
+    assert list(tmp_path.iterdir()) == [fpath]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_write_file_error_leaves_file_untouched(tmp_path, stream):
+    fpath = tmp_path / "out.txt"
+    fpath.write_text("original\n")
+    with pytest.raises(RuntimeError):
+        with write_file(fpath, stream=stream) as s:
+            for i in range(10000):
+                s.emitln(f"line {i}")
+            raise RuntimeError("fail")
+    assert fpath.read_text() == "original\n"
+    assert list(tmp_path.iterdir()) == [fpath]
+
+
+@pytest.mark.parametrize(
+    "mode, synced_before_end, synced_total",
+    [("none", 0, 0), ("file", 4, 4), ("batched", 0, 3)],
+)
+def test_write_file_durability(
+    tmp_path, monkeypatch, mode, synced_before_end, synced_total
+):
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: synced.append(fd) or fsync(fd))
+    durability = Durability(mode)
+    prev = set_durability(durability)
+    try:
+        for name in ("a.txt", "b.txt"):
+            with write_file(tmp_path / name) as s:
+                s.emitln(name)
+        assert len(synced) == synced_before_end
+        durability.sync()
+    finally:
+        set_durability(prev)
+    # batched: each file, then the directory once
+    assert len(synced) == synced_total
+    assert (tmp_path / "b.txt").read_text() == "b.txt\n"
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_write_file_encoding_and_newline(tmp_path, stream):
+    fpath = tmp_path / "out.txt"
+    with write_file(fpath, stream=stream, encoding="latin-1", newline="\r\n") as s:
+        s.emitln("café").indent()
+        s.emitln("crème")
+    assert fpath.read_bytes() == b"caf\xe9\r\n cr\xe8me\r\n"
+
+    with pytest.raises(UnicodeEncodeError):
+        with write_file(fpath, stream=stream, encoding="ascii") as s:
+            s.emitln("café")
+    assert list(tmp_path.iterdir()) == [fpath]